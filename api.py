@@ -5,6 +5,7 @@ load_dotenv("conf/.env")
 
 import atexit
 import json
+import math
 import os
 import traceback
 from datetime import datetime
@@ -17,22 +18,31 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from flask import Flask, request, jsonify
 
-from biz.queue.worker import handle_merge_request_event, handle_push_event, handle_github_pull_request_event, \
-    handle_github_push_event, handle_gitea_pull_request_event, handle_gitea_push_event
-from biz.coding.webhook_handler import handle_coding_pull_request_event, handle_coding_push_event
-from biz.git_provider.manager import GitProviderManager
-from biz.git_provider.parsers import gitlab_parser, github_parser, gitea_parser, coding_parser
-import importlib
+from biz.git_provider.manager import GitProviderManager, PROJECT_SETTINGS_EVENT, token_ref
+from biz.git_provider.parsers import summarize_payload
+from biz.queue.debounce import review_debouncer, review_project
+from biz.queue.fair import lane_for_event
+from biz.queue.metrics import queue_metrics, render_prometheus
+from biz.queue.pool import QueueFullError
+from biz.queue.sqlite_queue import load_function
+from biz.service.admission_service import admission_controller, Rejection
+from biz.service.dedup_service import webhook_deduplicator
+from biz.service.job_ledger import job_ledger
+from biz.service.outbox_service import note_outbox, NoteOutboxDispatcher
 from biz.service.review_service import ReviewService
 from biz.utils.im import notifier
+from biz.utils.leader import LeaderElector
 from biz.utils.log import logger
-from biz.utils.queue import handle_queue
+from biz.utils.queue import handle_queue, start_workers, stop_workers
 from biz.utils.reporter import Reporter
+from biz.utils.server import run_gunicorn
 from biz.utils.html_reporter import HTMLReporter
 
 from biz.utils.config_checker import check_config
 
 api_app = Flask(__name__)
+# 超过大小限制的请求体(包括未声明Content-Length的分块请求)直接返回413
+api_app.config['MAX_CONTENT_LENGTH'] = admission_controller.max_body_bytes
 
 # 初始化GitProviderManager
 git_provider_manager = GitProviderManager()
@@ -111,6 +121,20 @@ def daily_report_task():
         return {'message': f"Failed to generate daily report: {e}", 'success': False}
 
 
+def retry_failed_jobs():
+    """
+    将任务台账中退避时间已到的失败任务通过队列重新入队
+    """
+    def enqueue(job: dict):
+        handle_queue(load_function(job['function']), job['payload'], job['token'], job['url'], job['url_slug'],
+                     lane=lane_for_event(job['event_type']), project=job['project'])
+
+    try:
+        job_ledger.retry_due(enqueue)
+    except Exception as e:
+        logger.error(f"Failed to retry failed jobs: {e}")
+
+
 def setup_scheduler():
     """
     配置并启动定时任务调度器
@@ -135,132 +159,184 @@ def setup_scheduler():
             )
         )
 
+        # 失败任务的重试由主进程统一重新入队，不在worker中等待
+        if job_ledger.enabled:
+            scheduler.add_job(retry_failed_jobs, trigger='interval',
+                              seconds=int(os.getenv('JOB_RETRY_INTERVAL', 30)))
+
         # Start the scheduler
         scheduler.start()
         logger.info("Scheduler started successfully.")
-
-        # Shut down the scheduler when exiting the app
-        atexit.register(lambda: scheduler.shutdown())
+        return scheduler
     except Exception as e:
         logger.error(f"Error setting up scheduler: {e}")
         logger.error(traceback.format_exc())
+        return None
+
+
+def setup_scheduler_leader():
+    """
+    多进程、多节点部署时通过主节点选举保证只有一个进程运行定时任务，避免重复发送日报
+    """
+    scheduler = None
+
+    def on_elected():
+        nonlocal scheduler
+        scheduler = setup_scheduler()
+
+    def on_lost():
+        nonlocal scheduler
+        if scheduler is not None and scheduler.running:
+            scheduler.shutdown(wait=False)
+            logger.info("Scheduler stopped.")
+        scheduler = None
+
+    elector = LeaderElector('scheduler', on_elected=on_elected, on_lost=on_lost)
+    elector.start()
+    atexit.register(elector.stop)
+
+
+def start_background_services():
+    """
+    启动后台服务，多进程模式下在每个worker进程启动后调用
+    """
+    # 启动并预热async模式的review进程池
+    start_workers()
+    # 启动定时任务调度器(仅选举出的主进程)
+    setup_scheduler_leader()
+    # 启动review评论发件箱的发送线程，发件箱按租约领取记录，多个进程同时发送不会重复
+    setup_note_outbox()
+
+
+def stop_background_services(timeout: float):
+    """
+    worker进程退出前调用：等待进程池中执行中的review完成，最多等待 timeout 秒
+    """
+    stop_workers(timeout)
+
+
+def setup_note_outbox():
+    """
+    开启 NOTE_OUTBOX_ENABLED 时启动发件箱发送线程，review worker 写入的评论由该线程异步发表
+    """
+    if not note_outbox.enabled:
+        return
+    dispatcher = NoteOutboxDispatcher(note_outbox)
+    dispatcher.start()
+    atexit.register(dispatcher.stop)
+
+
+def reject_webhook(rejection: Rejection):
+    logger.warn(f"Webhook rejected from {request.remote_addr}: {rejection.status} {rejection.message}")
+    response = jsonify({'error': rejection.message})
+    if rejection.retry_after:
+        response.headers['Retry-After'] = str(math.ceil(rejection.retry_after))
+    return response, rejection.status
 
 
 # 处理 GitLab Merge Request Webhook
 @api_app.route('/review/webhook', methods=['POST'])
 def handle_webhook():
-    # 获取请求的JSON数据
+    # 快速路径：只解析路由所需的信息，原始请求体直接入队，日志只记录有限长度的摘要
     if not request.is_json:
         return jsonify({'message': 'Invalid data format'}), 400
-    data = request.get_json()
-    if not data:
-        return jsonify({"error": "Invalid JSON"}), 400
-
-    # logger.info(f"Received webhook headers: {request.headers}")
-    logger.info(f"Received webhook data: {data}")
-    # 识别Git提供方
-    provider_config = git_provider_manager.identify_provider(request.headers)
-
-    if not provider_config:
+    # 准入控制：大小、来源限流、队列积压和签名都在解析JSON之前检查
+    rejection = admission_controller.check_body_size(request.content_length)
+    if rejection:
+        return reject_webhook(rejection)
+
+    # 通过预编译的分发表识别Git提供方、事件类型及对应的解析器和处理函数
+    route = git_provider_manager.route(request.headers)
+    if not route:
         logger.error(f"Unknown Git provider or unsupported webhook event")
         return jsonify({"error": "Unknown Git provider or unsupported webhook event"}), 400
 
-    provider_name = provider_config["name"]
+    provider_name = route.provider.name
+    if not route.handler:
+        logger.error(f"Unsupported event type: {route.original_event_type} for {provider_name}")
+        return jsonify({"error": f"Unsupported event type: {route.original_event_type} for {provider_name}"}), 400
+
+    rejection = admission_controller.check_rate(request.remote_addr or '') or \
+        (route.event_type != PROJECT_SETTINGS_EVENT and admission_controller.check_queue(route.event_type))
+    if rejection:
+        return reject_webhook(rejection)
+
+    raw_body = request.get_data()
+    rejection = admission_controller.check_signature(provider_name, request.headers, raw_body)
+    if rejection:
+        return reject_webhook(rejection)
+
+    try:
+        data = json.loads(raw_body)
+    except ValueError:
+        data = None
+    if not data or not isinstance(data, dict):
+        return jsonify({"error": "Invalid JSON"}), 400
+
     # 获取访问令牌
-    access_token = git_provider_manager.get_access_token(provider_config, request.headers)
+    access_token = route.provider.access_token()
     if not access_token:
         logger.error(f"Missing {provider_name} access token")
         return jsonify({'message': f'Missing {provider_name} access token'}), 400
 
-    # 获取原始事件类型
-    original_event_type = None
-    for header_name, expected_values in provider_config["identification"]["headers"].items():
-        original_event_type = request.headers.get(header_name)
-        if original_event_type:
-            break
-
-    if not original_event_type:
-        logger.error(f"Could not determine original event type from headers")
-        return jsonify({"error": "Could not determine original event type"}), 400
-
-    # 映射到内部事件类型
-    event_type = git_provider_manager.get_event_mapping(provider_config, original_event_type)
-    if not event_type:
-        logger.error(f"Unsupported event type: {original_event_type} for {provider_name}")
-        return jsonify({"error": f"Unsupported event type: {original_event_type} for {provider_name}"}), 400
-
-    # 动态加载并调用payload解析器
-    parser_path = git_provider_manager.get_payload_parser_path(provider_config)
-    if not parser_path:
-        logger.error(f"No payload parser defined for {provider_name}")
-        return jsonify({"error": f"No payload parser defined for {provider_name}"}), 400
-
     try:
-        module_name, func_name = parser_path.rsplit('.', 1)
-        parser_module = importlib.import_module(module_name)
-        parser_func = getattr(parser_module, func_name)
-    except (ImportError, AttributeError) as e:
-        logger.error(f"Failed to load parser for {provider_name}: {e}")
-        return jsonify({"error": f"Failed to load parser for {provider_name}: {e}"}), 500
-
-    try:
-        # 根据不同的解析器函数签名传递参数
-        if provider_name == "github":
-            webhook_event = parser_func(data, access_token, os.getenv('GITHUB_URL'), event_type)
-        elif provider_name == "gitea":
-            webhook_event = parser_func(data, access_token, os.getenv('GITEA_URL'), event_type)
-        elif provider_name == "gitlab":
-            webhook_event = parser_func(data, access_token, os.getenv('GITLAB_URL'))
-        elif provider_name == "coding":
-            webhook_event = parser_func(data, access_token, os.getenv('CODING_URL'), event_type)
-        else:
-            # 对于自定义提供方，可能需要更通用的解析器，或者在配置中指定所有必要参数
-            webhook_event = parser_func(data, access_token, os.getenv(f'{provider_name.upper()}_URL'), event_type)
-
+        webhook_event = route.provider.parse(data, access_token, route.event_type)
     except ValueError as e:
         logger.error(f"Error parsing payload for {provider_name}: {e}")
         return jsonify({"error": str(e)}), 400
 
-    logger.info(f'Received {provider_name} event: {webhook_event.event_type}')
-    logger.info(f'Payload: {json.dumps(data)}')
-
-    # 根据事件类型调用相应的处理函数
-    if webhook_event.event_type == "pull_request":
-        if provider_name == "github":
-            handle_queue(handle_github_pull_request_event, webhook_event.payload, webhook_event.token, webhook_event.url, webhook_event.url_slug)
-        elif provider_name == "gitea":
-            handle_queue(handle_gitea_pull_request_event, webhook_event.payload, webhook_event.token, webhook_event.url, webhook_event.url_slug)
-        elif provider_name == "gitlab":
-            handle_queue(handle_merge_request_event, webhook_event.payload, webhook_event.token, webhook_event.url, webhook_event.url_slug)
-        elif provider_name == "coding":
-            # 假设 Coding 的 pull request 事件由 handle_coding_pull_request_event 处理
-            # 你需要创建 handle_coding_pull_request_event 函数
-            handle_queue(handle_coding_pull_request_event, webhook_event.payload, webhook_event.token, webhook_event.url, webhook_event.url_slug)
-        else:
-            logger.error(f"Unsupported pull_request event for {provider_name}")
-            # 对于自定义提供方，需要一个通用的pull request处理函数
-            return jsonify({"error": f"Unsupported pull_request event for {provider_name}"}), 400
-    elif webhook_event.event_type == "push":
-        if provider_name == "github":
-            handle_queue(handle_github_push_event, webhook_event.payload, webhook_event.token, webhook_event.url, webhook_event.url_slug)
-        elif provider_name == "gitea":
-            handle_queue(handle_gitea_push_event, webhook_event.payload, webhook_event.token, webhook_event.url, webhook_event.url_slug)
-        elif provider_name == "gitlab":
-            handle_queue(handle_push_event, webhook_event.payload, webhook_event.token, webhook_event.url, webhook_event.url_slug)
-        elif provider_name == "coding":
-            # 假设 Coding 的 push 事件由 handle_coding_push_event 处理
-            # 你需要创建 handle_coding_push_event 函数
-            handle_queue(handle_coding_push_event, webhook_event.payload, webhook_event.token, webhook_event.url, webhook_event.url_slug)
-        else:
-            # 对于自定义提供方，需要一个通用的push处理函数
-            logger.error(f"Unsupported push event for {provider_name}")
-            return jsonify({"error": f"Unsupported push event for {provider_name}"}), 400
-    else:
-        error_message = f'Unsupported event type: {webhook_event.event_type} for {provider_name}.'
-        logger.error(error_message)
-        return jsonify(error_message), 400
+    logger.info(f'Received {provider_name} event: {route.event_type}, {summarize_payload(data)}, '
+                f'{len(raw_body)} bytes')
+
+    if route.event_type == PROJECT_SETTINGS_EVENT:
+        # 项目设置变更事件只清除项目元数据缓存，直接在请求中处理，不入队
+        route.handler(data, webhook_event.url)
+        return jsonify({'message': f'{provider_name} {route.original_event_type} event handled.'}), 200
+
+    # 丢弃平台重试、重新投递等重复的事件，避免重复review
+    dedup_keys = webhook_deduplicator.check_and_mark(request.headers, raw_body)
+    if dedup_keys is None:
+        return jsonify({'message': f'{provider_name} duplicate delivery ignored(event_type={route.event_type}).'}), 200
+
+    try:
+        # 登记最新的head，同一MR/PR或分支被取代的旧任务在worker中跳过或丢弃结果；任务延迟到去抖窗口结束后执行
+        delay, registration = 0, None
+        if route.event_type != 'push' or push_review_enabled:
+            delay, registration = review_debouncer.register(provider_name, route.event_type, webhook_event.url_slug, data)
+        # 队列中只保存令牌引用，worker执行时再从环境变量解析，持久化的队列和任务台账中不出现明文令牌
+        handle_queue(route.handler, raw_body, token_ref(provider_name), webhook_event.url, webhook_event.url_slug,
+                     lane=lane_for_event(route.event_type), project=review_project(data), delay=delay)
+    except QueueFullError as e:
+        # 没有入队的事件不能取代已入队的旧任务，平台重试时重新登记
+        review_debouncer.restore(registration)
+        webhook_deduplicator.release(dedup_keys)
+        return reject_webhook(Rejection(429, str(e), retry_after=admission_controller.retry_after))
+    except Exception:
+        review_debouncer.restore(registration)
+        webhook_deduplicator.release(dedup_keys)
+        raise
+
+    return jsonify({'message': f'{provider_name} request received(event_type={route.event_type}), will process asynchronously.'}), 200
+
+
+@api_app.route('/queue/stats', methods=['GET'])
+def get_queue_stats():
+    """队列积压、速率、worker利用率和扩容建议"""
+    try:
+        return jsonify(queue_metrics())
+    except Exception as e:
+        logger.error(f"Failed to load queue stats: {e}")
+        return jsonify({'message': f"Failed to load queue stats: {e}"}), 500
 
-    return jsonify({'message': f'{provider_name} request received(event_type={webhook_event.event_type}), will process asynchronously.'}), 200
+
+@api_app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 格式的队列指标"""
+    try:
+        return render_prometheus(queue_metrics()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    except Exception as e:
+        logger.error(f"Failed to render metrics: {e}")
+        return f"# failed to collect queue metrics: {e}\n", 500, {'Content-Type': 'text/plain; charset=utf-8'}
 
 
 # 添加报告访问路由
@@ -298,9 +374,13 @@ def get_report(date, filename):
 
 if __name__ == '__main__':
     check_config()
-    # 启动定时任务调度器
-    setup_scheduler()
 
-    # 启动Flask API服务
     port = int(os.environ.get('SERVER_PORT', 5001))
-    api_app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    if os.environ.get('API_SERVER', 'flask') == 'gunicorn':
+        # 生产模式：gunicorn 多进程，预加载应用，每个worker启动后再启动后台服务
+        run_gunicorn(api_app, on_worker_start=start_background_services, port=port,
+                     on_worker_exit=stop_background_services)
+    else:
+        start_background_services()
+        # 启动Flask API服务
+        api_app.run(host='0.0.0.0', port=port)
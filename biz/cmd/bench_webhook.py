@@ -0,0 +1,110 @@
+"""
+webhook 入口延迟基准测试：通过 Flask test_client 重复投递 GitLab 事件，统计 /review/webhook 的 p50 / p99 延迟。
+入队函数替换为空操作，只测量入口本身（解析、识别平台、日志、入队前的处理）。
+
+用法: python -m biz.cmd.bench_webhook --requests 2000 --commits 500 --target-ms 5 2>/dev/null
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+def build_push_payload(commits: int) -> dict:
+    return {
+        'object_kind': 'push',
+        'ref': 'refs/heads/main',
+        'before': '0' * 40,
+        'after': 'a' * 40,
+        'project': {'id': 1, 'path_with_namespace': 'group/bench', 'web_url': 'http://127.0.0.1/group/bench'},
+        'commits': [
+            {
+                'id': f'{i:040x}',
+                'message': f'commit {i}\n\n' + 'details ' * 20,
+                'timestamp': '2026-10-19T00:00:00+08:00',
+                'url': f'http://127.0.0.1/group/bench/-/commit/{i:040x}',
+                'author': {'name': 'bench', 'email': 'bench@example.com'},
+                'added': [f'src/file_{i}.py'],
+                'modified': [],
+                'removed': [],
+            } for i in range(commits)
+        ],
+    }
+
+
+def build_merge_request_payload() -> dict:
+    return {
+        'object_kind': 'merge_request',
+        'project': {'id': 1, 'path_with_namespace': 'group/bench', 'web_url': 'http://127.0.0.1/group/bench'},
+        'object_attributes': {'iid': 1, 'action': 'update', 'source_branch': 'feature', 'target_branch': 'main',
+                              'last_commit': {'id': 'b' * 40}},
+        'user': {'username': 'bench'},
+    }
+
+
+def run(client, event: str, payload: dict, requests: int) -> list:
+    body = json.dumps(payload)
+    headers = {'X-Gitlab-Event': event, 'X-Gitlab-Token': 'bench', 'X-Gitlab-Instance': 'http://127.0.0.1'}
+    # 预热
+    for _ in range(min(50, requests)):
+        client.post('/review/webhook', data=body, headers=headers, content_type='application/json')
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.post('/review/webhook', data=body, headers=headers, content_type='application/json')
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"Unexpected response {response.status_code}: {response.get_data(as_text=True)}")
+    return latencies
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark /review/webhook ingress latency')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--commits', type=int, default=500, help='commits in the large push payload')
+    parser.add_argument('--target-ms', type=float, default=5.0, help='p99 latency target in milliseconds')
+    args = parser.parse_args()
+
+    # 保留INFO日志以计入日志开销，文件日志写入空设备
+    os.environ.setdefault('LOG_FILE', os.devnull)
+    # 重复的请求体会被去重丢弃，基准测试中关闭去重
+    os.environ.setdefault('WEBHOOK_DEDUP_TTL', '0')
+    os.environ.setdefault('GITLAB_ACCESS_TOKEN', 'bench')
+    os.environ.setdefault('GITLAB_URL', 'http://127.0.0.1')
+    import api
+    from biz.git_provider.manager import DEFAULT_PROVIDERS_CONFIG, GitProviderManager
+
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as config_file:
+        json.dump(DEFAULT_PROVIDERS_CONFIG, config_file)
+    try:
+        api.git_provider_manager = GitProviderManager(config_file.name)
+        api.handle_queue = lambda *args, **kwargs: None
+        client = api.api_app.test_client()
+
+        failed = False
+        cases = [
+            ('merge_request', 'Merge Request Hook', build_merge_request_payload()),
+            ('push x1', 'Push Hook', build_push_payload(1)),
+            (f'push x{args.commits}', 'Push Hook', build_push_payload(args.commits)),
+        ]
+        for name, event, payload in cases:
+            latencies = run(client, event, payload, args.requests)
+            p50, p99 = statistics.median(latencies), percentile(latencies, 99)
+            size = len(json.dumps(payload))
+            status = 'OK' if p99 <= args.target_ms else 'SLOW'
+            failed = failed or p99 > args.target_ms
+            print(f"{name:<16} {size:>9} bytes  p50={p50:.2f}ms  p99={p99:.2f}ms  max={max(latencies):.2f}ms  {status}")
+        return 1 if failed else 0
+    finally:
+        os.unlink(config_file.name)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+worker 单任务开销基准测试：对比三种执行方式下每个任务的初始化耗时(不调用大模型和 Git 平台)：
+  cold-fork   stock rq worker，父进程未预热，每个任务fork出的子进程导入处理函数、加载tokenizer、创建大模型客户端、读取提示词、打开SQLite
+  warm-fork   PreloadedWorker，父进程预热后fork，子进程只重新创建大模型客户端
+  in-process  InProcessWorker，在预热后的进程内直接执行
+
+用法: python -m biz.cmd.bench_worker --jobs 50 2>/dev/null
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+SAMPLE_DIFF = "@@ -1,3 +1,4 @@\n-def old():\n+def new(value):\n+    return value * 2\n" * 200
+
+
+def job_setup(tokenizer: bool):
+    # 与 worker 中每个 review 任务调用大模型前的初始化一致
+    import biz.queue.worker  # noqa: F401
+    from biz.service.job_ledger import job_ledger
+    from biz.utils.code_reviewer import CodeReviewer
+    from biz.utils.kv_store import get_kv_store
+    from biz.utils.token_util import count_tokens
+
+    CodeReviewer()
+    if tokenizer:
+        count_tokens(SAMPLE_DIFF)
+    get_kv_store()
+    job_ledger._connect().close()
+
+
+def run_forked(jobs: int, tokenizer: bool) -> list:
+    durations = []
+    for _ in range(jobs):
+        started = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                job_setup(tokenizer)
+            except BaseException as e:
+                print(f"job failed: {e}", file=sys.stderr)
+                os._exit(1)
+            os._exit(0)
+        _, status = os.waitpid(pid, 0)
+        if os.waitstatus_to_exitcode(status) != 0:
+            raise RuntimeError("Forked job failed, see stderr")
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+
+def run_in_process(jobs: int, tokenizer: bool) -> list:
+    durations = []
+    for _ in range(jobs):
+        started = time.perf_counter()
+        job_setup(tokenizer)
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark per-job setup overhead of RQ worker modes')
+    parser.add_argument('--jobs', type=int, default=50)
+    parser.add_argument('--no-tokenizer', action='store_true',
+                        help='skip tiktoken (it downloads the encoding on first use)')
+    args = parser.parse_args()
+    tokenizer = not args.no_tokenizer
+
+    os.environ.setdefault('LOG_FILE', os.devnull)
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+    tmp_dir = tempfile.TemporaryDirectory()
+    os.environ['JOB_LEDGER_DB_FILE'] = os.path.join(tmp_dir.name, 'jobs.db')
+    os.environ['KV_STORE_DRIVER'] = 'sqlite'
+    os.environ['KV_STORE_DB_FILE'] = os.path.join(tmp_dir.name, 'kv.db')
+
+    # 冷启动必须在导入任何业务模块之前执行
+    results = [('cold-fork', run_forked(args.jobs, tokenizer))]
+    from biz.queue.warmup import warmup
+    warmup()
+    results.append(('warm-fork', run_forked(args.jobs, tokenizer)))
+    results.append(('in-process', run_in_process(args.jobs, tokenizer)))
+
+    for name, durations in results:
+        print(f"{name:<11} jobs={len(durations)}  mean={statistics.mean(durations):.2f}ms  "
+              f"p50={statistics.median(durations):.2f}ms  max={max(durations):.2f}ms")
+    tmp_dir.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
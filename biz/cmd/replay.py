@@ -0,0 +1,79 @@
+"""
+重放任务台账中的失败任务：Git 平台或大模型服务恢复后，按指定并发批量重新执行死信任务。
+重放的任务仍然经过去抖和串行检查，已被更新事件取代的任务会被跳过。
+
+用法:
+    python -m biz.cmd.replay --list                      # 查看死信任务
+    python -m biz.cmd.replay --provider gitlab --concurrency 4
+    python -m biz.cmd.replay --id <job_id> --id <job_id>
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv("conf/.env")
+
+from biz.queue.deferral import run_deferrable
+from biz.queue.sqlite_queue import run_job
+from biz.queue.warmup import warmup
+from biz.service.job_ledger import STATUS_DEAD, STATUS_SUCCEEDED, job_ledger
+
+
+def print_jobs(jobs: list):
+    for job in jobs:
+        updated_at = datetime.fromtimestamp(job['updated_at']).strftime('%Y-%m-%d %H:%M:%S')
+        stages = ' '.join(f"{name}={seconds:.1f}s" for name, seconds in job['stages'].items())
+        print(f"{job['id']}  {job['status']:<9} attempts={job['attempts']:<3} {updated_at}  "
+              f"{job['provider']} {job['event_type']} project={job['project']}  {stages}")
+        if job['error']:
+            print(f"    error: {job['error'].splitlines()[0][:200]}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Replay failed review jobs from the job ledger')
+    parser.add_argument('--status', default=STATUS_DEAD, help='job status to replay (dead, failed, queued, running, partial: review already written back)')
+    parser.add_argument('--provider', help='only replay jobs of this provider')
+    parser.add_argument('--project', help='only replay jobs of this project')
+    parser.add_argument('--id', dest='job_ids', action='append', help='replay the given job id, repeatable')
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=2, help='jobs replayed at the same time')
+    parser.add_argument('--list', action='store_true', help='list matching jobs without replaying')
+    args = parser.parse_args()
+
+    status = None if args.job_ids else args.status
+    jobs = job_ledger.list_jobs(status=status, provider=args.provider, project=args.project, job_ids=args.job_ids,
+                                limit=args.limit)
+    if args.list or not jobs:
+        print_jobs(jobs)
+        print(f"{len(jobs)} jobs")
+        return 0
+
+    replayable = [job for job in jobs if job['payload']]
+    if len(replayable) < len(jobs):
+        print(f"Skipping {len(jobs) - len(replayable)} jobs without payload (already succeeded)")
+    print(f"Replaying {len(replayable)} jobs with concurrency {args.concurrency}")
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=args.concurrency, initializer=warmup) as executor:
+        # 重放时没有队列重新投递，推迟的任务在工作进程内等待后继续执行
+        futures = {executor.submit(run_deferrable, run_job, job['function'],
+                                   [job['payload'], job['token'], job['url'], job['url_slug']]): job
+                   for job in replayable}
+        for future in as_completed(futures):
+            job = futures[future]
+            error = future.exception()
+            print(f"{job['id']}  {'raised: ' + str(error) if error else 'done'}")
+
+    # 以台账中的最终状态为准
+    results = job_ledger.list_jobs(job_ids=[job['id'] for job in replayable], limit=len(replayable))
+    print_jobs(results)
+    succeeded = sum(1 for job in results if job['status'] == STATUS_SUCCEEDED)
+    print(f"{succeeded}/{len(replayable)} jobs succeeded in {time.time() - started:.1f}s")
+    return 0 if succeeded == len(replayable) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
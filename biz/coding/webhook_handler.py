@@ -7,12 +7,19 @@ import fnmatch
 import requests
 import traceback
 
+from biz.git_provider import http_client
+from biz.git_provider.rate_limit import PRIORITY_LOW
 from biz.utils.log import logger
 from biz.entity.review_entity import MergeRequestReviewEntity, PushReviewEntity
 from biz.service.review_service import ReviewService
 from biz.utils.code_reviewer import CodeReviewer
 from biz.event.event_manager import event_manager
 from biz.utils.im import notifier
+from biz.queue.debounce import review_debouncer
+from biz.queue.deferral import JobDeferred
+from biz.queue.serialize import serialized
+from biz.service.job_ledger import job_stage, record_job_error, tracked
+from biz.utils.queue import load_payload
 
 def filter_changes(changes: list):
     '''
@@ -55,7 +62,7 @@ def _get_diff_content_from_url(diff_url: str, token: str) -> str:
         "Accept": "application/vnd.github.v3.diff" # 某些平台可能需要特定的Accept头
     }
     try:
-        response = requests.get(diff_url, headers=headers)
+        response = http_client.get(diff_url, headers=headers)
         response.raise_for_status() # 如果请求失败，抛出HTTPError
         return response.text
     except requests.exceptions.RequestException as e:
@@ -64,7 +71,14 @@ def _get_diff_content_from_url(diff_url: str, token: str) -> str:
 
 
 
+@tracked('coding', 'pull_request')
+@serialized('coding', 'pull_request')
 def handle_coding_pull_request_event(data: dict, coding_token: str, coding_url: str, coding_url_slug: str):
+    data = load_payload(data)
+    # 同一MR或分支的连续更新只review最新的head
+    data = review_debouncer.begin('coding', 'pull_request', coding_url_slug, data)
+    if data is None:
+        return
     logger.info(f"Handling Coding Pull Request event for URL: {coding_url}")
 
     try:
@@ -98,7 +112,8 @@ def handle_coding_pull_request_event(data: dict, coding_token: str, coding_url:
                 logger.info(f"Merge Request with last_commit_id {last_commit_id} already exists, skipping review for {project_name}.")
                 return
 
-        diff_content = _get_diff_content_from_url(diff_url, coding_token)
+        with job_stage('fetch'):
+            diff_content = _get_diff_content_from_url(diff_url, coding_token)
 
         # 统计本次新增、删除的代码总数
         additions = data.get("mergeRequest", {}).get("additions", 0)
@@ -107,7 +122,8 @@ def handle_coding_pull_request_event(data: dict, coding_token: str, coding_url:
         # review 代码
         # 对于commits_text，暂时使用title，因为pull_request.json示例未提供提交消息列表
         commits_text = title
-        review_result = CodeReviewer().review_and_strip_code(diff_content, commits_text)
+        with job_stage('llm'):
+            review_result = CodeReviewer().review_and_strip_code(diff_content, commits_text)
         commits = [{
             'message': commits_text,
             'author': author_name,
@@ -130,18 +146,30 @@ def handle_coding_pull_request_event(data: dict, coding_token: str, coding_url:
                 deletions=deletions,
                 last_commit_id=last_commit_id,
             )
+        if not review_debouncer.finish('coding', 'pull_request', coding_url_slug, data):
+            return
         # 触发事件
         # dispatch merge_request_reviewed event
         event_manager['merge_request_reviewed'].send(entity)
         logger.info(f"Coding Pull Request event {pull_request_id} triggered for review.")
 
+    except JobDeferred:
+        raise
     except Exception as e:
         error_message = f"AI Code Review 服务出现未知错误: {str(e)} \n{traceback.format_exc()}"
         notifier.send_notification(content=error_message) # 如果需要通知，可以取消注释
+        record_job_error(e)
         logger.error(f"Error processing Coding PR {pull_request_id}: {error_message}")
         return
 
+@tracked('coding', 'push')
+@serialized('coding', 'push')
 def handle_coding_push_event(data: dict, coding_token: str, coding_url: str, coding_url_slug: str):
+    data = load_payload(data)
+    # 同一MR或分支的连续更新只review最新的head，被取代的push合并到最新的push中，before为最早未review的提交
+    data = review_debouncer.begin('coding', 'push', coding_url_slug, data)
+    if data is None:
+        return
     logger.info(f"Handling Coding Push event for URL: {coding_url}")
 
     push_review_enabled = os.environ.get('PUSH_REVIEW_ENABLED', '0') == '1'
@@ -172,7 +200,8 @@ def handle_coding_push_event(data: dict, coding_token: str, coding_url: str, cod
         compare_url = f"{coding_url}/api/v3/projects/{project_name}/git/repositories/{repo_id}/compare/{before_sha}...{after_sha}"
         headers = {"Authorization": f"token {coding_token}"}
         try:
-            compare_response = requests.get(compare_url, headers=headers)
+            with job_stage('fetch'):
+                compare_response = http_client.get(compare_url, headers=headers, priority=PRIORITY_LOW)
             compare_response.raise_for_status()
             compare_data = compare_response.json()
             # 假设 compare_data 中包含 diff 信息，例如 files 列表，每个文件有 patch 字段
@@ -181,10 +210,12 @@ def handle_coding_push_event(data: dict, coding_token: str, coding_url: str, cod
                     all_diff_content += file_change["patch"] + "\n"
         except requests.exceptions.RequestException as e:
             logger.error(f"Failed to get diff for Coding push {before_sha}...{after_sha}: {e}")
+            record_job_error(e)
             return
 
         # review 代码
-        review_result = CodeReviewer().review_and_strip_code(all_diff_content, commits_text)
+        with job_stage('llm'):
+            review_result = CodeReviewer().review_and_strip_code(all_diff_content, commits_text)
 
         # 构造 PushReviewEntity
         entity = PushReviewEntity(
@@ -206,12 +237,17 @@ def handle_coding_push_event(data: dict, coding_token: str, coding_url: str, cod
             commits=commits
         )
 
+        if not review_debouncer.finish('coding', 'push', coding_url_slug, data):
+            return
         # 触发事件
         event_manager['push_reviewed'].send(entity)
         logger.info(f"Coding Push event for {branch_name} triggered for review.")
 
+    except JobDeferred:
+        raise
     except Exception as e:
         error_message = f"AI Code Review 服务出现未知错误: {str(e)}\n{traceback.format_exc()}"
         notifier.send_notification(content=error_message) # 如果需要通知，可以取消注释
+        record_job_error(e)
         logger.error(f"Error processing Coding Push event: {error_message}")
         return
\ No newline at end of file
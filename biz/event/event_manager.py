@@ -3,6 +3,7 @@ from datetime import datetime
 from blinker import Signal
 
 from biz.entity.review_entity import MergeRequestReviewEntity, PushReviewEntity
+from biz.service.job_ledger import job_stage
 from biz.service.review_service import ReviewService
 from biz.utils.im import notifier
 from biz.utils.html_reporter import HTMLReporter
@@ -63,12 +64,14 @@ def on_merge_request_reviewed(mr_review_entity: MergeRequestReviewEntity):
     report_link = f"\n\n[查看详细报告]({report_url})"
     im_msg += report_link
     
-    notifier.send_notification(content=im_msg, msg_type='markdown', title='Merge Request Review',
-                               project_name=mr_review_entity.project_name, url_slug=mr_review_entity.url_slug,
-                               webhook_data=mr_review_entity.webhook_data)
+    with job_stage('notify'):
+        notifier.send_notification(content=im_msg, msg_type='markdown', title='Merge Request Review',
+                                   project_name=mr_review_entity.project_name, url_slug=mr_review_entity.url_slug,
+                                   webhook_data=mr_review_entity.webhook_data)
 
     # 记录到数据库
-    ReviewService().insert_mr_review_log(mr_review_entity)
+    with job_stage('persist'):
+        ReviewService().insert_mr_review_log(mr_review_entity)
 
 
 def on_push_reviewed(entity: PushReviewEntity):
@@ -124,12 +127,14 @@ def on_push_reviewed(entity: PushReviewEntity):
     report_link = f"\n\n[查看详细报告]({report_url})"
     im_msg += report_link
     
-    notifier.send_notification(content=im_msg, msg_type='markdown',title=f"{entity.project_name} Push Event",
-                               project_name=entity.project_name, url_slug=entity.url_slug,
-                               webhook_data=entity.webhook_data)
+    with job_stage('notify'):
+        notifier.send_notification(content=im_msg, msg_type='markdown',title=f"{entity.project_name} Push Event",
+                                   project_name=entity.project_name, url_slug=entity.url_slug,
+                                   webhook_data=entity.webhook_data)
 
     # 记录到数据库
-    ReviewService().insert_push_review_log(entity)
+    with job_stage('persist'):
+        ReviewService().insert_push_review_log(entity)
 
 
 # 连接事件处理函数到事件信号
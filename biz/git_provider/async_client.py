@@ -0,0 +1,105 @@
+import asyncio
+import importlib.util
+import os
+import threading
+
+import httpx
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from biz.utils.log import logger
+
+
+def http2_enabled() -> bool:
+    # HTTP/2 依赖 h2 包(httpx[http2])，未安装时使用 HTTP/1.1
+    return os.getenv('PROVIDER_HTTP2_ENABLED', '1') == '1' and importlib.util.find_spec('h2') is not None
+
+
+def to_requests_response(response: httpx.Response) -> requests.Response:
+    """
+    转换为 requests 的响应，各平台 webhook_handler 和 ETag 缓存按 requests 的接口使用响应
+    """
+    result = requests.Response()
+    result.status_code = response.status_code
+    result.url = str(response.url)
+    result.reason = response.reason_phrase
+    result.headers = CaseInsensitiveDict(response.headers.items())
+    result._content = response.content
+    result.encoding = response.encoding
+    result.elapsed = response.elapsed
+    return result
+
+
+class AsyncHttpClient:
+    """
+    Git 平台 API 的异步 HTTP 客户端：每个进程一个后台事件循环和共享的 httpx.AsyncClient(按是否校验证书区分)，
+    服务端支持时通过 HTTP/2 在同一连接上多路复用。
+    协程通过 run()/submit() 在该事件循环中 await request()；同步代码(各平台的 webhook_handler 经 http_client)
+    通过 send() 提交请求并等待结果，进程内所有线程的并发调用(ProviderCallPlanner 等)共用一个事件循环和连接池。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+        self._clients = {}
+
+    @property
+    def enabled(self) -> bool:
+        return os.getenv('PROVIDER_ASYNC_HTTP_ENABLED', '1') == '1'
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        # fork 后的子进程(进程池、gunicorn worker)中没有后台线程，重新创建事件循环和连接池
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='provider-http', daemon=True).start()
+                self._loop, self._pid, self._clients = loop, os.getpid(), {}
+                logger.debug(f"Provider HTTP event loop started (http2={http2_enabled()}).")
+            return self._loop
+
+    def _client(self, verify: bool) -> httpx.AsyncClient:
+        # 只在事件循环线程中调用，不需要加锁
+        client = self._clients.get(verify)
+        if client is None:
+            limits = httpx.Limits(max_connections=int(os.getenv('PROVIDER_ASYNC_MAX_CONNECTIONS', 100)),
+                                  max_keepalive_connections=int(os.getenv('PROVIDER_ASYNC_MAX_KEEPALIVE', 20)))
+            # 与 requests 一致跟随重定向(项目改名、http跳转https等)
+            client = self._clients[verify] = httpx.AsyncClient(http2=http2_enabled(), verify=verify, limits=limits,
+                                                               follow_redirects=True)
+        return client
+
+    async def request(self, method: str, url: str, headers: dict = None, params=None, json=None, verify: bool = True,
+                      timeout: float = None) -> httpx.Response:
+        """
+        在共享的事件循环中发送请求，只能在 run()/submit() 提交的协程中调用
+        """
+        return await self._client(verify).request(method, url, headers=headers, params=params, json=json,
+                                                  timeout=timeout)
+
+    def submit(self, coroutine):
+        """将协程提交到共享的事件循环，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop())
+
+    def run(self, coroutine):
+        """在共享的事件循环中执行协程并等待结果"""
+        return self.submit(coroutine).result()
+
+    def send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        同步发送请求：在共享的事件循环中执行，返回 requests 的响应；
+        超时、连接失败、URL无效转换为 requests 的异常，调用方按 requests.exceptions.RequestException 处理
+        """
+        try:
+            return to_requests_response(self.run(self.request(method, url, **kwargs)))
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(f"{method} {url}: {e}") from e
+        except httpx.UnsupportedProtocol as e:
+            raise requests.exceptions.MissingSchema(f"{method} {url}: {e}") from e
+        except httpx.InvalidURL as e:
+            raise requests.exceptions.InvalidURL(f"{method} {url}: {e}") from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(f"{method} {url}: {e}") from e
+
+
+async_http = AsyncHttpClient()
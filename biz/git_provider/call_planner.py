@@ -0,0 +1,57 @@
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict
+
+from biz.utils.log import logger
+
+
+class ProviderCallTimeout(Exception):
+    """事件处理的 Provider API 调用超过截止时间"""
+
+
+class ProviderCallPlanner:
+    """
+    并发执行同一事件中互不依赖的 Provider API 调用（受保护分支、变更、提交等），
+    使预处理阶段的耗时约等于最慢的一次调用，而不是所有调用之和。
+    同一个 planner 可以分阶段多次 add/run，所有阶段共享第一次 run 时开始计算的截止时间。
+    """
+
+    def __init__(self, deadline: float = None):
+        """
+        :param deadline: 所有调用的截止时间（秒），默认读取 PROVIDER_CALL_DEADLINE
+        """
+        self.deadline = deadline if deadline is not None else float(os.getenv('PROVIDER_CALL_DEADLINE', 60))
+        self.calls: Dict[str, tuple] = {}
+        self.expires_at = None
+
+    def add(self, name: str, func: Callable, *args, **kwargs) -> 'ProviderCallPlanner':
+        self.calls[name] = (func, args, kwargs)
+        return self
+
+    def run(self) -> Dict[str, Any]:
+        """
+        并发执行已添加且尚未执行的调用，返回 name -> 结果 的映射。
+        任一调用抛出异常时重新抛出该异常；超过截止时间时抛出 ProviderCallTimeout。
+        """
+        calls, self.calls = self.calls, {}
+        if not calls:
+            return {}
+        if self.expires_at is None:
+            self.expires_at = time.monotonic() + self.deadline
+        timeout = max(self.expires_at - time.monotonic(), 0)
+
+        executor = ThreadPoolExecutor(max_workers=len(calls), thread_name_prefix='provider-call')
+        try:
+            # 调用在调用方的上下文中执行(是否允许推迟任务等)
+            futures = {name: executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+                       for name, (func, args, kwargs) in calls.items()}
+            _, not_done = wait(futures.values(), timeout=timeout)
+            if not_done:
+                pending = [name for name, future in futures.items() if future in not_done]
+                logger.error(f"Provider calls exceeded deadline {self.deadline}s: {pending}")
+                raise ProviderCallTimeout(f"Provider calls exceeded deadline {self.deadline}s: {pending}")
+            return {name: future.result() for name, future in futures.items()}
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from biz.git_provider.async_client import async_http
+from biz.git_provider.rate_limit import rate_limit_scheduler, PRIORITY_HIGH
+from biz.git_provider.sha_cache import ShaCache
+from biz.utils.log import logger
+
+# 缓存响应时保留的响应头（分页、内容类型、校验信息）
+CACHED_HEADERS = ('Content-Type', 'Link', 'ETag', 'Last-Modified', 'X-Total', 'X-Total-Pages', 'X-Page',
+                  'X-Next-Page', 'X-Per-Page')
+# 参与缓存key计算的请求头，不同令牌看到的数据可能不同
+VARY_HEADERS = ('Authorization', 'Private-Token', 'Accept')
+
+etag_cache = ShaCache(cache_dir=os.getenv('PROVIDER_ETAG_CACHE_DIR', 'data/cache/etag'),
+                      max_bytes=int(os.getenv('PROVIDER_ETAG_CACHE_MAX_BYTES', 256 * 1024 * 1024)))
+
+_local = threading.local()
+
+
+def _session() -> requests.Session:
+    # 每个线程各自持有一个Session以复用连接，fork后的子进程重新创建
+    session = getattr(_local, 'session', None)
+    if session is None or _local.pid != os.getpid():
+        session = requests.Session()
+        _local.session = session
+        _local.pid = os.getpid()
+    return session
+
+
+def _transport(method: str, url: str, headers: dict, params, **kwargs) -> requests.Response:
+    # 默认通过进程共享的异步客户端(HTTP/2、共享连接池)发送，关闭 PROVIDER_ASYNC_HTTP_ENABLED 时使用每个线程的 requests.Session
+    if async_http.enabled:
+        return async_http.send(method, url, headers=headers, params=params, **kwargs)
+    return _session().request(method, url, headers=headers, params=params, **kwargs)
+
+
+def _etag_enabled() -> bool:
+    return os.getenv('PROVIDER_ETAG_CACHE_ENABLED', '1') == '1' and etag_cache.enabled
+
+
+def _cache_key(url: str, headers: dict, params) -> str:
+    vary = [f"{name}:{headers.get(name, '')}" for name in VARY_HEADERS]
+    raw = '\n'.join([url, repr(sorted((params or {}).items())), *vary])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _build_cached_response(url: str, cached: dict, fresh: requests.Response) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.encoding = 'utf-8'
+    response._content = cached['body'].encode('utf-8')
+    response.headers = CaseInsensitiveDict(cached['headers'])
+    # 304响应中的限流等最新响应头覆盖缓存的响应头
+    for name, value in fresh.headers.items():
+        if name.lower() not in ('content-length', 'content-encoding', 'transfer-encoding'):
+            response.headers[name] = value
+    response.request = fresh.request
+    response.elapsed = fresh.elapsed
+    return response
+
+
+def _rate_limit_key(url: str, headers: dict) -> str:
+    # 限流配额按 平台地址 + 令牌 区分
+    token = headers.get('Authorization') or headers.get('Private-Token') or ''
+    return f"{urlparse(url).netloc}#{hashlib.sha256(token.encode('utf-8')).hexdigest()[:12]}"
+
+
+def _send(method: str, url: str, headers: dict, params, **kwargs) -> requests.Response:
+    if method.upper() != 'GET' or not _etag_enabled():
+        return _transport(method, url, headers, params, **kwargs)
+
+    host = urlparse(url).netloc
+    key = _cache_key(url, headers, params)
+    cached = etag_cache.get(host, '', 'etag', key)
+    conditional_headers = dict(headers)
+    if cached:
+        if cached.get('etag'):
+            conditional_headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            conditional_headers['If-Modified-Since'] = cached['last_modified']
+
+    response = _transport(method, url, conditional_headers, params, **kwargs)
+    if response.status_code == 304 and cached:
+        logger.debug(f"Not modified (304), use cached response: {url}")
+        return _build_cached_response(url, cached, response)
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if response.status_code == 200 and (etag or last_modified):
+        etag_cache.set(host, '', 'etag', (key,), {
+            'etag': etag,
+            'last_modified': last_modified,
+            'body': response.text,
+            'headers': {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers},
+        })
+    return response
+
+
+def request(method: str, url: str, headers: dict = None, params: dict = None, priority: str = PRIORITY_HIGH,
+            **kwargs) -> requests.Response:
+    """
+    调用 Git 平台 API 的统一入口。
+    GET请求会缓存带 ETag / Last-Modified 的响应，再次请求时通过 If-None-Match / If-Modified-Since 条件请求重新校验，
+    服务端返回304时直接使用缓存内容（GitHub 的304响应不计入限流配额）。
+    请求通过进程共享的异步客户端(async_client.async_http)发送，服务端支持时使用 HTTP/2，所有线程共用连接池。
+    请求前后经过限流调度，配额不足时按优先级等待，触发限流(403/429)时等待后重试；
+    任务在可推迟的阶段需要长时间等待时抛出 JobDeferred，由队列推迟后重新投递。
+    """
+    headers = dict(headers or {})
+    kwargs.setdefault('timeout', float(os.getenv('PROVIDER_HTTP_TIMEOUT', 60)))
+    key = _rate_limit_key(url, headers)
+    max_retries = int(os.getenv('PROVIDER_RATE_LIMIT_RETRIES', 3))
+
+    attempt = 0
+    while True:
+        rate_limit_scheduler.before_request(key, priority)
+        response = _send(method, url, headers, params, **kwargs)
+        wait = rate_limit_scheduler.after_response(key, response)
+        if not wait or attempt >= max_retries:
+            return response
+        attempt += 1
+        logger.warn(f"Rate limited by {urlparse(url).netloc} ({response.status_code}), "
+                    f"retrying in {wait:.1f}s (attempt {attempt}/{max_retries}): {url}")
+        rate_limit_scheduler.wait(key, wait)
+
+
+def get(url: str, headers: dict = None, params: dict = None, priority: str = PRIORITY_HIGH,
+        **kwargs) -> requests.Response:
+    return request('GET', url, headers=headers, params=params, priority=priority, **kwargs)
+
+
+def post(url: str, headers: dict = None, priority: str = PRIORITY_HIGH, **kwargs) -> requests.Response:
+    return request('POST', url, headers=headers, priority=priority, **kwargs)
@@ -1,18 +1,253 @@
+import importlib
+import inspect
 import json
 import os
-from typing import Dict, Any, Optional, List
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, Callable, Tuple
 from biz.utils.log import logger
+
+# 未提供 conf/git_providers.json 时使用的内置配置，Gitea 同时发送 X-GitHub-Event，需要排在 GitHub 之前
+DEFAULT_PROVIDERS_CONFIG = {
+    "providers": [
+        {
+            "name": "gitlab",
+            "identification": {"headers": {"X-Gitlab-Event": ["Merge Request Hook", "Push Hook", "System Hook"]}},
+            "credentials": {"type": "env", "key": "GITLAB_ACCESS_TOKEN"},
+            "payload_parser": "biz.git_provider.parsers.gitlab_parser",
+            "event_mapping": {"Merge Request Hook": "pull_request", "Push Hook": "push",
+                              "System Hook": "project_settings"},
+        },
+        {
+            "name": "gitea",
+            "identification": {"headers": {"X-Gitea-Event": ["pull_request", "push"]}},
+            "credentials": {"type": "env", "key": "GITEA_ACCESS_TOKEN"},
+            "payload_parser": "biz.git_provider.parsers.gitea_parser",
+            "event_mapping": {"pull_request": "pull_request", "push": "push"},
+        },
+        {
+            "name": "github",
+            "identification": {"headers": {"X-GitHub-Event": ["pull_request", "push", "branch_protection_rule",
+                                                              "branch_protection_configuration", "repository"]}},
+            "credentials": {"type": "env", "key": "GITHUB_ACCESS_TOKEN"},
+            "payload_parser": "biz.git_provider.parsers.github_parser",
+            "event_mapping": {"pull_request": "pull_request", "push": "push",
+                              "branch_protection_rule": "project_settings",
+                              "branch_protection_configuration": "project_settings",
+                              "repository": "project_settings"},
+        },
+        {
+            "name": "coding",
+            "identification": {"headers": {"X-Coding-Event": ["merge_request", "push"]}},
+            "credentials": {"type": "env", "key": "CODING_ACCESS_TOKEN"},
+            "payload_parser": "biz.git_provider.parsers.coding_parser",
+            "event_mapping": {"merge_request": "pull_request", "push": "push"},
+        },
+    ]
+}
+
+# 项目设置变更事件：不入队，在请求中直接调用处理函数 handler(webhook_data, url) 清除项目元数据缓存
+PROJECT_SETTINGS_EVENT = "project_settings"
+
+# 各平台内部事件类型对应的处理函数，可在配置中通过 event_handlers 覆盖。
+# 入队的令牌参数是 token_ref() 引用，由 @tracked 装饰器解析，自定义处理函数需使用 tracked 或自行调用 resolve_token
+DEFAULT_EVENT_HANDLERS = {
+    "gitlab": {"pull_request": "biz.queue.worker.handle_merge_request_event",
+               "push": "biz.queue.worker.handle_push_event",
+               PROJECT_SETTINGS_EVENT: "biz.gitlab.webhook_handler.invalidate_project_metadata"},
+    "github": {"pull_request": "biz.queue.worker.handle_github_pull_request_event",
+               "push": "biz.queue.worker.handle_github_push_event",
+               PROJECT_SETTINGS_EVENT: "biz.github.webhook_handler.invalidate_project_metadata"},
+    "gitea": {"pull_request": "biz.queue.worker.handle_gitea_pull_request_event",
+              "push": "biz.queue.worker.handle_gitea_push_event"},
+    "coding": {"pull_request": "biz.coding.webhook_handler.handle_coding_pull_request_event",
+               "push": "biz.coding.webhook_handler.handle_coding_push_event"},
+}
+
+
+@lru_cache(maxsize=None)
+def resolve_callable(path: str) -> Callable:
+    """
+    根据 "模块.函数" 路径加载函数，结果缓存
+    """
+    module_name, func_name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def access_token_from_config(provider_config: Dict[str, Any]) -> Optional[str]:
+    credentials_config = provider_config.get("credentials", {})
+    cred_type = credentials_config.get("type")
+    cred_key = credentials_config.get("key")
+
+    if cred_type == "env" and cred_key:
+        return os.getenv(cred_key)
+    # Add other credential types (e.g., from request headers, payload) here if needed
+    return None
+
+
+# 队列、任务台账、评论发件箱等持久化的数据中不保存访问令牌，只保存平台名引用，执行时再从环境变量解析
+TOKEN_REF_PREFIX = 'provider-token:'
+
+
+def provider_access_token(provider_name: str, config_path: str = "conf/git_providers.json") -> Optional[str]:
+    """
+    按平台名读取 conf/git_providers.json(不存在时使用内置配置)中配置的访问令牌
+    """
+    providers_config = DEFAULT_PROVIDERS_CONFIG
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            providers_config = json.load(f)
+    for provider_config in providers_config.get("providers", []):
+        if provider_config.get("name") == provider_name:
+            return access_token_from_config(provider_config)
+    return None
+
+
+def token_ref(provider_name: str) -> str:
+    return f"{TOKEN_REF_PREFIX}{provider_name}"
+
+
+def resolve_token(token: Optional[str]) -> Optional[str]:
+    """
+    将 token_ref() 生成的引用解析为平台当前的访问令牌，其他值原样返回(兼容旧数据和直接传入令牌的调用)
+    """
+    if token and token.startswith(TOKEN_REF_PREFIX):
+        return provider_access_token(token[len(TOKEN_REF_PREFIX):])
+    return token
+
+
+class CompiledProvider:
+    """
+    编译后的平台配置：识别规则、解析器和各事件的处理函数都已加载完成
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.name = config["name"]
+        self.config = config
+        headers_rules = config.get("identification", {}).get("headers", {})
+        self.header_rules: List[Tuple[str, frozenset]] = [(name, frozenset(values))
+                                                          for name, values in headers_rules.items()]
+        self.event_mapping: Dict[str, str] = config.get("event_mapping", {})
+        self.url = os.getenv(config.get("url_env") or f"{self.name.upper()}_URL")
+
+        parser_path = config.get("payload_parser")
+        if not parser_path:
+            raise ValueError(f"No payload parser defined for {self.name}")
+        self.parser = resolve_callable(parser_path)
+        # gitlab_parser 不接收 event_type 参数
+        self.parser_takes_event_type = len(inspect.signature(self.parser).parameters) >= 4
+
+        handler_paths = {**DEFAULT_EVENT_HANDLERS.get(self.name, {}), **config.get("event_handlers", {})}
+        self.handlers: Dict[str, Callable] = {event_type: resolve_callable(path)
+                                              for event_type, path in handler_paths.items()}
+
+    def matches(self, headers) -> bool:
+        for header_name, expected_values in self.header_rules:
+            actual_value = headers.get(header_name)
+            if not actual_value or actual_value not in expected_values:
+                return False
+        return True
+
+    def access_token(self) -> Optional[str]:
+        return access_token_from_config(self.config)
+
+    def parse(self, data: Dict[str, Any], token: str, event_type: str):
+        if self.parser_takes_event_type:
+            return self.parser(data, token, self.url, event_type)
+        return self.parser(data, token, self.url)
+
+
+class WebhookRoute:
+    """
+    一次webhook请求的分发结果
+    """
+
+    def __init__(self, provider: CompiledProvider, original_event_type: str):
+        self.provider = provider
+        self.original_event_type = original_event_type
+        self.event_type = provider.event_mapping.get(original_event_type)
+        self.handler = provider.handlers.get(self.event_type) if self.event_type else None
+
+
+class DispatchTable:
+    """
+    header -> 平台 -> 事件 -> (解析器, 处理函数) 的分发表，每个请求只需按识别header查找
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.providers: List[CompiledProvider] = [CompiledProvider(provider_config)
+                                                  for provider_config in config.get("providers", [])]
+        # 按平台的第一个识别header建立索引，该header的值即原始事件类型
+        self.by_header: Dict[str, List[CompiledProvider]] = {}
+        for provider in self.providers:
+            if provider.header_rules:
+                self.by_header.setdefault(provider.header_rules[0][0], []).append(provider)
+
+    def route(self, headers) -> Optional[WebhookRoute]:
+        for header_name, providers in self.by_header.items():
+            original_event_type = headers.get(header_name)
+            if not original_event_type:
+                continue
+            for provider in providers:
+                if provider.matches(headers):
+                    return WebhookRoute(provider, original_event_type)
+        return None
+
+
 class GitProviderManager:
+    """
+    加载 conf/git_providers.json 并编译为分发表，文件修改后自动重新加载，无需重启服务
+    """
+
     def __init__(self, config_path="conf/git_providers.json"):
         self.config_path = config_path
+        self.reload_interval = float(os.getenv('GIT_PROVIDERS_RELOAD_INTERVAL', 1))
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
         self.providers_config = self._load_config()
+        self.table = DispatchTable(self.providers_config)
+
+    def _config_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.config_path).st_mtime
+        except OSError:
+            return None
 
     def _load_config(self) -> Dict[str, Any]:
-        if not os.path.exists(self.config_path):
-            return {"providers": []}
+        self._mtime = self._config_mtime()
+        if self._mtime is None:
+            return DEFAULT_PROVIDERS_CONFIG
         with open(self.config_path, 'r', encoding='utf-8') as f:
             return json.load(f)
 
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        if self._config_mtime() == self._mtime:
+            return
+        with self._lock:
+            if self._config_mtime() == self._mtime:
+                return
+            try:
+                providers_config = self._load_config()
+                table = DispatchTable(providers_config)
+            except Exception as e:
+                # 配置有误时继续使用旧的分发表
+                logger.error(f"Failed to reload {self.config_path}, keeping previous providers: {e}")
+                return
+            # 一次赋值完成切换，正在处理的请求继续使用旧的分发表
+            self.providers_config, self.table = providers_config, table
+            logger.info(f"Git providers reloaded from {self.config_path}: "
+                        f"{', '.join(provider.name for provider in table.providers)}")
+
+    def route(self, headers) -> Optional[WebhookRoute]:
+        self._reload_if_changed()
+        return self.table.route(headers)
+
     def get_provider_config(self, provider_name: str) -> Optional[Dict[str, Any]]:
         for provider in self.providers_config.get("providers", []):
             if provider["name"] == provider_name:
@@ -20,33 +255,11 @@ class GitProviderManager:
         return None
 
     def identify_provider(self, headers: Dict[str, str]) -> Optional[Dict[str, Any]]:
-        # 打印一下 headers
-        logger.info(f"headers: {headers}")
-        for provider_config in self.providers_config.get("providers", []):
-            identification_rules = provider_config.get("identification", {})
-            headers_rules = identification_rules.get("headers", {})
-
-            # Check if all header rules match
-            match = True
-            for header_name, expected_values in headers_rules.items():
-                actual_value = headers.get(header_name)
-                if not actual_value or actual_value not in expected_values:
-                    match = False
-                    break
-            if match:
-                return provider_config
-        # 默认返回 gitlab 的 配置
-        return self.get_provider_config("gitlab")
+        route = self.route(headers)
+        return route.provider.config if route else None
 
     def get_access_token(self, provider_config: Dict[str, Any], request_headers: Dict[str, str]) -> Optional[str]:
-        credentials_config = provider_config.get("credentials", {})
-        cred_type = credentials_config.get("type")
-        cred_key = credentials_config.get("key")
-
-        if cred_type == "env" and cred_key:
-            return os.getenv(cred_key)
-        # Add other credential types (e.g., from request headers, payload) here if needed
-        return None
+        return access_token_from_config(provider_config)
 
     def get_payload_parser_path(self, provider_config: Dict[str, Any]) -> Optional[str]:
         return provider_config.get("payload_parser")
@@ -0,0 +1,68 @@
+import os
+from typing import Any, Callable, Optional
+
+from biz.utils.kv_store import KVStore, get_kv_store
+from biz.utils.log import logger
+
+FIELD_PROTECTED_BRANCHES = 'protected_branches'
+
+
+class ProjectMetadataCache:
+    """
+    项目元数据(受保护分支、默认分支、项目名称等变化缓慢的数据)缓存，按 (host, project, field) 缓存，带TTL，
+    存储在KVStore中，多个worker进程共享。
+    收到平台的项目设置变更事件(GitHub branch_protection_rule / repository、GitLab 系统钩子的项目事件)时显式失效，
+    其他变更(如 GitLab 修改受保护分支)没有事件通知，最多 PROJECT_METADATA_CACHE_TTL 秒后生效。
+    """
+
+    def __init__(self, store: KVStore = None, ttl: float = None):
+        self._store = store
+        self.ttl = ttl if ttl is not None else float(os.getenv('PROJECT_METADATA_CACHE_TTL', 300))
+
+    @property
+    def store(self) -> KVStore:
+        if self._store is None:
+            self._store = get_kv_store()
+        return self._store
+
+    @staticmethod
+    def _key(host: str, project: Any, field: str = '') -> str:
+        return f"project_meta:{host}:{project}:{field}"
+
+    def get_or_load(self, host: str, project: Any, field: str, loader: Callable[[], Optional[Any]]) -> Optional[Any]:
+        """
+        优先从缓存读取，未命中时调用loader加载并写入缓存；loader返回None表示加载失败，不写入缓存
+        """
+        if self.ttl <= 0:
+            return loader()
+
+        key = self._key(host, project, field)
+        try:
+            cached = self.store.get(key)
+        except Exception as e:
+            logger.warn(f"Failed to read project metadata cache {key}: {e}")
+            return loader()
+        if cached is not None:
+            logger.debug(f"Project metadata cache hit: {key}")
+            return cached
+
+        value = loader()
+        if value is not None:
+            try:
+                self.store.set(key, value, ttl=self.ttl)
+            except Exception as e:
+                logger.warn(f"Failed to write project metadata cache {key}: {e}")
+        return value
+
+    def invalidate(self, host: str, project: Any, field: str = None):
+        """
+        使缓存失效，未指定field时使该项目的全部元数据失效
+        """
+        if field:
+            self.store.delete(self._key(host, project, field))
+        else:
+            self.store.delete_prefix(self._key(host, project))
+        logger.info(f"Project metadata cache invalidated: {host} {project} {field or '*'}")
+
+
+project_metadata_cache = ProjectMetadataCache()
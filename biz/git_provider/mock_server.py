@@ -0,0 +1,411 @@
+"""
+本地 Git 平台 API 模拟服务，用于离线压测和调试获取 diff 的链路（分页、缓存、限流、失败重试等）。
+
+支持 GitLab(/api/v4)、GitHub(/repos 或 /api/v3/repos) 和 Gitea(/api/v1) 中 handler 调用的接口：
+MR/PR 的 changes 和 files、commits、compare、受保护分支以及发表评论。
+优先返回 fixtures 目录中录制的响应，没有录制时返回按参数生成的数据。
+
+启动示例：
+    python -m biz.git_provider.mock_server --port 9000 --latency 0.2 --failure-rate 0.05 --rate-limit 500
+然后将 webhook 中的 GitLab / Gitea 地址，或 GITHUB_API_URL 指向 http://127.0.0.1:9000
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from flask import Flask, Response, jsonify, request
+
+GITLAB_PREFIX = '/api/v4/projects/<path:project>'
+GITEA_PREFIX = '/api/v1/repos/<owner>/<repo>'
+GITHUB_PREFIXES = ('/repos/<owner>/<repo>', '/api/v3/repos/<owner>/<repo>')
+
+
+class MockSettings:
+    """
+    模拟服务的参数，未指定时读取 MOCK_* 环境变量，运行中可通过 POST /_mock/settings 修改
+    """
+
+    def __init__(self, **kwargs):
+        self.latency = float(os.getenv('MOCK_LATENCY', 0))
+        self.jitter = float(os.getenv('MOCK_JITTER', 0))
+        self.failure_rate = float(os.getenv('MOCK_FAILURE_RATE', 0))
+        self.failure_status = int(os.getenv('MOCK_FAILURE_STATUS', 502))
+        self.rate_limit = int(os.getenv('MOCK_RATE_LIMIT', 5000))
+        self.rate_limit_window = int(os.getenv('MOCK_RATE_LIMIT_WINDOW', 3600))
+        self.files = int(os.getenv('MOCK_FILES', 20))
+        self.commits = int(os.getenv('MOCK_COMMITS', 5))
+        self.diff_lines = int(os.getenv('MOCK_DIFF_LINES', 20))
+        self.fixtures_dir = os.getenv('MOCK_FIXTURES_DIR', '')
+        self.record_upstream = os.getenv('MOCK_RECORD_UPSTREAM', '')
+        self.seed = os.getenv('MOCK_SEED')
+        self.update(**kwargs)
+
+    def update(self, **kwargs):
+        for name, value in kwargs.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown mock setting: {name}")
+            if value is not None:
+                setattr(self, name, value)
+
+
+def _sha(*parts) -> str:
+    return hashlib.sha1('/'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def _provider() -> str:
+    if request.path.startswith('/api/v4/'):
+        return 'gitlab'
+    if request.path.startswith('/api/v1/'):
+        return 'gitea'
+    return 'github'
+
+
+class RateLimiter:
+    """按令牌统计固定窗口内的请求数，返回各平台格式的限流响应头"""
+
+    def __init__(self, settings: MockSettings):
+        self.settings = settings
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def _window(self, token: str) -> dict:
+        now = time.time()
+        window = self.windows.get(token)
+        if window is None or now >= window['reset']:
+            window = self.windows[token] = {'used': 0, 'reset': int(now) + self.settings.rate_limit_window}
+        return window
+
+    def exhausted(self, token: str) -> bool:
+        with self.lock:
+            return self._window(token)['used'] >= self.settings.rate_limit
+
+    def charge(self, token: str):
+        with self.lock:
+            self._window(token)['used'] += 1
+
+    def headers(self, token: str, provider: str) -> dict:
+        with self.lock:
+            window = self._window(token)
+            remaining = max(self.settings.rate_limit - window['used'], 0)
+        prefix = 'RateLimit' if provider == 'gitlab' else 'X-RateLimit'
+        return {f'{prefix}-Limit': str(self.settings.rate_limit), f'{prefix}-Remaining': str(remaining),
+                f'{prefix}-Reset': str(window['reset'])}
+
+    def reset(self):
+        with self.lock:
+            self.windows.clear()
+
+
+class SyntheticRepo:
+    """根据项目和MR/PR编号生成确定性的变更文件和提交"""
+
+    def __init__(self, settings: MockSettings):
+        self.settings = settings
+
+    def files(self, project, number) -> list:
+        files = []
+        for i in range(self.settings.files):
+            path = f"src/module_{i // 10}/file_{i}.py"
+            lines = []
+            for line in range(self.settings.diff_lines):
+                lines.append(f"-    value_{line} = old_call({line})")
+                lines.append(f"+    value_{line} = new_call({line}, '{project}#{number}')")
+            diff = f"@@ -1,{self.settings.diff_lines} +1,{self.settings.diff_lines} @@\n" + '\n'.join(lines) + '\n'
+            files.append({'path': path, 'diff': diff, 'additions': self.settings.diff_lines,
+                          'deletions': self.settings.diff_lines, 'sha': _sha(project, number, path)})
+        return files
+
+    def commits(self, project, number) -> list:
+        commits = []
+        for i in range(self.settings.commits):
+            commits.append({'sha': _sha(project, number, 'commit', i),
+                            'parent': _sha(project, number, 'commit', i - 1),
+                            'message': f"feat: change {i} of {project}#{number}",
+                            'author': 'mock', 'email': 'mock@example.com',
+                            'date': '2026-01-01T00:00:00Z'})
+        return commits
+
+
+def _gitlab_diff(file: dict) -> dict:
+    return {'old_path': file['path'], 'new_path': file['path'], 'a_mode': '100644', 'b_mode': '100644',
+            'new_file': False, 'renamed_file': False, 'deleted_file': False, 'diff': file['diff']}
+
+
+def _gitlab_commit(commit: dict) -> dict:
+    return {'id': commit['sha'], 'short_id': commit['sha'][:8], 'title': commit['message'],
+            'message': commit['message'], 'author_name': commit['author'], 'author_email': commit['email'],
+            'created_at': commit['date'], 'parent_ids': [commit['parent']], 'web_url': ''}
+
+
+def _github_file(file: dict) -> dict:
+    return {'sha': file['sha'], 'filename': file['path'], 'status': 'modified', 'additions': file['additions'],
+            'deletions': file['deletions'], 'changes': file['additions'] + file['deletions'], 'patch': file['diff']}
+
+
+def _github_commit(commit: dict) -> dict:
+    return {'sha': commit['sha'], 'html_url': '', 'parents': [{'sha': commit['parent']}],
+            'commit': {'message': commit['message'],
+                       'author': {'name': commit['author'], 'email': commit['email'], 'date': commit['date']}}}
+
+
+def _paginate(items: list, default_per_page: int = 20) -> Response:
+    page = max(int(request.args.get('page', 1)), 1)
+    per_page = min(max(int(request.args.get('per_page', request.args.get('limit', default_per_page))), 1), 100)
+    total_pages = max((len(items) + per_page - 1) // per_page, 1)
+    response = jsonify(items[(page - 1) * per_page:page * per_page])
+
+    if _provider() == 'gitlab':
+        response.headers['X-Page'] = str(page)
+        response.headers['X-Per-Page'] = str(per_page)
+        response.headers['X-Total'] = str(len(items))
+        response.headers['X-Total-Pages'] = str(total_pages)
+        response.headers['X-Next-Page'] = str(page + 1) if page < total_pages else ''
+    else:
+        args = {name: value for name, value in request.args.items() if name != 'page'}
+        query = '&'.join(f"{name}={value}" for name, value in args.items())
+        base = f"{request.base_url}?{query + '&' if query else ''}page="
+        links = []
+        if page < total_pages:
+            links.append(f'<{base}{page + 1}>; rel="next"')
+        links.append(f'<{base}{total_pages}>; rel="last"')
+        response.headers['Link'] = ', '.join(links)
+    return response
+
+
+def create_app(settings: MockSettings = None) -> Flask:
+    settings = settings or MockSettings()
+    app = Flask(__name__)
+    limiter = RateLimiter(settings)
+    synthetic = SyntheticRepo(settings)
+    rng = random.Random(settings.seed)
+    notes = []
+    app.config['MOCK_SETTINGS'] = settings
+    app.config['MOCK_NOTES'] = notes
+
+    def token() -> str:
+        return request.headers.get('Private-Token') or request.headers.get('Authorization') or ''
+
+    def fixture_path() -> str:
+        return os.path.join(settings.fixtures_dir, request.path.lstrip('/') + '.json')
+
+    def add_note(body: dict):
+        notes.append({'path': request.path, 'body': (body or {}).get('body') or (body or {}).get('note')})
+        return jsonify({'id': len(notes), 'body': notes[-1]['body']}), 201
+
+    @app.before_request
+    def simulate():
+        if request.path.startswith('/_mock/'):
+            return None
+        delay = settings.latency + (rng.uniform(0, settings.jitter) if settings.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        provider = _provider()
+        if limiter.exhausted(token()):
+            headers = limiter.headers(token(), provider)
+            if provider == 'github':
+                return Response(json.dumps({'message': 'API rate limit exceeded'}), 403, headers=headers,
+                                mimetype='application/json')
+            reset_at = int(headers.get('RateLimit-Reset') or headers.get('X-RateLimit-Reset'))
+            headers['Retry-After'] = str(max(int(reset_at - time.time()), 1))
+            return Response(json.dumps({'message': 'Retry later'}), 429, headers=headers, mimetype='application/json')
+
+        if settings.failure_rate and rng.random() < settings.failure_rate:
+            return jsonify({'message': 'Injected failure'}), settings.failure_status
+
+        if request.method == 'GET' and settings.fixtures_dir:
+            path = fixture_path()
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    return Response(f.read(), 200, mimetype='application/json')
+            if settings.record_upstream:
+                # 录制模式：转发到真实平台并保存响应
+                upstream = requests.get(f"{settings.record_upstream.rstrip('/')}{request.full_path.rstrip('?')}",
+                                        headers={name: value for name, value in request.headers.items()
+                                                 if name in ('Private-Token', 'Authorization', 'Accept')},
+                                        timeout=60)
+                if upstream.status_code == 200:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, 'w', encoding='utf-8') as f:
+                        f.write(upstream.text)
+                return Response(upstream.content, upstream.status_code,
+                                mimetype=upstream.headers.get('Content-Type', 'application/json'))
+        return None
+
+    @app.after_request
+    def finalize(response: Response) -> Response:
+        if request.path.startswith('/_mock/'):
+            return response
+        if request.method == 'GET' and response.status_code == 200 and not response.direct_passthrough:
+            etag = f'"{hashlib.sha1(response.get_data()).hexdigest()}"'
+            response.headers['ETag'] = etag
+            if request.headers.get('If-None-Match') == etag:
+                response.status_code = 304
+                response.set_data(b'')
+        provider = _provider()
+        # GitHub 的304响应不计入配额
+        if response.status_code not in (403, 429) and not (provider == 'github' and response.status_code == 304):
+            limiter.charge(token())
+        response.headers.update(limiter.headers(token(), provider))
+        return response
+
+    # ---------------- GitLab ----------------
+    @app.get(f'{GITLAB_PREFIX}/merge_requests/<int:iid>')
+    def gitlab_merge_request(project, iid):
+        commits = synthetic.commits(project, iid)
+        return jsonify({'iid': iid, 'merge_status': 'can_be_merged', 'detailed_merge_status': 'mergeable',
+                        'diff_refs': {'base_sha': commits[0]['parent'], 'head_sha': commits[-1]['sha'],
+                                      'start_sha': commits[0]['parent']}})
+
+    @app.get(f'{GITLAB_PREFIX}/merge_requests/<int:iid>/changes')
+    def gitlab_merge_request_changes(project, iid):
+        return jsonify({'iid': iid, 'changes': [_gitlab_diff(file) for file in synthetic.files(project, iid)]})
+
+    @app.get(f'{GITLAB_PREFIX}/merge_requests/<int:iid>/diffs')
+    def gitlab_merge_request_diffs(project, iid):
+        return _paginate([_gitlab_diff(file) for file in synthetic.files(project, iid)])
+
+    @app.get(f'{GITLAB_PREFIX}/merge_requests/<int:iid>/commits')
+    def gitlab_merge_request_commits(project, iid):
+        return _paginate([_gitlab_commit(commit) for commit in synthetic.commits(project, iid)])
+
+    @app.post(f'{GITLAB_PREFIX}/merge_requests/<int:iid>/notes')
+    def gitlab_merge_request_notes(project, iid):
+        return add_note(request.get_json(silent=True))
+
+    @app.get(f'{GITLAB_PREFIX}/protected_branches')
+    def gitlab_protected_branches(project):
+        return _paginate([{'name': 'main'}, {'name': 'release/*'}])
+
+    @app.get(f'{GITLAB_PREFIX}/repository/compare')
+    def gitlab_compare(project):
+        key = f"{request.args.get('from')}...{request.args.get('to')}"
+        return jsonify({'commits': [_gitlab_commit(commit) for commit in synthetic.commits(project, key)],
+                        'diffs': [_gitlab_diff(file) for file in synthetic.files(project, key)]})
+
+    @app.get(f'{GITLAB_PREFIX}/repository/commits')
+    def gitlab_commits(project):
+        return _paginate([_gitlab_commit(commit) for commit in synthetic.commits(project, request.args.get('ref_name'))])
+
+    @app.post(f'{GITLAB_PREFIX}/repository/commits/<sha>/comments')
+    def gitlab_commit_comments(project, sha):
+        return add_note(request.get_json(silent=True))
+
+    # ---------------- GitHub ----------------
+    def github_pull_files(owner, repo, number):
+        return _paginate([_github_file(file) for file in synthetic.files(f"{owner}/{repo}", number)], 30)
+
+    def github_pull_commits(owner, repo, number):
+        return _paginate([_github_commit(commit) for commit in synthetic.commits(f"{owner}/{repo}", number)], 30)
+
+    def github_comments(owner, repo, number=None, sha=None):
+        return add_note(request.get_json(silent=True))
+
+    def github_branches(owner, repo):
+        return _paginate([{'name': 'main', 'protected': True}], 30)
+
+    def github_commit(owner, repo, sha):
+        return jsonify(_github_commit(synthetic.commits(f"{owner}/{repo}", sha)[-1]))
+
+    def github_commits(owner, repo):
+        return _paginate([_github_commit(commit) for commit in synthetic.commits(f"{owner}/{repo}",
+                                                                            request.args.get('sha'))], 30)
+
+    def github_compare(owner, repo, basehead):
+        project = f"{owner}/{repo}"
+        return jsonify({'commits': [_github_commit(commit) for commit in synthetic.commits(project, basehead)],
+                        'files': [_github_file(file) for file in synthetic.files(project, basehead)]})
+
+    for prefix in GITHUB_PREFIXES:
+        routes = [
+            ('/pulls/<int:number>/files', github_pull_files, ['GET']),
+            ('/pulls/<int:number>/commits', github_pull_commits, ['GET']),
+            ('/issues/<int:number>/comments', github_comments, ['POST']),
+            ('/commits/<sha>/comments', github_comments, ['POST']),
+            ('/branches', github_branches, ['GET']),
+            ('/commits/<sha>', github_commit, ['GET']),
+            ('/commits', github_commits, ['GET']),
+            ('/compare/<basehead>', github_compare, ['GET']),
+        ]
+        for rule, view, methods in routes:
+            app.add_url_rule(f"{prefix}{rule}",
+                             endpoint=f"github{prefix}{rule}", view_func=view, methods=methods)
+
+    # ---------------- Gitea ----------------
+    @app.get(f'{GITEA_PREFIX}/pulls/<int:number>/files')
+    def gitea_pull_files(owner, repo, number):
+        return _paginate([_github_file(file) for file in synthetic.files(f"{owner}/{repo}", number)], 30)
+
+    @app.get(f'{GITEA_PREFIX}/pulls/<int:number>/commits')
+    def gitea_pull_commits(owner, repo, number):
+        return _paginate([_github_commit(commit) for commit in synthetic.commits(f"{owner}/{repo}", number)], 30)
+
+    @app.post(f'{GITEA_PREFIX}/issues/<int:number>/comments')
+    def gitea_comments(owner, repo, number):
+        return add_note(request.get_json(silent=True))
+
+    @app.get(f'{GITEA_PREFIX}/branches')
+    def gitea_branches(owner, repo):
+        return _paginate([{'name': 'main', 'protected': True}], 30)
+
+    @app.get(f'{GITEA_PREFIX}/git/commits/<sha>.diff')
+    def gitea_commit_diff(owner, repo, sha):
+        files = synthetic.files(f"{owner}/{repo}", sha)
+        diff = ''.join(f"diff --git a/{file['path']} b/{file['path']}\n--- a/{file['path']}\n+++ b/{file['path']}\n"
+                       f"{file['diff']}" for file in files)
+        return Response(diff, 200, mimetype='text/plain')
+
+    @app.get(f'{GITEA_PREFIX}/compare/<basehead>')
+    def gitea_compare(owner, repo, basehead):
+        commits = synthetic.commits(f"{owner}/{repo}", basehead)
+        return jsonify({'total_commits': len(commits), 'commits': [_github_commit(commit) for commit in commits]})
+
+    # ---------------- 控制接口 ----------------
+    @app.get('/_mock/notes')
+    def mock_notes():
+        return jsonify(notes)
+
+    @app.post('/_mock/settings')
+    def mock_settings():
+        settings.update(**(request.get_json(silent=True) or {}))
+        return jsonify(vars(settings))
+
+    @app.post('/_mock/reset')
+    def mock_reset():
+        limiter.reset()
+        notes.clear()
+        return jsonify({'message': 'ok'})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock GitLab / GitHub / Gitea API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency', type=float, help='每个请求的固定延迟(秒)')
+    parser.add_argument('--jitter', type=float, help='在固定延迟上增加的随机延迟上限(秒)')
+    parser.add_argument('--failure-rate', type=float, help='随机返回失败响应的比例(0-1)')
+    parser.add_argument('--failure-status', type=int, help='注入失败时返回的状态码')
+    parser.add_argument('--rate-limit', type=int, help='每个令牌在限流窗口内允许的请求数')
+    parser.add_argument('--rate-limit-window', type=int, help='限流窗口(秒)')
+    parser.add_argument('--files', type=int, help='每个MR/PR生成的变更文件数')
+    parser.add_argument('--commits', type=int, help='每个MR/PR生成的提交数')
+    parser.add_argument('--diff-lines', type=int, help='每个文件生成的修改行数')
+    parser.add_argument('--fixtures-dir', help='录制的响应目录，按请求路径保存为 .json 文件')
+    parser.add_argument('--record-upstream', help='录制模式：未命中fixtures时转发到该地址并保存响应')
+    parser.add_argument('--seed', help='随机数种子，用于复现失败注入和延迟')
+    args = parser.parse_args()
+
+    options = {name: value for name, value in vars(args).items() if name not in ('host', 'port')}
+    app = create_app(MockSettings(**options))
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -72,3 +72,23 @@ def coding_parser(data: Dict[str, Any], token: str, coding_url: str, event_type:
     coding_url_slug = slugify_url(coding_url)
 
     return WebhookEvent("coding", event_type, data, token, coding_url, coding_url_slug)
+
+
+def summarize_payload(data: Dict[str, Any], max_length: int = 200) -> str:
+    """
+    生成用于日志的payload摘要，只包含项目、分支、MR/PR编号等少量字段，长度有上限
+    """
+    project = data.get('project') or {}
+    repository = data.get('repository') or {}
+    attributes = data.get('object_attributes') or data.get('pull_request') or data.get('mergeRequest') or {}
+    fields = {
+        'project': project.get('path_with_namespace') or repository.get('full_name') or repository.get('name'),
+        'kind': data.get('object_kind') or data.get('event_name'),
+        'action': data.get('action') or attributes.get('action'),
+        'number': attributes.get('iid') or attributes.get('number'),
+        'ref': data.get('ref') or attributes.get('source_branch'),
+        'after': (data.get('after') or '')[:12],
+        'commits': len(data.get('commits') or []) or None,
+    }
+    summary = ', '.join(f"{name}={value}" for name, value in fields.items() if value)
+    return summary[:max_length]
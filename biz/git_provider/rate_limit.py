@@ -0,0 +1,183 @@
+import os
+import time
+from typing import Any, Callable, Optional, Tuple
+
+from biz.queue.deferral import JobDeferred, can_defer
+from biz.utils.kv_store import KVStore, get_kv_store
+from biz.utils.log import logger
+
+# 请求优先级：MR/PR 审查所需的调用优先于 Push 审查等调用
+PRIORITY_HIGH = 'high'
+PRIORITY_LOW = 'low'
+
+# 并发更新限流状态冲突时的重试次数，超过后不再扣减配额
+CAS_RETRIES = 10
+
+
+def _header_int(headers, *names) -> Optional[int]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return int(float(value))
+            except ValueError:
+                continue
+    return None
+
+
+def parse_reset_at(headers, now: float) -> Optional[float]:
+    """
+    GitHub / Gitea 的 X-RateLimit-Reset 和 GitLab 的 RateLimit-Reset 为重置时间的 Unix 时间戳，
+    个别实现返回的是距重置的秒数，小于10年秒数的值按相对时间处理
+    """
+    reset = _header_int(headers, 'X-RateLimit-Reset', 'RateLimit-Reset')
+    if reset is None:
+        return None
+    return float(reset) if reset > 315360000 else now + reset
+
+
+class RateLimitScheduler:
+    """
+    根据 Git 平台返回的限流响应头(X-RateLimit-* / RateLimit-*)调度请求：
+    剩余配额不足时平摊到重置时间之前发送，低优先级请求为高优先级请求预留配额，
+    配额耗尽(403/429)时等待重置后重试，而不是直接失败。
+    限流状态保存在KVStore中，多个worker进程、节点共享同一个令牌的配额；
+    任务在可推迟的阶段(获取变更等)需要等待 PROVIDER_RATE_LIMIT_DEFER_AFTER 秒以上时抛出 JobDeferred，
+    由队列推迟后重新投递，不占用worker等待。
+    """
+
+    def __init__(self, store: KVStore = None):
+        self._store = store
+        self.low_priority_reserve = float(os.getenv('PROVIDER_RATE_LIMIT_RESERVE', 0.1))
+        self.pacing_threshold = float(os.getenv('PROVIDER_RATE_LIMIT_PACING_THRESHOLD', 0.2))
+        self.max_wait = float(os.getenv('PROVIDER_RATE_LIMIT_MAX_WAIT', 300))
+        self.defer_after = float(os.getenv('PROVIDER_RATE_LIMIT_DEFER_AFTER', 10))
+
+    @property
+    def store(self) -> KVStore:
+        if self._store is None:
+            self._store = get_kv_store()
+        return self._store
+
+    @staticmethod
+    def _key(key: str) -> str:
+        return f"provider_rate_limit:{key}"
+
+    def state(self, key: str) -> Optional[dict]:
+        return self.store.get(self._key(key))
+
+    def _update(self, key: str, update: Callable[[Optional[dict]], Tuple[Optional[dict], Any]]) -> Any:
+        """
+        以 compare_and_set 读-改-写限流状态：update(当前状态) 返回(新状态, 结果)，新状态为None时不写入；
+        多个进程同时更新时重新读取后重试
+        """
+        state_key = self._key(key)
+        for _ in range(CAS_RETRIES):
+            state = self.store.get(state_key)
+            new_state, result = update(state)
+            if new_state is None:
+                return result
+            # 重置时间之后状态失效，重新从响应头获取
+            ttl = max((new_state.get('reset_at') or 0) - time.time(), 0) + 60
+            if state is None:
+                if self.store.add(state_key, new_state, ttl=ttl):
+                    return result
+            elif self.store.compare_and_set(state_key, state, new_state, ttl=ttl):
+                return result
+        logger.warn(f"Rate limit state for {key.split('#')[0]} is highly contended, update skipped.")
+        return result
+
+    def _wait_time(self, state: Optional[dict], priority: str, now: float) -> float:
+        if not state or state.get('remaining') is None or state.get('reset_at') is None or now >= state['reset_at']:
+            return 0.0
+        remaining = state['remaining']
+        until_reset = state['reset_at'] - now
+        if remaining <= 0:
+            return until_reset
+
+        limit = state.get('limit') or remaining
+        if priority == PRIORITY_LOW and remaining <= limit * self.low_priority_reserve:
+            return until_reset
+
+        if remaining <= limit * self.pacing_threshold:
+            interval = until_reset / remaining
+            return max(0.0, state.get('last_sent_at', 0.0) + interval - now)
+        return 0.0
+
+    def reserve(self, key: str, priority: str = PRIORITY_HIGH) -> float:
+        """
+        尝试占用一次请求配额，返回需要等待的秒数，0 表示可以立即发送
+        """
+        def update(state):
+            now = time.time()
+            wait = self._wait_time(state, priority, now)
+            if wait > 0 or not state:
+                return None, wait
+            state = {**state, 'last_sent_at': now}
+            if state.get('remaining') is not None and state.get('reset_at') and now < state['reset_at']:
+                # 乐观扣减，避免并发请求在收到响应前超发
+                state['remaining'] -= 1
+            return state, 0.0
+
+        try:
+            wait = self._update(key, update)
+        except Exception as e:
+            logger.warn(f"Failed to read rate limit state for {key.split('#')[0]}: {e}")
+            return 0.0
+        if wait <= 0:
+            return 0.0
+        wait = min(wait, self.max_wait)
+        logger.info(f"Rate limit for {key.split('#')[0]} is low (priority={priority}), "
+                    f"waiting {wait:.1f}s before next request.")
+        return wait
+
+    def wait(self, key: str, seconds: float):
+        """
+        等待限流：任务在可推迟的阶段且等待时间较长时抛出 JobDeferred，由队列推迟后重新投递，否则在当前线程等待
+        """
+        if seconds >= self.defer_after and can_defer():
+            raise JobDeferred(seconds, f"rate limit for {key.split('#')[0]} is low")
+        time.sleep(seconds)
+
+    def before_request(self, key: str, priority: str = PRIORITY_HIGH):
+        """发送请求前调用，必要时等待"""
+        while True:
+            wait = self.reserve(key, priority)
+            if wait <= 0:
+                return
+            self.wait(key, wait)
+
+    def after_response(self, key: str, response) -> float:
+        """
+        根据响应头更新限流状态，返回因限流需要等待后重试的秒数，0 表示无需重试
+        """
+        now = time.time()
+        headers = response.headers
+        remaining = _header_int(headers, 'X-RateLimit-Remaining', 'RateLimit-Remaining')
+        reset_at = None
+        if remaining is not None:
+            def update(state):
+                state = dict(state or {})
+                state['remaining'] = remaining
+                state['limit'] = _header_int(headers, 'X-RateLimit-Limit', 'RateLimit-Limit') or state.get('limit')
+                state['reset_at'] = parse_reset_at(headers, now) or state.get('reset_at')
+                return state, state['reset_at']
+
+            try:
+                reset_at = self._update(key, update)
+            except Exception as e:
+                logger.warn(f"Failed to update rate limit state for {key.split('#')[0]}: {e}")
+                reset_at = parse_reset_at(headers, now)
+
+        if response.status_code not in (403, 429):
+            return 0.0
+        retry_after = _header_int(headers, 'Retry-After')
+        if retry_after is not None:
+            return min(float(retry_after), self.max_wait)
+        if remaining == 0 and reset_at:
+            return min(max(reset_at - now, 1.0), self.max_wait)
+        # 429 没有任何提示时短暂退避；403 且配额未耗尽属于权限问题，不重试
+        return 5.0 if response.status_code == 429 else 0.0
+
+
+rate_limit_scheduler = RateLimitScheduler()
@@ -0,0 +1,133 @@
+import functools
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from typing import Any, Callable, Optional
+
+from biz.utils.log import logger
+
+# 只缓存完整的 SHA-1/SHA-256，分支名、短SHA等可变引用不缓存
+FULL_SHA_PATTERN = re.compile(r'^(?:[0-9a-f]{40}|[0-9a-f]{64})$')
+
+
+class ShaCache:
+    """
+    基于内容寻址的磁盘缓存，按 (host, project, kind, sha 或 sha对) 缓存提交元数据、compare结果、diff等不可变数据。
+    总大小超过上限时按最近访问时间(LRU)淘汰。
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        self.cache_dir = cache_dir or os.getenv('SHA_CACHE_DIR', 'data/cache/sha')
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv('SHA_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+        self._size = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, host: str, project: Any, kind: str, shas: tuple) -> str:
+        key = json.dumps([host, str(project), kind, list(shas)])
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.json")
+
+    def get(self, host: str, project: Any, kind: str, *shas: str) -> Optional[Any]:
+        path = self._path(host, project, kind, shas)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            # 更新访问时间，用于LRU淘汰
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warn(f"Failed to read sha cache {path}: {e}")
+            return None
+
+    def set(self, host: str, project: Any, kind: str, shas: tuple, value: Any):
+        path = self._path(host, project, kind, shas)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再原子替换，避免并发读取到不完整的内容
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warn(f"Failed to write sha cache {path}: {e}")
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _scan_files(self) -> list:
+        files = []
+        if not os.path.isdir(self.cache_dir):
+            return files
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._scan_files())
+
+    def _evict(self):
+        """淘汰最久未访问的缓存，直到总大小降到上限的80%"""
+        files = sorted(self._scan_files())
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.8
+        removed = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        self._size = total
+        logger.info(f"Sha cache evicted {removed} entries, size now {total} bytes.")
+
+    def cached(self, kind: str, scope: Callable[[Any], tuple]):
+        """
+        装饰handler方法，方法的位置参数为sha；仅当所有参数都是完整sha且结果非空时缓存
+        :param kind: 缓存类型，如 compare、parent、commit_diff
+        :param scope: 根据handler返回 (host, project)
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(handler, *shas):
+                if not self.enabled or not all(isinstance(sha, str) and FULL_SHA_PATTERN.match(sha) for sha in shas):
+                    return func(handler, *shas)
+                host, project = scope(handler)
+                cached = self.get(host, project, kind, *shas)
+                if cached is not None:
+                    logger.debug(f"Sha cache hit: {kind} {project} {shas}")
+                    return cached
+                result = func(handler, *shas)
+                if result:
+                    self.set(host, project, kind, shas, result)
+                return result
+
+            return wrapper
+
+        return decorator
+
+
+sha_cache = ShaCache()
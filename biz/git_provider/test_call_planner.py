@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import time
+from unittest import TestCase, main
+
+from biz.git_provider.call_planner import ProviderCallPlanner, ProviderCallTimeout
+from biz.queue.deferral import can_defer, deferrable
+
+
+# @Describe:
+class TestProviderCallPlanner(TestCase):
+    def test_run_concurrently(self):
+        """测试并发执行调用并按名称返回结果"""
+        planner = ProviderCallPlanner(deadline=5)
+        planner.add('a', lambda: 1).add('b', lambda x: x * 2, 21)
+        self.assertEqual(planner.run(), {'a': 1, 'b': 42})
+        self.assertEqual(planner.run(), {})
+
+    def test_phases_share_deadline(self):
+        """测试多次run共享同一个截止时间，第二阶段只能使用剩余的时间"""
+        planner = ProviderCallPlanner(deadline=0.3)
+        planner.add('checks', time.sleep, 0.2)
+        planner.run()
+        planner.add('fetches', time.sleep, 0.2)
+        with self.assertRaises(ProviderCallTimeout):
+            planner.run()
+
+    def test_context_propagates(self):
+        """测试调用在调用方的上下文中执行，可推迟阶段的限流等待可以推迟任务"""
+        with deferrable():
+            self.assertEqual(ProviderCallPlanner(deadline=5).add('deferrable', can_defer).run(), {'deferrable': True})
+        self.assertEqual(ProviderCallPlanner(deadline=5).add('deferrable', can_defer).run(), {'deferrable': False})
+
+    def test_exception_propagates(self):
+        """测试调用抛出的异常重新抛出"""
+        planner = ProviderCallPlanner(deadline=5)
+        planner.add('fail', lambda: 1 / 0)
+        with self.assertRaises(ZeroDivisionError):
+            planner.run()
+
+
+if __name__ == '__main__':
+    main()
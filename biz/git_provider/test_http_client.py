@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import requests
+
+from biz.git_provider import http_client
+from biz.git_provider.rate_limit import RateLimitScheduler, PRIORITY_HIGH, PRIORITY_LOW
+from biz.git_provider.sha_cache import ShaCache
+from biz.queue.deferral import deferrable, JobDeferred
+from biz.utils.kv_store import SqliteKVStore
+
+
+class EtagHandler(BaseHTTPRequestHandler):
+    """返回带ETag的固定内容，命中If-None-Match时返回304"""
+    requests_seen = []
+
+    def do_GET(self):
+        EtagHandler.requests_seen.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('X-RateLimit-Remaining', '4999')
+            self.end_headers()
+            return
+        body = json.dumps([{'filename': 'a.py'}]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', '"v1"')
+        self.send_header('Link', '<http://example/?page=2>; rel="next"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# @Describe:
+class TestConditionalGet(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        EtagHandler.requests_seen = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), EtagHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/repos/o/r/pulls/1/files"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_patch = patch.object(http_client, 'etag_cache', ShaCache(cache_dir=self.tmp_dir.name))
+        self.cache_patch.start()
+        self.scheduler_patch = patch.object(http_client, 'rate_limit_scheduler',
+                                            RateLimitScheduler(SqliteKVStore(f"{self.tmp_dir.name}/kv.db")))
+        self.scheduler_patch.start()
+
+    def tearDown(self):
+        self.scheduler_patch.stop()
+        self.cache_patch.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def test_revalidate_with_etag(self):
+        """测试第二次请求携带If-None-Match，304时返回缓存内容"""
+        headers = {'Authorization': 'token t1'}
+        first = http_client.get(self.url, headers=headers)
+        second = http_client.get(self.url, headers=headers)
+
+        self.assertEqual(EtagHandler.requests_seen, [None, '"v1"'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+        self.assertIn('rel="next"', second.headers['Link'])
+        self.assertEqual(second.headers['X-RateLimit-Remaining'], '4999')
+
+    def test_cache_varies_by_token(self):
+        """测试不同令牌不共享缓存"""
+        http_client.get(self.url, headers={'Authorization': 'token t1'})
+        http_client.get(self.url, headers={'Authorization': 'token t2'})
+        self.assertEqual(EtagHandler.requests_seen, [None, None])
+
+
+    def test_async_transport_matches_session(self):
+        """测试通过共享异步客户端发送的请求与 requests.Session 返回相同的响应，连接失败抛出 requests 的异常"""
+        responses = []
+        for enabled in ('1', '0'):
+            with patch.dict('os.environ', {'PROVIDER_ASYNC_HTTP_ENABLED': enabled, 'PROVIDER_ETAG_CACHE_ENABLED': '0'}):
+                responses.append(http_client.get(self.url, headers={'Authorization': 'token t1'}))
+        self.assertEqual([(r.status_code, r.json(), r.headers['Link']) for r in responses[:1]],
+                         [(r.status_code, r.json(), r.headers['Link']) for r in responses[1:]])
+
+        port = self.server.server_address[1]
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            http_client.get(f"http://127.0.0.1:{port}/", timeout=5)
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, headers: dict):
+        self.status_code = status_code
+        self.headers = headers
+
+
+class TestRateLimitScheduler(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = SqliteKVStore(f"{self.tmp_dir.name}/kv.db")
+        self.scheduler = RateLimitScheduler(self.store)
+        self.reset_at = int(time.time()) + 600
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def low_quota(self):
+        self.scheduler.after_response('k', FakeResponse(200, {
+            'X-RateLimit-Limit': '5000', 'X-RateLimit-Remaining': '300', 'X-RateLimit-Reset': str(self.reset_at)}))
+
+    def test_low_priority_waits_for_reserve(self):
+        """测试剩余配额低于预留值时，低优先级请求等待而高优先级请求继续"""
+        self.low_quota()
+        state = self.scheduler.state('k')
+        now = time.time()
+        self.assertGreater(self.scheduler._wait_time(state, PRIORITY_LOW, now), 500)
+        self.assertLess(self.scheduler._wait_time(state, PRIORITY_HIGH, now), 5)
+
+    def test_state_shared_between_processes(self):
+        """测试限流状态保存在KVStore中，共享存储的调度器(其他进程)看到同一份配额和扣减"""
+        self.low_quota()
+        other = RateLimitScheduler(self.store)
+        self.assertGreater(other.reserve('k', PRIORITY_LOW), 0)
+        self.assertEqual(other.reserve('k', PRIORITY_HIGH), 0)
+        self.assertEqual(self.scheduler.state('k')['remaining'], 299)
+
+    def test_long_wait_deferred(self):
+        """测试可推迟的阶段中需要长时间等待的请求抛出 JobDeferred，而不是占用worker等待"""
+        self.low_quota()
+        with deferrable():
+            with self.assertRaises(JobDeferred) as context:
+                self.scheduler.before_request('k', PRIORITY_LOW)
+            self.assertEqual(context.exception.delay, self.scheduler.max_wait)
+            with deferrable(False), patch('time.sleep') as sleep:
+                self.scheduler.wait('k', 30)
+                sleep.assert_called_once_with(30)
+
+    def test_retry_after_rate_limited(self):
+        """测试限流响应返回需要等待的时间，权限不足的403不重试"""
+        wait = self.scheduler.after_response('k', FakeResponse(429, {'Retry-After': '7'}))
+        self.assertEqual(wait, 7)
+        wait = self.scheduler.after_response('k', FakeResponse(403, {
+            'RateLimit-Remaining': '0', 'RateLimit-Reset': str(self.reset_at)}))
+        self.assertEqual(wait, self.scheduler.max_wait)
+        wait = self.scheduler.after_response('other', FakeResponse(403, {'X-RateLimit-Remaining': '10'}))
+        self.assertEqual(wait, 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import json
+import os
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from biz.git_provider.manager import GitProviderManager, PROJECT_SETTINGS_EVENT
+from biz.github.webhook_handler import invalidate_project_metadata as invalidate_github_project_metadata
+from biz.gitlab.webhook_handler import invalidate_project_metadata as invalidate_gitlab_project_metadata
+from biz.queue.worker import handle_gitea_push_event, handle_merge_request_event
+
+
+# @Describe:
+class TestGitProviderManager(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config_path = os.path.join(self.tmp_dir.name, 'git_providers.json')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_default_dispatch_table(self):
+        """测试未提供配置文件时使用内置配置，按header分发到对应的处理函数"""
+        manager = GitProviderManager(self.config_path)
+        route = manager.route({'X-Gitlab-Event': 'Merge Request Hook'})
+        self.assertEqual(route.provider.name, 'gitlab')
+        self.assertEqual(route.event_type, 'pull_request')
+        self.assertIs(route.handler, handle_merge_request_event)
+
+        # Gitea 同时发送 X-GitHub-Event
+        route = manager.route({'X-Gitea-Event': 'push', 'X-GitHub-Event': 'push'})
+        self.assertEqual(route.provider.name, 'gitea')
+        self.assertIs(route.handler, handle_gitea_push_event)
+        self.assertIsNone(manager.route({'X-Unknown-Event': 'push'}))
+
+        # 仓库设置变更事件分发到清除项目元数据缓存的处理函数
+        route = manager.route({'X-GitHub-Event': 'branch_protection_rule'})
+        self.assertEqual(route.event_type, PROJECT_SETTINGS_EVENT)
+        self.assertIs(route.handler, invalidate_github_project_metadata)
+        self.assertEqual(manager.route({'X-Gitlab-Event': 'System Hook'}).event_type, PROJECT_SETTINGS_EVENT)
+
+    @patch('biz.gitlab.webhook_handler.project_metadata_cache')
+    def test_invalidate_gitlab_project_metadata(self, cache):
+        """测试GitLab系统钩子只有项目事件清除该项目的元数据缓存"""
+        self.assertFalse(invalidate_gitlab_project_metadata({'event_name': 'user_create'}, 'https://gitlab/'))
+        self.assertTrue(invalidate_gitlab_project_metadata({'event_name': 'project_update', 'project_id': 7},
+                                                           'https://gitlab/'))
+        cache.invalidate.assert_called_once_with('https://gitlab/', 7)
+
+    def test_reload_when_file_changes(self):
+        """测试配置文件修改后自动重新加载，配置有误时保留原分发表"""
+        config = {'providers': [{'name': 'gitlab', 'identification': {'headers': {'X-Gitlab-Event': ['Push Hook']}},
+                                 'payload_parser': 'biz.git_provider.parsers.gitlab_parser',
+                                 'event_mapping': {'Push Hook': 'push'}}]}
+        with open(self.config_path, 'w') as f:
+            json.dump(config, f)
+        manager = GitProviderManager(self.config_path)
+        manager.reload_interval = 0
+        self.assertIsNone(manager.route({'X-Gitlab-Event': 'Merge Request Hook'}))
+
+        config['providers'][0]['identification']['headers']['X-Gitlab-Event'].append('Merge Request Hook')
+        config['providers'][0]['event_mapping']['Merge Request Hook'] = 'pull_request'
+        with open(self.config_path, 'w') as f:
+            json.dump(config, f)
+        os.utime(self.config_path, (1, 1))
+        self.assertEqual(manager.route({'X-Gitlab-Event': 'Merge Request Hook'}).event_type, 'pull_request')
+
+        config['providers'][0]['payload_parser'] = 'biz.git_provider.parsers.missing_parser'
+        with open(self.config_path, 'w') as f:
+            json.dump(config, f)
+        os.utime(self.config_path, (2, 2))
+        self.assertEqual(manager.route({'X-Gitlab-Event': 'Push Hook'}).provider.name, 'gitlab')
+
+
+if __name__ == '__main__':
+    main()
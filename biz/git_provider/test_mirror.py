@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import base64
+import os
+import subprocess
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from biz.git_provider.mirror import LocalMirror, MirrorError
+
+
+def git(repo: str, *args) -> str:
+    return subprocess.run(['git', '-C', repo, '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args],
+                          check=True, capture_output=True, text=True).stdout.strip()
+
+
+def commit_file(repo: str, path: str, content: str, message: str) -> str:
+    full_path = os.path.join(repo, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'w') as f:
+        f.write(content)
+    git(repo, 'add', '-A')
+    git(repo, 'commit', '-q', '-m', message)
+    return git(repo, 'rev-parse', 'HEAD')
+
+
+# @Describe:
+class TestLocalMirror(TestCase):
+    def setUp(self):
+        """设置测试环境：本地源仓库包含 main 分支和 feature 分支"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp_dir.name, 'source')
+        os.makedirs(self.source)
+        git(self.source, 'init', '-q', '-b', 'main')
+        self.base = commit_file(self.source, 'src/app.py', 'a = 1\nb = 2\n', 'init')
+        commit_file(self.source, 'src/old.py', 'x = 1\n', 'add old')
+        git(self.source, 'checkout', '-q', '-b', 'feature')
+        commit_file(self.source, 'src/app.py', 'a = 1\nb = 3\n', 'change b')
+        git(self.source, 'mv', 'src/old.py', 'src/renamed.py')
+        git(self.source, 'commit', '-q', '-m', 'rename')
+        self.head = commit_file(self.source, 'src/new.py', 'y = 2\n', 'add new')
+        git(self.source, 'checkout', '-q', 'main')
+        self.main_head = commit_file(self.source, 'README.md', 'readme\n', 'docs on main')
+        self.mirror = LocalMirror(mirror_dir=os.path.join(self.tmp_dir.name, 'mirrors'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_compare(self):
+        """测试基于merge-base计算变更，并解析新增、重命名文件"""
+        repo_path = self.mirror.sync('gitlab', 'local', 1, self.source, shas=(self.main_head, self.head))
+        changes = {change['new_path']: change for change in self.mirror.compare(repo_path, self.main_head, self.head)}
+
+        self.assertEqual(set(changes), {'src/app.py', 'src/renamed.py', 'src/new.py'})
+        self.assertIn('-b = 2\n+b = 3', changes['src/app.py']['diff'])
+        self.assertTrue(changes['src/app.py']['diff'].startswith('@@'))
+        self.assertTrue(changes['src/new.py']['new_file'])
+        self.assertTrue(changes['src/renamed.py']['renamed_file'])
+        self.assertEqual(changes['src/renamed.py']['old_path'], 'src/old.py')
+        self.assertEqual(self.mirror.parent(repo_path, self.base), '')
+
+    def test_incremental_fetch(self):
+        """测试缺少提交时增量fetch，不存在的提交抛出异常"""
+        self.mirror.sync('gitlab', 'local', 1, self.source, shas=(self.head,))
+        new_head = commit_file(self.source, 'src/app.py', 'a = 2\n', 'change a')
+        repo_path = self.mirror.sync('gitlab', 'local', 1, self.source, shas=(new_head,))
+        self.assertEqual(self.mirror.parent(repo_path, new_head), self.main_head)
+
+        with self.assertRaises(MirrorError):
+            self.mirror.sync('gitlab', 'local', 1, self.source, shas=('f' * 40,))
+
+    def test_token_not_on_command_line(self):
+        """测试令牌通过环境变量传给git，不出现在命令行参数和镜像配置中"""
+        with patch('biz.git_provider.mirror.subprocess.run', wraps=subprocess.run) as run:
+            repo_path = self.mirror.sync('gitlab', 'local', 1, self.source, token='secret-token', shas=(self.head,))
+        clone_command, clone_kwargs = run.call_args_list[0].args[0], run.call_args_list[0].kwargs
+        self.assertIn('clone', clone_command)
+        self.assertFalse(any('secret-token' in arg or 'Authorization' in arg for arg in clone_command))
+
+        env = clone_kwargs['env']
+        header = subprocess.run(['git', 'config', '--get', 'http.extraHeader'], capture_output=True, text=True,
+                                env=env).stdout.strip()
+        credential = base64.b64decode(header.split()[-1]).decode('utf-8')
+        self.assertEqual(credential, 'oauth2:secret-token')
+        with open(os.path.join(repo_path, 'config'), encoding='utf-8') as f:
+            self.assertNotIn('Authorization', f.read())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import tempfile
+import threading
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from werkzeug.serving import make_server
+
+from biz.git_provider import http_client
+from biz.git_provider.mock_server import create_app, MockSettings
+from biz.git_provider.rate_limit import RateLimitScheduler
+from biz.gitlab.webhook_handler import MergeRequestHandler
+from biz.utils.kv_store import SqliteKVStore
+
+
+# @Describe:
+class TestMockServer(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.app = create_app(MockSettings(files=45, rate_limit=5, seed='1'))
+        self.client = self.app.test_client()
+
+    def test_gitlab_pagination(self):
+        """测试GitLab分页响应头"""
+        response = self.client.get('/api/v4/projects/1/merge_requests/3/diffs?page=2&per_page=20')
+        self.assertEqual(len(response.json), 20)
+        self.assertEqual(response.headers['X-Next-Page'], '3')
+        self.assertEqual(response.headers['X-Total'], '45')
+        self.assertEqual(response.headers['RateLimit-Remaining'], '4')
+
+    def test_github_link_and_etag(self):
+        """测试GitHub的Link分页、ETag以及304不计入配额"""
+        response = self.client.get('/repos/o/r/pulls/1/files?per_page=30', headers={'Authorization': 'token t'})
+        self.assertIn('rel="next"', response.headers['Link'])
+        self.assertIn('page=2', response.headers['Link'])
+        etag = response.headers['ETag']
+        response = self.client.get('/repos/o/r/pulls/1/files?per_page=30',
+                                   headers={'Authorization': 'token t', 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['X-RateLimit-Remaining'], '4')
+
+    def test_rate_limit_and_failure_injection(self):
+        """测试配额耗尽后返回限流响应，以及失败注入"""
+        for _ in range(5):
+            self.client.get('/api/v1/repos/o/r/branches')
+        response = self.client.get('/api/v1/repos/o/r/branches')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+
+        self.client.post('/_mock/reset')
+        self.client.post('/_mock/settings', json={'failure_rate': 1.0, 'failure_status': 503})
+        self.assertEqual(self.client.get('/api/v1/repos/o/r/branches').status_code, 503)
+
+    def test_merge_request_handler(self):
+        """测试MergeRequestHandler通过mock服务获取diff并发表评论"""
+        server = make_server('127.0.0.1', 0, self.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.app.config['MOCK_SETTINGS'].rate_limit = 1000
+        webhook_data = {
+            'object_kind': 'merge_request',
+            'object_attributes': {'iid': 3, 'target_project_id': 1, 'action': 'update'},
+        }
+        tmp_dir = tempfile.TemporaryDirectory()
+        scheduler = RateLimitScheduler(SqliteKVStore(f"{tmp_dir.name}/kv.db"))
+        try:
+            with patch.dict('os.environ', {'PROVIDER_ETAG_CACHE_ENABLED': '0'}), \
+                    patch.object(http_client, 'rate_limit_scheduler', scheduler):
+                handler = MergeRequestHandler(webhook_data, 'token', f"http://127.0.0.1:{server.server_port}")
+                changes = handler.get_merge_request_changes()
+                commits = handler.get_merge_request_commits()
+                handler.add_merge_request_notes('LGTM')
+        finally:
+            server.shutdown()
+            tmp_dir.cleanup()
+
+        self.assertEqual(len(changes), 45)
+        self.assertEqual(len(commits), 5)
+        self.assertEqual(self.app.config['MOCK_NOTES'][0]['body'], 'LGTM')
+
+
+if __name__ == '__main__':
+    main()
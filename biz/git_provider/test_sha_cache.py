@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import os
+import tempfile
+import time
+from unittest import TestCase, main
+
+from biz.git_provider.sha_cache import ShaCache
+
+SHA_A = 'a' * 40
+SHA_B = 'b' * 40
+
+
+# @Describe:
+class TestShaCache(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ShaCache(cache_dir=self.tmp_dir.name, max_bytes=10 * 1024 * 1024)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cached_method(self):
+        """测试完整sha命中缓存，可变引用不缓存"""
+        cache = self.cache
+        calls = []
+
+        class Handler:
+            url = 'https://gitlab.example.com'
+            project_id = 1
+
+            @cache.cached('compare', scope=lambda h: (h.url, h.project_id))
+            def repository_compare(self, before, after):
+                calls.append((before, after))
+                return [{'new_path': 'a.py', 'diff': '+1'}]
+
+        handler = Handler()
+        self.assertEqual(handler.repository_compare(SHA_A, SHA_B), [{'new_path': 'a.py', 'diff': '+1'}])
+        self.assertEqual(handler.repository_compare(SHA_A, SHA_B), [{'new_path': 'a.py', 'diff': '+1'}])
+        handler.repository_compare('main', SHA_B)
+        handler.repository_compare('main', SHA_B)
+        self.assertEqual(calls, [(SHA_A, SHA_B), ('main', SHA_B), ('main', SHA_B)])
+
+    def test_lru_eviction(self):
+        """测试超过大小上限时淘汰最久未访问的条目"""
+        cache = ShaCache(cache_dir=self.tmp_dir.name, max_bytes=3000)
+        payload = 'x' * 900
+        cache.set('host', 'p', 'commit_diff', ('1' * 40,), payload)
+        cache.set('host', 'p', 'commit_diff', ('2' * 40,), payload)
+        time.sleep(0.01)
+        # 访问第一条，使第二条成为最久未访问的条目
+        os.utime(cache._path('host', 'p', 'commit_diff', ('2' * 40,)), (0, 0))
+        self.assertEqual(cache.get('host', 'p', 'commit_diff', '1' * 40), payload)
+        cache.set('host', 'p', 'commit_diff', ('3' * 40,), payload)
+        cache.set('host', 'p', 'commit_diff', ('4' * 40,), payload)
+
+        self.assertIsNone(cache.get('host', 'p', 'commit_diff', '2' * 40))
+        self.assertEqual(cache.get('host', 'p', 'commit_diff', '4' * 40), payload)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,15 @@
 import os
 import re
-import time
 from urllib.parse import urljoin
 
 import fnmatch
-import requests
 
+from biz.git_provider import http_client
+from biz.git_provider.metadata_cache import project_metadata_cache, FIELD_PROTECTED_BRANCHES
+from biz.git_provider.rate_limit import PRIORITY_HIGH, PRIORITY_LOW
+from biz.git_provider.sha_cache import sha_cache
 from biz.utils.log import logger
+from biz.utils.polling import poll_until, ready_or_failed
 
 
 def filter_changes(changes: list):
@@ -51,6 +54,9 @@ def filter_changes(changes: list):
 
 
 class PullRequestHandler:
+    # MR/PR 审查所需的调用，限流时优先保证
+    request_priority = PRIORITY_HIGH
+
     def __init__(self, webhook_data: dict, gitea_token: str, gitea_url: str):
         self.webhook_data = webhook_data
         self.gitea_token = gitea_token
@@ -99,38 +105,33 @@ class PullRequestHandler:
             logger.error("Missing repository information for Gitea pull request.")
             return []
 
-        max_retries = 3
-        retry_delay = 10
         endpoint = f"api/v1/repos/{self.repo_full_name}/pulls/{self.pull_request_index}/files"
         url = urljoin(f"{self.gitea_url}/", endpoint)
+        files = poll_until(lambda: self._fetch_pull_request_files(url),
+                           ready_or_failed,
+                           description=f"Pull request {self.pull_request_index} changes")
+        if not files:
+            return []
+
+        changes = []
+        for file in files:
+            changes.append({
+                'diff': file.get('patch') or file.get('diff') or '',
+                'new_path': file.get('filename') or file.get('path') or '',
+                'status': file.get('status', ''),
+                'additions': file.get('additions'),
+                'deletions': file.get('deletions')
+            })
+        return changes
+
+    def _fetch_pull_request_files(self, url: str):
+        response = http_client.get(url, headers=self._headers(), verify=False, priority=self.request_priority)
+        logger.debug(f"Get changes response from Gitea: {response.status_code}, {response.text}, URL: {url}")
 
-        for attempt in range(max_retries):
-            response = requests.get(url, headers=self._headers(), verify=False)
-            logger.debug(
-                f"Get changes response from Gitea (attempt {attempt + 1}): {response.status_code}, {response.text}, URL: {url}")
-
-            if response.status_code == 200:
-                files = response.json() or []
-                if files:
-                    changes = []
-                    for file in files:
-                        changes.append({
-                            'diff': file.get('patch') or file.get('diff') or '',
-                            'new_path': file.get('filename') or file.get('path') or '',
-                            'status': file.get('status', ''),
-                            'additions': file.get('additions'),
-                            'deletions': file.get('deletions')
-                        })
-                    return changes
-                logger.info(
-                    f"Changes is empty, retrying in {retry_delay} seconds... (attempt {attempt + 1}/{max_retries}), URL: {url}")
-                time.sleep(retry_delay)
-            else:
-                logger.warn(f"Failed to get changes from Gitea (URL: {url}): {response.status_code}, {response.text}")
-                return []
-
-        logger.warning(f"Max retries ({max_retries}) reached. Changes is still empty.")
-        return []
+        if response.status_code == 200:
+            return response.json() or []
+        logger.warn(f"Failed to get changes from Gitea (URL: {url}): {response.status_code}, {response.text}")
+        return None
 
     def get_pull_request_commits(self) -> list:
         if self.event_type != 'pull_request':
@@ -142,7 +143,7 @@ class PullRequestHandler:
 
         endpoint = f"api/v1/repos/{self.repo_full_name}/pulls/{self.pull_request_index}/commits"
         url = urljoin(f"{self.gitea_url}/", endpoint)
-        response = requests.get(url, headers=self._headers(), verify=False)
+        response = http_client.get(url, headers=self._headers(), verify=False, priority=self.request_priority)
         logger.debug(f"Get commits response from Gitea: {response.status_code}, {response.text}")
 
         if response.status_code == 200:
@@ -168,37 +169,55 @@ class PullRequestHandler:
     def add_pull_request_notes(self, review_result: str):
         if not self.repo_full_name or not self.pull_request_index:
             logger.error("Missing repository information for adding pull request notes.")
-            return
+            return False
 
         endpoint = f"api/v1/repos/{self.repo_full_name}/issues/{self.pull_request_index}/comments"
         url = urljoin(f"{self.gitea_url}/", endpoint)
-        response = requests.post(url, headers=self._headers(), json={'body': review_result}, verify=False)
+        response = http_client.post(url, headers=self._headers(), json={'body': review_result}, verify=False,
+                                    priority=self.request_priority)
         logger.debug(f"Add comment to Gitea pull request {url}: {response.status_code}, {response.text}")
 
         if response.status_code == 201:
             logger.info("Comment successfully added to Gitea pull request.")
+            return True
         else:
             logger.error(f"Failed to add comment to Gitea pull request: {response.status_code}")
             logger.error(response.text)
+            return False
 
     def target_branch_protected(self) -> bool:
         if not self.repo_full_name or not self.target_branch:
             return False
 
+        protected_branches = self.get_protected_branches()
+        if protected_branches is None:
+            return False
+        return any(fnmatch.fnmatch(self.target_branch, name) for name in protected_branches)
+
+    def get_protected_branches(self):
+        """
+        获取仓库的受保护分支名称列表（带TTL缓存），请求失败时返回None
+        """
+        return project_metadata_cache.get_or_load(self.gitea_url, self.repo_full_name, FIELD_PROTECTED_BRANCHES,
+                                                  self._fetch_protected_branches)
+
+    def _fetch_protected_branches(self):
         endpoint = f"api/v1/repos/{self.repo_full_name}/branches?protected=true"
         url = urljoin(f"{self.gitea_url}/", endpoint)
-        response = requests.get(url, headers=self._headers(), verify=False)
+        response = http_client.get(url, headers=self._headers(), verify=False, priority=self.request_priority)
         logger.debug(f"Get protected branches response from Gitea: {response.status_code}, {response.text}")
 
         if response.status_code == 200:
             branches = response.json() or []
-            return any(fnmatch.fnmatch(self.target_branch, branch.get('name', '')) for branch in branches)
+            return [branch.get('name', '') for branch in branches]
         else:
             logger.warn(f"Failed to get protected branches from Gitea: {response.status_code}, {response.text}")
-            return False
+            return None
 
 
 class PushHandler:
+    request_priority = PRIORITY_LOW
+
     def __init__(self, webhook_data: dict, gitea_token: str, gitea_url: str):
         self.webhook_data = webhook_data
         self.gitea_token = gitea_token
@@ -265,7 +284,7 @@ class PushHandler:
 
         # endpoint = f"api/v1/repos/{self.repo_full_name}/git/commits/{last_commit_id}/comments"
         # url = urljoin(f"{self.gitea_url}/", endpoint)
-        # response = requests.post(url, headers=self._headers(), json={'body': message}, verify=False)
+        # response = http_client.post(url, headers=self._headers(), json={'body': message}, verify=False)
         # logger.debug(f"Add comment to Gitea commit {last_commit_id}: {response.status_code}, {response.text}")
 
         # if response.status_code == 201:
@@ -275,15 +294,16 @@ class PushHandler:
         #     logger.error(response.text)
 
         # TODO 官方暂未提供添加评论的API，暂时先注释掉
-        return
+        return True
 
+    @sha_cache.cached('commit_diff', scope=lambda h: (h.gitea_url, h.repo_full_name))
     def _get_commit_diff(self, commit_id: str) -> str:
         if not commit_id or not self.repo_full_name:
             return ""
 
         endpoint = f"api/v1/repos/{self.repo_full_name}/git/commits/{commit_id}.diff"
         url = urljoin(f"{self.gitea_url}/", endpoint)
-        response = requests.get(url, headers=self._headers(), verify=False)
+        response = http_client.get(url, headers=self._headers(), verify=False, priority=self.request_priority)
         logger.debug(
             f"Get commit diff from Gitea: {response.status_code}, {url}")
         if response.status_code == 200:
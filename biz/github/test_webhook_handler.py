@@ -4,8 +4,9 @@
 # @Author  : Arrow
 import os
 from unittest import TestCase, main
+from unittest.mock import patch, MagicMock
 
-from biz.github.webhook_handler import PushHandler
+from biz.github.webhook_handler import PushHandler, PullRequestHandler, last_page_from_link_header
 
 
 # @Describe:
@@ -45,5 +46,61 @@ class TestPushHandler(TestCase):
         self.assertIsInstance(parent_id, str)
 
 
+class TestPullRequestHandler(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.sample_webhook_data = {
+            'action': 'opened',
+            'repository': {'full_name': 'owner/repo'},
+            'pull_request': {'number': 1},
+        }
+        self.handler = PullRequestHandler(self.sample_webhook_data, '', 'https://github.com')
+
+    @staticmethod
+    def _page_response(page: int, last_page: int, size: int):
+        response = MagicMock()
+        response.status_code = 200
+        response.json.return_value = [{'filename': f'file_{page}_{i}.py', 'patch': '+a', 'additions': 1,
+                                       'deletions': 0} for i in range(size)]
+        base = 'https://api.github.com/repositories/1/pulls/1/files?per_page=100'
+        response.headers = {'Link': f'<{base}&page={page + 1}>; rel="next", <{base}&page={last_page}>; rel="last"'}
+        return response
+
+    def test_last_page_from_link_header(self):
+        """测试Link头解析总页数"""
+        self.assertEqual(last_page_from_link_header(''), 1)
+        link = '<https://api.github.com/x?per_page=100&page=2>; rel="next", ' \
+               '<https://api.github.com/x?per_page=100&page=7>; rel="last"'
+        self.assertEqual(last_page_from_link_header(link), 7)
+
+    def test_get_pull_request_changes_all_pages(self):
+        """测试分页获取全部变更文件，并按页码顺序拼接"""
+        def fake_get(url, headers=None, params=None, **kwargs):
+            page = params['page']
+            return self._page_response(page, 3, 100 if page < 3 else 5)
+
+        with patch('biz.git_provider.http_client.get', side_effect=fake_get):
+            changes = self.handler.get_pull_request_changes()
+
+        self.assertEqual(len(changes), 205)
+        self.assertEqual(changes[0]['new_path'], 'file_1_0.py')
+        self.assertEqual(changes[-1]['new_path'], 'file_3_4.py')
+
+    def test_get_pull_request_changes_max_files(self):
+        """测试变更文件数上限"""
+        requested_pages = []
+
+        def fake_get(url, headers=None, params=None, **kwargs):
+            requested_pages.append(params['page'])
+            return self._page_response(params['page'], 10, 100)
+
+        with patch.dict(os.environ, {'GITHUB_PR_MAX_FILES': '150'}), \
+                patch('biz.git_provider.http_client.get', side_effect=fake_get):
+            changes = self.handler.get_pull_request_changes()
+
+        self.assertEqual(len(changes), 150)
+        self.assertEqual(sorted(requested_pages), [1, 2])
+
+
 if __name__ == '__main__':
     main() 
\ No newline at end of file
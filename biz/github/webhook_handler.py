@@ -1,10 +1,17 @@
 import os
 import re
-import time
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
 import fnmatch
+from biz.git_provider import http_client
+from biz.git_provider.metadata_cache import project_metadata_cache, FIELD_PROTECTED_BRANCHES
+from biz.git_provider.rate_limit import PRIORITY_HIGH, PRIORITY_LOW
+from biz.git_provider.sha_cache import sha_cache
 from biz.utils.log import logger
+from biz.utils.polling import poll_until, ready_or_failed
+
+# GitHub 列表接口单页最大条数
+GITHUB_PER_PAGE = 100
 
 
 
@@ -55,12 +62,55 @@ def filter_changes(changes: list):
     return filtered_changes
 
 
+def parse_link_header(link_header: str) -> dict:
+    '''
+    解析GitHub分页响应中的Link头，返回 rel -> url 的映射，举例：
+    <https://api.github.com/repositories/1/pulls/1/files?page=2>; rel="next" => {'next': 'https://...page=2'}
+    '''
+    links = {}
+    if not link_header:
+        return links
+    for part in link_header.split(','):
+        match = re.match(r'\s*<([^>]+)>\s*;\s*rel="([^"]+)"', part)
+        if match:
+            links[match.group(2)] = match.group(1)
+    return links
+
+
+def last_page_from_link_header(link_header: str) -> int:
+    '''
+    从Link头中的 rel="last" 链接解析出总页数，没有分页时返回1
+    '''
+    last_url = parse_link_header(link_header).get('last')
+    if not last_url:
+        return 1
+    match = re.search(r'[?&]page=(\d+)', last_url)
+    return int(match.group(1)) if match else 1
+
+
+def invalidate_project_metadata(webhook_data: dict, github_url: str) -> bool:
+    '''
+    收到 branch_protection_rule、repository 等仓库设置变更事件时清除该仓库的元数据缓存，返回是否清除
+    '''
+    repo_full_name = (webhook_data.get('repository') or {}).get('full_name')
+    if not repo_full_name:
+        return False
+    api_url = os.getenv('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
+    project_metadata_cache.invalidate(api_url, repo_full_name)
+    return True
+
+
 class PullRequestHandler:
+    # MR/PR 审查所需的调用，限流时优先保证
+    request_priority = PRIORITY_HIGH
+
     def __init__(self, webhook_data: dict, github_token: str, github_url: str):
         self.pull_request_number = None
         self.webhook_data = webhook_data
         self.github_token = github_token
         self.github_url = github_url
+        # GitHub Enterprise 或本地 mock 服务可通过 GITHUB_API_URL 指定 API 地址
+        self.api_url = os.getenv('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
         self.event_type = None
         self.repo_full_name = None
         self.action = None
@@ -83,84 +133,102 @@ class PullRequestHandler:
             logger.warn(f"Invalid event type: {self.event_type}. Only 'pull_request' event is supported now.")
             return []
 
-        # GitHub pull request changes API可能存在延迟，多次尝试
-        max_retries = 3  # 最大重试次数
-        retry_delay = 10  # 重试间隔时间（秒）
-        for attempt in range(max_retries):
-            # 调用 GitHub API 获取 Pull Request 的 files（变更）
-            url = f"https://api.github.com/repos/{self.repo_full_name}/pulls/{self.pull_request_number}/files"
-            headers = {
-                'Authorization': f'token {self.github_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            response = requests.get(url, headers=headers)
-            logger.debug(
-                f"Get changes response from GitHub (attempt {attempt + 1}): {response.status_code}, {response.text}, URL: {url}")
-
-            # 检查请求是否成功
-            if response.status_code == 200:
-                files = response.json()
-                if files:
-                    # 转换成GitLab格式的changes
-                    changes = []
-                    for file in files:
-                        change = {
-                            'old_path': file.get('filename'),
-                            'new_path': file.get('filename'),
-                            'diff': file.get('patch', ''),
-                            'additions': file.get('additions', 0),
-                            'deletions': file.get('deletions', 0)
-                        }
-                        changes.append(change)
-                    return changes
-                else:
-                    logger.info(
-                        f"Changes is empty, retrying in {retry_delay} seconds... (attempt {attempt + 1}/{max_retries}), URL: {url}")
-                    time.sleep(retry_delay)
-            else:
-                logger.warn(f"Failed to get changes from GitHub (URL: {url}): {response.status_code}, {response.text}")
-                return []
+        # GitHub pull request changes API可能存在延迟，按指数退避轮询
+        url = f"{self.api_url}/repos/{self.repo_full_name}/pulls/{self.pull_request_number}/files"
+        max_files = int(os.getenv('GITHUB_PR_MAX_FILES', 3000))
+        # 调用 GitHub API 分页获取 Pull Request 的 files（变更）
+        files = poll_until(lambda: self._get_all_pages(url, max_items=max_files),
+                           ready_or_failed,
+                           description=f"Pull request {self.pull_request_number} changes")
+        if not files:
+            return []
 
-        logger.warning(f"Max retries ({max_retries}) reached. Changes is still empty.")
-        return []  # 达到最大重试次数后返回空列表
+        # 转换成GitLab格式的changes
+        changes = []
+        for file in files:
+            change = {
+                'old_path': file.get('filename'),
+                'new_path': file.get('filename'),
+                'diff': file.get('patch', ''),
+                'additions': file.get('additions', 0),
+                'deletions': file.get('deletions', 0)
+            }
+            changes.append(change)
+        return changes
 
     def get_pull_request_commits(self) -> list:
         # 检查是否为 Pull Request Hook 事件
         if self.event_type != 'pull_request':
             return []
 
-        # 调用 GitHub API 获取 Pull Request 的 commits
-        url = f"https://api.github.com/repos/{self.repo_full_name}/pulls/{self.pull_request_number}/commits"
+        # 调用 GitHub API 分页获取 Pull Request 的 commits
+        url = f"{self.api_url}/repos/{self.repo_full_name}/pulls/{self.pull_request_number}/commits"
+        github_commits = self._get_all_pages(url)
+        if github_commits is None:
+            return []
+
+        # 将GitHub的commits转换为GitLab格式的commits
+        gitlab_format_commits = []
+        for commit in github_commits:
+            gitlab_commit = {
+                'id': commit.get('sha'),
+                'title': commit.get('commit', {}).get('message', '').split('\n')[0],
+                'message': commit.get('commit', {}).get('message', ''),
+                'author_name': commit.get('commit', {}).get('author', {}).get('name'),
+                'author_email': commit.get('commit', {}).get('author', {}).get('email'),
+                'created_at': commit.get('commit', {}).get('author', {}).get('date'),
+                'web_url': commit.get('html_url')
+            }
+            gitlab_format_commits.append(gitlab_commit)
+        return gitlab_format_commits
+
+    def _get_page(self, url: str, page: int):
         headers = {
             'Authorization': f'token {self.github_token}',
             'Accept': 'application/vnd.github.v3+json'
         }
-        response = requests.get(url, headers=headers)
-        logger.debug(f"Get commits response from GitHub: {response.status_code}, {response.text}")
-        
-        # 检查请求是否成功
-        if response.status_code == 200:
-            # 将GitHub的commits转换为GitLab格式的commits
-            github_commits = response.json()
-            gitlab_format_commits = []
-            for commit in github_commits:
-                gitlab_commit = {
-                    'id': commit.get('sha'),
-                    'title': commit.get('commit', {}).get('message', '').split('\n')[0],
-                    'message': commit.get('commit', {}).get('message', ''),
-                    'author_name': commit.get('commit', {}).get('author', {}).get('name'),
-                    'author_email': commit.get('commit', {}).get('author', {}).get('email'),
-                    'created_at': commit.get('commit', {}).get('author', {}).get('date'),
-                    'web_url': commit.get('html_url')
-                }
-                gitlab_format_commits.append(gitlab_commit)
-            return gitlab_format_commits
-        else:
-            logger.warn(f"Failed to get commits: {response.status_code}, {response.text}")
-            return []
+        response = http_client.get(url, headers=headers, params={'per_page': GITHUB_PER_PAGE, 'page': page},
+                                   priority=self.request_priority)
+        logger.debug(f"Get page {page} from GitHub: {response.status_code}, URL: {url}")
+        return response
+
+    def _get_all_pages(self, url: str, max_items: int = None):
+        '''
+        按 per_page=100 分页获取GitHub列表接口的全部数据。
+        先同步获取第一页，再根据Link头中的总页数并发获取剩余分页，结果按页码顺序拼接。
+        :param url: 列表接口地址
+        :param max_items: 最多获取的条数，为空表示不限制
+        :return: 数据列表；第一页请求失败时返回None
+        '''
+        response = self._get_page(url, 1)
+        if response.status_code != 200:
+            logger.warn(f"Failed to get data from GitHub (URL: {url}): {response.status_code}, {response.text}")
+            return None
+
+        items = response.json()
+        last_page = last_page_from_link_header(response.headers.get('Link', ''))
+        if max_items:
+            last_page = min(last_page, -(-max_items // GITHUB_PER_PAGE))
+
+        if last_page > 1:
+            concurrency = int(os.getenv('GITHUB_PAGE_FETCH_CONCURRENCY', 4))
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                responses = list(executor.map(lambda page: self._get_page(url, page), range(2, last_page + 1)))
+            for page, page_response in enumerate(responses, start=2):
+                if page_response.status_code != 200:
+                    logger.warn(f"Failed to get page {page} from GitHub (URL: {url}): "
+                                f"{page_response.status_code}, {page_response.text}. "
+                                f"Only the first {len(items)} items are used.")
+                    break
+                items.extend(page_response.json())
+
+        if max_items and len(items) > max_items:
+            logger.warn(f"GitHub returned {len(items)} items, truncated to {max_items} (URL: {url}).")
+            items = items[:max_items]
+        return items
 
     def add_pull_request_notes(self, review_result):
-        url = f"https://api.github.com/repos/{self.repo_full_name}/issues/{self.pull_request_number}/comments"
+        url = f"{self.api_url}/repos/{self.repo_full_name}/issues/{self.pull_request_number}/comments"
         headers = {
             'Authorization': f'token {self.github_token}',
             'Accept': 'application/vnd.github.v3+json'
@@ -168,36 +236,53 @@ class PullRequestHandler:
         data = {
             'body': review_result
         }
-        response = requests.post(url, headers=headers, json=data)
+        response = http_client.post(url, headers=headers, json=data, priority=self.request_priority)
         logger.debug(f"Add comment to GitHub PR {url}: {response.status_code}, {response.text}")
         if response.status_code == 201:
             logger.info("Comment successfully added to pull request.")
+            return True
         else:
             logger.error(f"Failed to add comment: {response.status_code}")
             logger.error(response.text)
+            return False
 
     def target_branch_protected(self) -> bool:
-        url = f"https://api.github.com/repos/{self.repo_full_name}/branches?protected=true"
+        protected_branches = self.get_protected_branches()
+        if protected_branches is None:
+            return False
+        target_branch = self.webhook_data['pull_request']['base']['ref']
+        return any(fnmatch.fnmatch(target_branch, name) for name in protected_branches)
+
+    def get_protected_branches(self):
+        '''
+        获取仓库的受保护分支名称列表（带TTL缓存），请求失败时返回None
+        '''
+        return project_metadata_cache.get_or_load(self.api_url, self.repo_full_name, FIELD_PROTECTED_BRANCHES,
+                                                  self._fetch_protected_branches)
+
+    def _fetch_protected_branches(self):
+        url = f"{self.api_url}/repos/{self.repo_full_name}/branches?protected=true"
         headers = {
             'Authorization': f'token {self.github_token}',
             'Accept': 'application/vnd.github.v3+json'
         }
 
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers, priority=self.request_priority)
         if response.status_code == 200:
-            data = response.json()
-            target_branch = self.webhook_data['pull_request']['base']['ref']
-            return any(fnmatch.fnmatch(target_branch, item['name']) for item in data)
+            return [item['name'] for item in response.json()]
         else:
             logger.warn(f"Failed to get protected branches: {response.status_code}, {response.text}")
-            return False
+            return None
 
 
 class PushHandler:
+    request_priority = PRIORITY_LOW
+
     def __init__(self, webhook_data: dict, github_token: str, github_url: str):
         self.webhook_data = webhook_data
         self.github_token = github_token
         self.github_url = github_url
+        self.api_url = os.getenv('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
         self.event_type = None
         self.repo_full_name = None
         self.branch_name = None
@@ -239,15 +324,15 @@ class PushHandler:
         # 添加评论到 GitHub Push 请求的提交中（此处假设是在最后一次提交上添加注释）
         if not self.commit_list:
             logger.warn("No commits found to add notes to.")
-            return
+            return False
 
         # 获取最后一个提交的ID
         last_commit_id = self.commit_list[-1].get('id')
         if not last_commit_id:
             logger.error("Last commit ID not found.")
-            return
+            return False
 
-        url = f"https://api.github.com/repos/{self.repo_full_name}/commits/{last_commit_id}/comments"
+        url = f"{self.api_url}/repos/{self.repo_full_name}/commits/{last_commit_id}/comments"
         headers = {
             'Authorization': f'token {self.github_token}',
             'Accept': 'application/vnd.github.v3+json'
@@ -255,22 +340,24 @@ class PushHandler:
         data = {
             'body': message
         }
-        response = requests.post(url, headers=headers, json=data)
+        response = http_client.post(url, headers=headers, json=data, priority=self.request_priority)
         logger.debug(f"Add comment to commit {last_commit_id}: {response.status_code}, {response.text}")
         if response.status_code == 201:
             logger.info("Comment successfully added to push commit.")
+            return True
         else:
             logger.error(f"Failed to add comment: {response.status_code}")
             logger.error(response.text)
+            return False
 
     def __repository_commits(self, sha: str = "", per_page: int = 100, page: int = 1):
         # 获取仓库提交信息
-        url = f"https://api.github.com/repos/{self.repo_full_name}/commits?sha={sha}&per_page={per_page}&page={page}"
+        url = f"{self.api_url}/repos/{self.repo_full_name}/commits?sha={sha}&per_page={per_page}&page={page}"
         headers = {
             'Authorization': f'token {self.github_token}',
             'Accept': 'application/vnd.github.v3+json'
         }
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers, priority=self.request_priority)
         logger.debug(
             f"Get commits response from GitHub for repository_commits: {response.status_code}, {response.text}, URL: {url}")
 
@@ -281,13 +368,14 @@ class PushHandler:
                 f"Failed to get commits for sha {sha}: {response.status_code}, {response.text}")
             return []
 
+    @sha_cache.cached('parent', scope=lambda h: (h.api_url, h.repo_full_name))
     def get_parent_commit_id(self, commit_id: str) -> str:
-        url = f"https://api.github.com/repos/{self.repo_full_name}/commits/{commit_id}"
+        url = f"{self.api_url}/repos/{self.repo_full_name}/commits/{commit_id}"
         headers = {
             'Authorization': f'token {self.github_token}',
             'Accept': 'application/vnd.github.v3+json'
         }
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers, priority=self.request_priority)
         logger.debug(
             f"Get commit response from GitHub: {response.status_code}, {response.text}, URL: {url}")
 
@@ -295,14 +383,15 @@ class PushHandler:
             return response.json().get('parents')[0].get('sha', '')
         return ""
 
+    @sha_cache.cached('compare', scope=lambda h: (h.api_url, h.repo_full_name))
     def repository_compare(self, base: str, head: str):
         # 比较两个提交之间的差异
-        url = f"https://api.github.com/repos/{self.repo_full_name}/compare/{base}...{head}"
+        url = f"{self.api_url}/repos/{self.repo_full_name}/compare/{base}...{head}"
         headers = {
             'Authorization': f'token {self.github_token}',
             'Accept': 'application/vnd.github.v3+json'
         }
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers, priority=self.request_priority)
         logger.debug(
             f"Get changes response from GitHub for repository_compare: {response.status_code}, {response.text}, URL: {url}")
 
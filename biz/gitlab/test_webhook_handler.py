@@ -3,8 +3,10 @@
 # @Time    : 2025/3/18 17:58
 # @Author  : Arrow
 from unittest import TestCase, main
+from unittest.mock import patch
 
-from biz.gitlab.webhook_handler import PushHandler
+from biz.gitlab.webhook_handler import PushHandler, MergeRequestHandler, iter_filter_changes
+from biz.utils.token_util import take_changes_within_budget
 
 
 # @Describe:
@@ -32,5 +34,108 @@ class TestPushHandler(TestCase):
         self.assertTrue(parent_id)
 
 
+class FakeResponse:
+    def __init__(self, status_code: int, payload, headers: dict = None):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = headers or {}
+        self.content = b'{}'
+
+    def json(self):
+        return self.payload
+
+
+class TestMergeRequestHandler(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        webhook_data = {
+            'object_kind': 'merge_request',
+            'object_attributes': {'iid': 1, 'target_project_id': 2, 'action': 'update'},
+        }
+        self.handler = MergeRequestHandler(webhook_data, 'token', 'https://gitlab.example.com')
+        self.pages_requested = []
+
+    def fake_get(self, url, headers=None, params=None, **kwargs):
+        if url.endswith('/merge_requests/1'):
+            return FakeResponse(200, {'diff_refs': {'head_sha': 'x'}, 'merge_status': 'can_be_merged'})
+        page = params['page']
+        self.pages_requested.append(page)
+        files = [{'new_path': f'p{page}_{i}.py', 'diff': '+a\n-b'} for i in range(2)]
+        return FakeResponse(200, files, {'X-Next-Page': str(page + 1) if page < 3 else ''})
+
+    def test_iter_changes_lazily(self):
+        """测试按页流式获取diff，后续分页在迭代时才请求"""
+        with patch('biz.git_provider.http_client.get', side_effect=self.fake_get):
+            changes = self.handler.iter_merge_request_changes()
+            self.assertEqual(self.pages_requested, [1])
+            filtered = iter_filter_changes(changes)
+            first = next(filtered)
+            self.assertEqual(first['new_path'], 'p1_0.py')
+            self.assertEqual(self.pages_requested, [1])
+            rest = list(filtered)
+
+        self.assertEqual(self.pages_requested, [1, 2, 3])
+        self.assertEqual(len(rest), 5)
+        self.assertEqual((first['additions'], first['deletions']), (1, 1))
+
+    def test_fallback_to_changes_api(self):
+        """测试 /diffs 接口不存在时回退到 /changes 接口"""
+        def fake_get(url, headers=None, params=None, **kwargs):
+            if url.endswith('/merge_requests/1'):
+                return FakeResponse(200, {'diff_refs': {'head_sha': 'x'}})
+            if url.endswith('/diffs'):
+                return FakeResponse(404, {})
+            return FakeResponse(200, {'changes': [{'new_path': 'a.py', 'diff': '+a'}]})
+
+        with patch('biz.git_provider.http_client.get', side_effect=fake_get):
+            changes = list(self.handler.iter_merge_request_changes())
+        self.assertEqual(changes, [{'new_path': 'a.py', 'diff': '+a'}])
+
+    def test_count_remaining_after_budget(self):
+        """测试token预算用完后只保留预算内的文件，剩余分页继续统计新增、删除行数"""
+        with patch('biz.git_provider.http_client.get', side_effect=self.fake_get), \
+                patch('biz.utils.token_util.count_tokens', return_value=10):
+            changes = self.handler.iter_merge_request_changes()
+            kept, additions, deletions = take_changes_within_budget(iter_filter_changes(changes), max_tokens=30)
+        self.assertEqual(len(kept), 3)
+        self.assertEqual((additions, deletions), (6, 6))
+        self.assertEqual(self.pages_requested, [1, 2, 3])
+
+    def test_refetch_collapsed_diffs(self):
+        """测试超过 diff 大小限制被折叠的文件逐个获取原始文件重新生成diff，获取不到时跳过"""
+        raw_requests = []
+
+        def fake_get(url, headers=None, params=None, **kwargs):
+            if url.endswith('/merge_requests/1'):
+                return FakeResponse(200, {'diff_refs': {'base_sha': 'b' * 40, 'head_sha': 'h' * 40}})
+            if url.endswith('/diffs'):
+                return FakeResponse(200, [
+                    {'new_path': 'small.py', 'diff': '+a'},
+                    {'new_path': 'src/big.py', 'old_path': 'src/big.py', 'diff': '', 'too_large': True},
+                    {'new_path': 'added.py', 'diff': '', 'collapsed': True, 'new_file': True},
+                    {'new_path': 'gone.py', 'diff': '', 'collapsed': True},
+                    {'new_path': 'big.lock', 'diff': '', 'too_large': True},
+                ])
+            raw_requests.append((url, params['ref'][0]))
+            contents = {
+                ('src%2Fbig.py', 'b'): b'x = 1\ny = 2\n',
+                ('src%2Fbig.py', 'h'): b'x = 1\ny = 3\nz = 4\n',
+                ('added.py', 'h'): b'print(1)\n',
+            }
+            path = url.split('/repository/files/')[1].rsplit('/raw', 1)[0]
+            content = contents.get((path, params['ref'][0]))
+            response = FakeResponse(200 if content is not None else 404, None)
+            response.content = content or b''
+            return response
+
+        with patch('biz.git_provider.http_client.get', side_effect=fake_get):
+            changes = list(iter_filter_changes(self.handler.iter_merge_request_changes()))
+        self.assertEqual([(c['new_path'], c['additions'], c['deletions']) for c in changes],
+                         [('small.py', 1, 0), ('src/big.py', 2, 1), ('added.py', 1, 0)])
+        self.assertIn('+z = 4\n', changes[1]['diff'])
+        self.assertTrue(changes[1]['diff'].startswith('@@'))
+        # 不支持的文件类型不获取原始文件，新增的文件不获取 base 版本
+        self.assertEqual([ref for _, ref in raw_requests], ['h', 'b', 'h', 'h'])
+
 if __name__ == '__main__':
     main()
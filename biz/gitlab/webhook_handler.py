@@ -1,34 +1,100 @@
+import difflib
 import os
 import re
-import time
-from urllib.parse import urljoin
+from urllib.parse import quote, urljoin
 import fnmatch
-import requests
+from typing import Iterable, Iterator, Optional
 
+from biz.git_provider import http_client
+from biz.git_provider.metadata_cache import project_metadata_cache, FIELD_PROTECTED_BRANCHES
+from biz.git_provider.mirror import local_mirror, MirrorError
+from biz.git_provider.rate_limit import PRIORITY_HIGH, PRIORITY_LOW
+from biz.git_provider.sha_cache import sha_cache
 from biz.utils.log import logger
+from biz.utils.polling import poll_until, ready_or_failed
 
 
-def filter_changes(changes: list):
+def supported_file_extensions() -> list:
+    return os.getenv('SUPPORTED_EXTENSIONS', '.java,.py,.php').split(',')
+
+
+def is_supported_change(item: dict, supported_extensions: list = None) -> bool:
     '''
-    过滤数据，只保留支持的文件类型以及必要的字段信息
+    未删除且 `new_path` 以支持的扩展名结尾的变更需要review
     '''
-    # 从环境变量中获取支持的文件扩展名
-    supported_extensions = os.getenv('SUPPORTED_EXTENSIONS', '.java,.py,.php').split(',')
+    if item.get("deleted_file"):
+        return False
+    supported_extensions = supported_extensions or supported_file_extensions()
+    return any(item.get('new_path', '').endswith(ext) for ext in supported_extensions)
 
-    filter_deleted_files_changes = [change for change in changes if not change.get("deleted_file")]
 
-    # 过滤 `new_path` 以支持的扩展名结尾的元素, 仅保留diff和new_path字段
-    filtered_changes = [
-        {
-            'diff': item.get('diff', ''),
+def iter_filter_changes(changes: Iterable[dict]) -> Iterator[dict]:
+    '''
+    逐个过滤变更，只保留支持的文件类型以及必要的字段信息，可直接消费流式获取的变更
+    '''
+    # 从环境变量中获取支持的文件扩展名
+    supported_extensions = supported_file_extensions()
+
+    for item in changes:
+        # 过滤已删除的文件，以及 `new_path` 不以支持的扩展名结尾的元素, 仅保留diff和new_path字段
+        if not is_supported_change(item, supported_extensions):
+            continue
+        diff = item.get('diff', '')
+        yield {
+            'diff': diff,
             'new_path': item['new_path'],
-            'additions': len(re.findall(r'^\+(?!\+\+)', item.get('diff', ''), re.MULTILINE)),
-            'deletions': len(re.findall(r'^-(?!--)', item.get('diff', ''), re.MULTILINE))
+            'additions': len(re.findall(r'^\+(?!\+\+)', diff, re.MULTILINE)),
+            'deletions': len(re.findall(r'^-(?!--)', diff, re.MULTILINE))
         }
-        for item in filter_deleted_files_changes
-        if any(item.get('new_path', '').endswith(ext) for ext in supported_extensions)
-    ]
-    return filtered_changes
+
+
+def filter_changes(changes: list):
+    '''
+    过滤数据，只保留支持的文件类型以及必要的字段信息
+    '''
+    return list(iter_filter_changes(changes))
+
+
+# 系统钩子中可能改变项目设置(受保护分支、默认分支等)的项目事件
+PROJECT_SETTINGS_EVENTS = ('project_update', 'project_rename', 'project_transfer', 'project_destroy')
+
+
+def invalidate_project_metadata(webhook_data: dict, gitlab_url: str) -> bool:
+    '''
+    收到系统钩子的项目事件时清除该项目的元数据缓存，其他系统钩子事件忽略，返回是否清除
+    '''
+    project_id = webhook_data.get('project_id')
+    if webhook_data.get('event_name') not in PROJECT_SETTINGS_EVENTS or project_id is None:
+        return False
+    project_metadata_cache.invalidate(gitlab_url, project_id)
+    return True
+
+
+def unified_diff(old_text: str, new_text: str) -> str:
+    '''
+    生成与 GitLab diff 字段格式一致的 unified diff(只有 @@ 块，没有 ---/+++ 文件头)
+    '''
+    lines = difflib.unified_diff(old_text.splitlines(keepends=True), new_text.splitlines(keepends=True), n=3)
+    return ''.join(line if line.endswith('\n') else f"{line}\n" for index, line in enumerate(lines) if index >= 2)
+
+
+def sync_local_mirror(webhook_data: dict, gitlab_url: str, gitlab_token: str, project_id, shas: tuple) -> Optional[str]:
+    '''
+    同步项目的本地镜像并返回镜像路径，未开启 LOCAL_MIRROR_ENABLED 或同步失败时返回None，调用方回退到 API
+    '''
+    if not local_mirror.enabled:
+        return None
+    project = webhook_data.get('project') or {}
+    path_with_namespace = project.get('path_with_namespace')
+    remote_url = f"{gitlab_url.rstrip('/')}/{path_with_namespace}.git" if path_with_namespace \
+        else project.get('git_http_url')
+    if not remote_url:
+        return None
+    try:
+        return local_mirror.sync('gitlab', gitlab_url, project_id, remote_url, gitlab_token, shas)
+    except MirrorError as e:
+        logger.warn(f"Local mirror unavailable for project {project_id}, fallback to API: {e}")
+        return None
 
 
 def slugify_url(original_url: str) -> str:
@@ -50,6 +116,9 @@ def slugify_url(original_url: str) -> str:
 
 
 class MergeRequestHandler:
+    # MR/PR 审查所需的调用，限流时优先保证
+    request_priority = PRIORITY_HIGH
+
     def __init__(self, webhook_data: dict, gitlab_token: str, gitlab_url: str):
         self.merge_request_iid = None
         self.webhook_data = webhook_data
@@ -58,6 +127,7 @@ class MergeRequestHandler:
         self.event_type = None
         self.project_id = None
         self.action = None
+        self.diff_refs = None
         self.parse_event_type()
 
     def parse_event_type(self):
@@ -74,40 +144,192 @@ class MergeRequestHandler:
         self.action = merge_request.get('action')
 
     def get_merge_request_changes(self) -> list:
+        return list(self.iter_merge_request_changes())
+
+    def iter_merge_request_changes(self) -> Iterator[dict]:
+        '''
+        按页读取 /diffs 接口，逐个文件返回 Merge Request 的变更，内存占用与MR大小无关。
+        第一页在调用时获取（含diff就绪轮询），后续分页在迭代时按需获取，调用方可以边获取边处理
+        '''
         # 检查是否为 Merge Request Hook 事件
         if self.event_type != 'merge_request':
             logger.warn(f"Invalid event type: {self.event_type}. Only 'merge_request' event is supported now.")
-            return []
+            return iter(())
+
+        # 开启本地镜像时在本地计算diff，不可用时回退到 API
+        if local_mirror.enabled:
+            changes = self._iter_local_mirror_changes()
+            if changes is not None:
+                return changes
+
+        # Gitlab merge request diff可能存在延迟，先根据MR状态判断diff是否已生成，再按指数退避轮询
+        first_page = poll_until(self._fetch_first_diffs_page_when_ready,
+                                lambda result: result is None or ready_or_failed(result[0]),
+                                description=f"Merge request {self.merge_request_iid} changes")
+        if first_page is None:
+            return iter(())
+        return self._iter_diffs_pages(*first_page)
+
+    def get_merge_request(self) -> Optional[dict]:
+        url = urljoin(f"{self.gitlab_url}/",
+                      f"api/v4/projects/{self.project_id}/merge_requests/{self.merge_request_iid}")
+        headers = {
+            'Private-Token': self.gitlab_token
+        }
+        response = http_client.get(url, headers=headers, verify=False, priority=self.request_priority)
+        if response.status_code != 200:
+            logger.warn(f"Failed to get merge request from GitLab (URL: {url}): {response.status_code}")
+            return None
+        return response.json()
+
+    @staticmethod
+    def _diff_ready(merge_request: dict) -> bool:
+        preparing = 'preparing' in (merge_request.get('merge_status'), merge_request.get('detailed_merge_status'))
+        return bool(merge_request.get('diff_refs')) and not preparing
+
+    def merge_request_diff_ready(self) -> bool:
+        '''
+        根据 MR 的 merge_status / diff_refs 判断 GitLab 是否已生成diff
+        '''
+        merge_request = self.get_merge_request()
+        # 无法获取MR状态时不阻塞，直接尝试获取changes
+        if merge_request is None:
+            return True
+        self.diff_refs = merge_request.get('diff_refs') or None
+        return self._diff_ready(merge_request)
+
+    def _iter_local_mirror_changes(self) -> Optional[Iterator[dict]]:
+        '''
+        在本地镜像中计算 diff_refs.base_sha 与 head_sha 之间的变更，本地镜像不可用时返回None
+        '''
+        merge_request = poll_until(self.get_merge_request,
+                                   lambda result: result is None or self._diff_ready(result),
+                                   description=f"Merge request {self.merge_request_iid} diff refs")
+        diff_refs = (merge_request or {}).get('diff_refs') or {}
+        base_sha, head_sha = diff_refs.get('base_sha'), diff_refs.get('head_sha')
+        if not base_sha or not head_sha:
+            return None
+        repo_path = sync_local_mirror(self.webhook_data, self.gitlab_url, self.gitlab_token, self.project_id,
+                                      (base_sha, head_sha))
+        if repo_path is None:
+            return None
+        return local_mirror.iter_diff(repo_path, base_sha, head_sha)
+
+    def _fetch_first_diffs_page_when_ready(self):
+        '''
+        diff未就绪时返回空页，请求失败时返回None
+        '''
+        if not self.merge_request_diff_ready():
+            return [], None
+        return self._fetch_diffs_page(1)
+
+    def _iter_diffs_pages(self, items: list, next_page: Optional[int]) -> Iterator[dict]:
+        '''
+        逐个返回各页的变更，调用方停止迭代(如token预算用完)后不再请求后续分页。
+        超过 GitLab diff 大小限制的文件在 /diffs 中被折叠(collapsed/too_large)、diff为空，
+        对需要review的文件逐个获取 diff_refs 两端的原始文件重新生成diff，获取不到时跳过该文件
+        '''
+        for item in self._iter_diffs_items(items, next_page):
+            if item.get('diff') or not (item.get('collapsed') or item.get('too_large')) \
+                    or not is_supported_change(item):
+                yield item
+                continue
+            diff = self._fetch_collapsed_diff(item)
+            if not diff:
+                logger.warn(f"Diff of {item.get('new_path')} in merge request {self.merge_request_iid} exceeds "
+                            f"GitLab diff limits and raw files are unavailable, skipped.")
+                continue
+            yield {**item, 'diff': diff}
+
+    def _fetch_collapsed_diff(self, item: dict) -> Optional[str]:
+        '''
+        获取折叠文件在 base_sha、head_sha 的原始内容并在本地生成diff，每次只读取这一个文件
+        '''
+        diff_refs = self.diff_refs or (self.get_merge_request() or {}).get('diff_refs') or {}
+        base_sha, head_sha = diff_refs.get('base_sha'), diff_refs.get('head_sha')
+        if not base_sha or not head_sha:
+            return None
+        new_text = self._fetch_raw_file(item['new_path'], head_sha)
+        if new_text is None:
+            return None
+        old_text = '' if item.get('new_file') else self._fetch_raw_file(item.get('old_path') or item['new_path'],
+                                                                         base_sha)
+        return None if old_text is None else unified_diff(old_text, new_text)
+
+    def _fetch_raw_file(self, path: str, ref: str) -> Optional[str]:
+        '''
+        获取指定版本的原始文件内容，请求失败、超过 GITLAB_RAW_FILE_MAX_BYTES 或为二进制文件时返回None
+        '''
+        url = urljoin(f"{self.gitlab_url}/",
+                      f"api/v4/projects/{self.project_id}/repository/files/{quote(path, safe='')}/raw")
+        headers = {
+            'Private-Token': self.gitlab_token
+        }
+        response = http_client.get(url, headers=headers, params={'ref': ref}, verify=False,
+                                   priority=self.request_priority)
+        if response.status_code != 200:
+            logger.warn(f"Failed to get raw file {path}@{ref[:12]} from GitLab: {response.status_code}")
+            return None
+        content = response.content
+        if len(content) > int(os.getenv('GITLAB_RAW_FILE_MAX_BYTES', 1024 * 1024)) or b'\0' in content:
+            return None
+        return content.decode('utf-8', errors='replace')
+
+    def _iter_diffs_items(self, items: list, next_page: Optional[int]) -> Iterator[dict]:
+        yield from items
+        while next_page:
+            result = self._fetch_diffs_page(next_page)
+            if result is None:
+                logger.warn(f"Failed to get diffs page {next_page} of merge request {self.merge_request_iid}, "
+                            f"remaining files skipped.")
+                return
+            items, next_page = result
+            yield from items
+
+    def _fetch_diffs_page(self, page: int):
+        '''
+        获取 /diffs 接口的一页，返回 (变更列表, 下一页页码)，请求失败时返回None
+        '''
+        url = urljoin(f"{self.gitlab_url}/",
+                      f"api/v4/projects/{self.project_id}/merge_requests/{self.merge_request_iid}/diffs")
+        headers = {
+            'Private-Token': self.gitlab_token
+        }
+        params = {'page': page, 'per_page': int(os.getenv('GITLAB_DIFFS_PER_PAGE', 20))}
+        response = http_client.get(url, headers=headers, params=params, verify=False,
+                                   priority=self.request_priority)
+        logger.debug(f"Get diffs page {page} from GitLab: {response.status_code}, "
+                     f"{len(response.content)} bytes, URL: {url}")
 
-        # Gitlab merge request changes API可能存在延迟，多次尝试
-        max_retries = 3  # 最大重试次数
-        retry_delay = 10  # 重试间隔时间（秒）
-        for attempt in range(max_retries):
-            # 调用 GitLab API 获取 Merge Request 的 changes
-            url = urljoin(f"{self.gitlab_url}/",
-                          f"api/v4/projects/{self.project_id}/merge_requests/{self.merge_request_iid}/changes?access_raw_diffs=true")
-            headers = {
-                'Private-Token': self.gitlab_token
-            }
-            response = requests.get(url, headers=headers, verify=False)
-            logger.debug(
-                f"Get changes response from GitLab (attempt {attempt + 1}): {response.status_code}, {response.text}, URL: {url}")
-
-            # 检查请求是否成功
-            if response.status_code == 200:
-                changes = response.json().get('changes', [])
-                if changes:
-                    return changes
-                else:
-                    logger.info(
-                        f"Changes is empty, retrying in {retry_delay} seconds... (attempt {attempt + 1}/{max_retries}), URL: {url}")
-                    time.sleep(retry_delay)
-            else:
-                logger.warn(f"Failed to get changes from GitLab (URL: {url}): {response.status_code}, {response.text}")
-                return []
+        if response.status_code == 200:
+            next_page = response.headers.get('X-Next-Page')
+            return response.json(), int(next_page) if next_page else None
+        if response.status_code == 404 and page == 1:
+            # /diffs 接口需要 GitLab 15.7 及以上版本，旧版本回退到一次性获取的 /changes 接口
+            logger.info(f"GitLab diffs API not available, fallback to changes API (URL: {url}).")
+            changes = self._fetch_merge_request_changes()
+            return None if changes is None else (changes, None)
+        logger.warn(f"Failed to get diffs from GitLab (URL: {url}): {response.status_code}")
+        return None
+
+    def _fetch_merge_request_changes(self) -> Optional[list]:
+        '''
+        调用 GitLab API 一次性获取 Merge Request 的 changes，请求失败时返回None
+        '''
+        url = urljoin(f"{self.gitlab_url}/",
+                      f"api/v4/projects/{self.project_id}/merge_requests/{self.merge_request_iid}/changes?access_raw_diffs=true")
+        headers = {
+            'Private-Token': self.gitlab_token
+        }
+        response = http_client.get(url, headers=headers, verify=False, priority=self.request_priority)
+        logger.debug(f"Get changes response from GitLab: {response.status_code}, "
+                     f"{len(response.content)} bytes, URL: {url}")
 
-        logger.warning(f"Max retries ({max_retries}) reached. Changes is still empty.")
-        return []  # 达到最大重试次数后返回空列表
+        # 检查请求是否成功
+        if response.status_code == 200:
+            return response.json().get('changes', [])
+        logger.warn(f"Failed to get changes from GitLab (URL: {url}): {response.status_code}")
+        return None
 
     def get_merge_request_commits(self) -> list:
         # 检查是否为 Merge Request Hook 事件
@@ -120,7 +342,7 @@ class MergeRequestHandler:
         headers = {
             'Private-Token': self.gitlab_token
         }
-        response = requests.get(url, headers=headers, verify=False)
+        response = http_client.get(url, headers=headers, verify=False, priority=self.request_priority)
         logger.debug(f"Get commits response from gitlab: {response.status_code}, {response.text}")
         # 检查请求是否成功
         if response.status_code == 200:
@@ -139,34 +361,50 @@ class MergeRequestHandler:
         data = {
             'body': review_result
         }
-        response = requests.post(url, headers=headers, json=data, verify=False)
+        response = http_client.post(url, headers=headers, json=data, verify=False, priority=self.request_priority)
         logger.debug(f"Add notes to gitlab {url}: {response.status_code}, {response.text}")
         if response.status_code == 201:
             logger.info("Note successfully added to merge request.")
+            return True
         else:
             logger.error(f"Failed to add note: {response.status_code}")
             logger.error(response.text)
+            return False
 
     def target_branch_protected(self) -> bool:
+        protected_branches = self.get_protected_branches()
+        if protected_branches is None:
+            return False
+        target_branch = self.webhook_data['object_attributes']['target_branch']
+        return any(fnmatch.fnmatch(target_branch, name) for name in protected_branches)
+
+    def get_protected_branches(self):
+        '''
+        获取项目的受保护分支名称列表（带TTL缓存），请求失败时返回None
+        '''
+        return project_metadata_cache.get_or_load(self.gitlab_url, self.project_id, FIELD_PROTECTED_BRANCHES,
+                                                  self._fetch_protected_branches)
+
+    def _fetch_protected_branches(self):
         url = urljoin(f"{self.gitlab_url}/",
                       f"api/v4/projects/{self.project_id}/protected_branches")
         headers = {
             'Private-Token': self.gitlab_token,
             'Content-Type': 'application/json'
         }
-        response = requests.get(url, headers=headers, verify=False)
+        response = http_client.get(url, headers=headers, verify=False, priority=self.request_priority)
         logger.debug(f"Get protected branches response from gitlab: {response.status_code}, {response.text}")
         # 检查请求是否成功
         if response.status_code == 200:
-            data = response.json()
-            target_branch = self.webhook_data['object_attributes']['target_branch']
-            return any(fnmatch.fnmatch(target_branch, item['name']) for item in data)
+            return [item['name'] for item in response.json()]
         else:
             logger.warn(f"Failed to get protected branches: {response.status_code}, {response.text}")
-            return False
+            return None
 
 
 class PushHandler:
+    request_priority = PRIORITY_LOW
+
     def __init__(self, webhook_data: dict, gitlab_token: str, gitlab_url: str):
         self.webhook_data = webhook_data
         self.gitlab_token = gitlab_token
@@ -215,13 +453,13 @@ class PushHandler:
         # 添加评论到 GitLab Push 请求的提交中（此处假设是在最后一次提交上添加注释）
         if not self.commit_list:
             logger.warn("No commits found to add notes to.")
-            return
+            return False
 
         # 获取最后一个提交的ID
         last_commit_id = self.commit_list[-1].get('id')
         if not last_commit_id:
             logger.error("Last commit ID not found.")
-            return
+            return False
 
         url = urljoin(f"{self.gitlab_url}/",
                       f"api/v4/projects/{self.project_id}/repository/commits/{last_commit_id}/comments")
@@ -232,13 +470,15 @@ class PushHandler:
         data = {
             'note': message
         }
-        response = requests.post(url, headers=headers, json=data, verify=False)
+        response = http_client.post(url, headers=headers, json=data, verify=False, priority=self.request_priority)
         logger.debug(f"Add comment to commit {last_commit_id}: {response.status_code}, {response.text}")
         if response.status_code == 201:
             logger.info("Comment successfully added to push commit.")
+            return True
         else:
             logger.error(f"Failed to add comment: {response.status_code}")
             logger.error(response.text)
+            return False
 
     def __repository_commits(self, ref_name: str = "", since: str = "", until: str = "", pre_page: int = 100,
                              page: int = 1):
@@ -247,7 +487,7 @@ class PushHandler:
         headers = {
             'Private-Token': self.gitlab_token
         }
-        response = requests.get(url, headers=headers, verify=False)
+        response = http_client.get(url, headers=headers, verify=False, priority=self.request_priority)
         logger.debug(
             f"Get commits response from GitLab for repository_commits: {response.status_code}, {response.text}, URL: {url}")
 
@@ -258,19 +498,33 @@ class PushHandler:
                 f"Failed to get commits for ref {ref_name}: {response.status_code}, {response.text}")
             return []
 
+    @sha_cache.cached('parent', scope=lambda h: (h.gitlab_url, h.project_id))
     def get_parent_commit_id(self, commit_id: str) -> str:
+        repo_path = sync_local_mirror(self.webhook_data, self.gitlab_url, self.gitlab_token, self.project_id,
+                                      (commit_id,))
+        if repo_path:
+            return local_mirror.parent(repo_path, commit_id)
         commits = self.__repository_commits(ref_name=commit_id, pre_page=1, page=1)
         if commits and commits[0].get('parent_ids', []):
             return commits[0].get('parent_ids', [])[0]
         return ""
 
+    @sha_cache.cached('compare', scope=lambda h: (h.gitlab_url, h.project_id))
     def repository_compare(self, before: str, after: str):
-        # 比较两个提交之间的差异
+        # 比较两个提交之间的差异，开启本地镜像时在本地计算
+        repo_path = sync_local_mirror(self.webhook_data, self.gitlab_url, self.gitlab_token, self.project_id,
+                                      (before, after))
+        if repo_path:
+            try:
+                return local_mirror.compare(repo_path, before, after)
+            except MirrorError as e:
+                logger.warn(f"Local mirror compare failed, fallback to API: {e}")
+
         url = f"{urljoin(f'{self.gitlab_url}/', f'api/v4/projects/{self.project_id}/repository/compare')}?from={before}&to={after}"
         headers = {
             'Private-Token': self.gitlab_token
         }
-        response = requests.get(url, headers=headers, verify=False)
+        response = http_client.get(url, headers=headers, verify=False, priority=self.request_priority)
         logger.debug(
             f"Get changes response from GitLab for repository_compare: {response.status_code}, {response.text}, URL: {url}")
 
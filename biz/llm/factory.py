@@ -10,9 +10,24 @@ from biz.utils.log import logger
 
 
 class Factory:
+    # 每个进程按 provider 复用客户端(HTTP连接池)；fork后的子进程不能复用父进程的连接，重新创建
+    _clients = {}
+    _pid = None
+
     @staticmethod
     def getClient(provider: str = None) -> BaseClient:
         provider = provider or os.getenv("LLM_PROVIDER", "openai")
+        if Factory._pid != os.getpid():
+            Factory._clients = {}
+            Factory._pid = os.getpid()
+        client = Factory._clients.get(provider)
+        if client is None:
+            # 多个线程同时创建时以先写入的为准
+            client = Factory._clients.setdefault(provider, Factory.createClient(provider))
+        return client
+
+    @staticmethod
+    def createClient(provider: str) -> BaseClient:
         chat_model_providers = {
             'zhipuai': lambda: ZhipuAIClient(),
             'openai': lambda: OpenAIClient(),
@@ -0,0 +1,201 @@
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from biz.queue.deferral import JobDeferred
+from biz.utils.kv_store import KVStore, get_kv_store
+from biz.utils.log import logger
+
+# 合并的push中保留的提交数上限
+MAX_COALESCED_COMMITS = 200
+
+
+def review_project(data: dict) -> Optional[str]:
+    """
+    事件所属的项目：GitLab、Coding 为项目ID，GitHub/Gitea 为仓库全名
+    """
+    project = (data.get('project') or {}).get('id') or (data.get('repository') or {}).get('full_name')
+    return str(project) if project else None
+
+
+def review_key(provider: str, event_type: str, url_slug: str, data: dict) -> Optional[str]:
+    """
+    同一个MR/PR或同一个分支的事件共享同一个key：MR/PR 按 (平台, 项目, 编号)，push 按 (平台, 项目, 分支)
+    """
+    project = review_project(data)
+    if not project:
+        return None
+    if event_type == 'push':
+        ref = data.get('ref')
+        return f"{provider}:{url_slug}:{project}:branch:{ref}" if ref else None
+    number = (data.get('object_attributes') or {}).get('iid') or (data.get('pull_request') or {}).get('number') or \
+             (data.get('mergeRequest') or {}).get('number')
+    return f"{provider}:{url_slug}:{project}:mr:{number}" if number else None
+
+
+def review_head(event_type: str, data: dict) -> str:
+    if event_type == 'push':
+        return data.get('after') or ''
+    last_commit = (data.get('object_attributes') or {}).get('last_commit') or {}
+    # GitHub/Gitea 为 pull_request，Coding 为 mergeRequest
+    pull_request = data.get('pull_request') or data.get('mergeRequest') or {}
+    return last_commit.get('id') or (pull_request.get('head') or {}).get('sha') or ''
+
+
+class ReviewDebouncer:
+    """
+    对同一个MR/PR或分支的连续更新去抖：入队时登记最新的head，任务延迟到去抖窗口结束后执行，
+    执行时已被更新的head取代的任务直接跳过，窗口因新的更新延长时抛出 JobDeferred 由队列推迟到新窗口结束；review过程中被取代的任务丢弃结果，不发表评论。
+    被取代的push会合并到最新的push中，最新的任务从最早未review的提交开始比较，不会漏掉中间的提交。
+    """
+
+    def __init__(self, store: KVStore = None, window: float = None, supersede: bool = None):
+        self._store = store
+        self.window = window if window is not None else float(os.getenv('REVIEW_DEBOUNCE_SECONDS', 0))
+        # 不去抖时也登记最新的head，排队中的旧任务被新任务取代，需单独开启
+        self.supersede = supersede if supersede is not None else os.getenv('REVIEW_SUPERSEDE_ENABLED', '0') == '1'
+        # 状态保留时间，超过后视为没有登记
+        self.state_ttl = max(self.window * 10, 86400)
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 or self.supersede
+
+    @property
+    def store(self) -> KVStore:
+        if self._store is None:
+            self._store = get_kv_store()
+        return self._store
+
+    @contextmanager
+    def _lock(self, key: str):
+        # 同一key的登记和完成需要读-改-写，使用KVStore的add实现跨进程的短期锁，获取超时后不再等待
+        lock_key, token = f"review_debounce_lock:{key}", uuid.uuid4().hex
+        deadline = time.time() + 2
+        while not self.store.add(lock_key, token, ttl=5) and time.time() < deadline:
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            self.store.compare_and_delete(lock_key, token)
+
+    def register(self, provider: str, event_type: str, url_slug: str, data: dict) -> Tuple[float, Optional[tuple]]:
+        """
+        webhook入口登记最新的head，未完成review的push保留最早的before和累计的提交。
+        返回(任务应延迟执行的秒数, 登记记录)：不去抖的事件延迟为0；任务入队失败时调用方通过 restore(登记记录) 恢复登记前的状态
+        """
+        key = review_key(provider, event_type, url_slug, data)
+        head = review_head(event_type, data)
+        if not self.enabled or not key or not head:
+            return 0, None
+        state_key = f"review_debounce:{key}"
+        try:
+            with self._lock(key):
+                previous = self.store.get(state_key)
+                state = previous or {}
+                pending = state and not state.get('done')
+                if pending and state.get('head') == head:
+                    # MR的标题、标签等更新不改变head，不延长去抖窗口
+                    return max(state.get('updated_at', 0) + self.window - time.time(), 0), None
+                base = state.get('base') if pending else data.get('before')
+                commits = (state.get('commits') or []) if pending else []
+                if event_type == 'push':
+                    commits = (commits + (data.get('commits') or []))[-MAX_COALESCED_COMMITS:]
+                current = {'head': head, 'base': base, 'commits': commits, 'done': False, 'updated_at': time.time()}
+                self.store.set(state_key, current, ttl=self.state_ttl)
+            if pending:
+                logger.info(f"Review debounce: {key} updated to {head[:12]}, older head superseded.")
+        except Exception as e:
+            logger.warn(f"Failed to register review debounce state for {key}: {e}")
+            return 0, None
+        return self.window, (key, previous, current)
+
+    def restore(self, registration: Optional[tuple]):
+        """
+        任务入队失败时撤销 register 的登记：状态仍是本次登记的值时恢复为登记前的状态，
+        被取代的旧任务不会因为没有入队的新head而跳过；之后又有新的登记时不做修改
+        """
+        if not registration:
+            return
+        key, previous, current = registration
+        state_key = f"review_debounce:{key}"
+        try:
+            if previous:
+                restored = self.store.compare_and_set(state_key, current, previous, ttl=self.state_ttl)
+            else:
+                restored = self.store.compare_and_delete(state_key, current)
+            if restored:
+                logger.info(f"Review debounce: {key} registration of {current['head'][:12]} restored.")
+        except Exception as e:
+            logger.warn(f"Failed to restore review debounce state for {key}: {e}")
+
+    def begin(self, provider: str, event_type: str, url_slug: str, data: dict) -> Optional[dict]:
+        """
+        worker开始处理前调用：返回需要review的webhook数据(push已合并被取代的提交)，当前任务已被更新的head取代时返回None；
+        去抖窗口未结束(入队后窗口被同一head的重复登记等延长)时抛出 JobDeferred，由队列推迟到窗口结束后重新投递
+        """
+        key = review_key(provider, event_type, url_slug, data)
+        head = review_head(event_type, data)
+        if not self.enabled or not key or not head:
+            return data
+        state_key = f"review_debounce:{key}"
+        try:
+            state = self.store.get(state_key)
+        except Exception as e:
+            logger.warn(f"Failed to read review debounce state for {key}: {e}")
+            return data
+        if not state:
+            return data
+        if state.get('head') != head:
+            logger.info(f"Review debounce: {key} head {head[:12]} superseded by {state.get('head', '')[:12]}, skipped.")
+            return None
+        remaining = state.get('updated_at', 0) + self.window - time.time()
+        if remaining > 0 and not state.get('done'):
+            raise JobDeferred(remaining, f"{key} debounce window not over")
+
+        if event_type == 'push' and state.get('base') and state.get('base') != data.get('before'):
+            logger.info(f"Review debounce: {key} coalesced pushes from {state['base'][:12]} to {head[:12]}.")
+            return {**data, 'before': state['base'], 'commits': state.get('commits') or data.get('commits')}
+        return data
+
+    def superseded(self, provider: str, event_type: str, url_slug: str, data: dict) -> bool:
+        """
+        当前任务的head是否已被同一MR/PR或分支更新的事件取代
+        """
+        key = review_key(provider, event_type, url_slug, data)
+        head = review_head(event_type, data)
+        if not self.enabled or not key or not head:
+            return False
+        try:
+            state = self.store.get(f"review_debounce:{key}")
+        except Exception as e:
+            logger.warn(f"Failed to read review debounce state for {key}: {e}")
+            return False
+        return bool(state) and state.get('head') != head
+
+    def finish(self, provider: str, event_type: str, url_slug: str, data: dict) -> bool:
+        """
+        发表review结果前调用：当前head仍是最新时标记完成并返回True，已被取代时返回False，调用方应丢弃结果
+        """
+        key = review_key(provider, event_type, url_slug, data)
+        head = review_head(event_type, data)
+        if not self.enabled or not key or not head:
+            return True
+        state_key = f"review_debounce:{key}"
+        try:
+            with self._lock(key):
+                state = self.store.get(state_key)
+                if state and state.get('head') != head:
+                    logger.info(f"Review debounce: {key} head {head[:12]} superseded during review, "
+                                f"result discarded.")
+                    return False
+                self.store.set(state_key, {'head': head, 'base': None, 'commits': [], 'done': True,
+                                           'updated_at': time.time()}, ttl=self.state_ttl)
+        except Exception as e:
+            logger.warn(f"Failed to update review debounce state for {key}: {e}")
+        return True
+
+
+review_debouncer = ReviewDebouncer()
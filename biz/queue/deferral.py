@@ -0,0 +1,57 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from biz.utils.log import logger
+
+
+class JobDeferred(Exception):
+    """
+    处理函数抛出后，队列在 delay 秒后重新投递同一个任务，当前执行不计为失败。
+    用于不应占用worker等待的情况：同一MR/PR的任务正在执行、去抖窗口未结束、Git平台限流配额不足等。
+    rq模式放入 FairQueue 的延迟集合，sqlite模式推迟 available_at，async模式由进程池定时重新提交
+    """
+
+    def __init__(self, delay: float, reason: str = ''):
+        super().__init__(delay, reason)
+        self.delay = max(float(delay), 0.0)
+        self.reason = reason
+
+    def __str__(self):
+        return f"deferred for {self.delay:.1f}s: {self.reason}" if self.reason else f"deferred for {self.delay:.1f}s"
+
+
+# 当前执行的代码抛出 JobDeferred 是否安全：只在任务发表评论、调用大模型之前的阶段开启，推迟不会重复这些操作
+_deferrable = contextvars.ContextVar('job_deferrable', default=False)
+
+
+@contextmanager
+def deferrable(enabled: bool = True):
+    """
+    在上下文中开启(或关闭)推迟任务，Provider API 限流等待较长时据此选择推迟任务还是在当前线程等待
+    """
+    token = _deferrable.set(enabled)
+    try:
+        yield
+    finally:
+        _deferrable.reset(token)
+
+
+def can_defer() -> bool:
+    return _deferrable.get()
+
+
+def run_deferrable(function: Callable, *args, delay: float = 0):
+    """
+    在没有队列重新投递的场景(每个事件一个子进程、命令行重放)中执行任务：delay 秒后执行，推迟时在当前进程等待后重新执行。
+    这些场景中每个任务独占一个进程，等待不会占用其他任务的执行名额
+    """
+    if delay > 0:
+        time.sleep(delay)
+    while True:
+        try:
+            return function(*args)
+        except JobDeferred as e:
+            logger.info(f"Job {e}, waiting in process.")
+            time.sleep(e.delay)
@@ -0,0 +1,352 @@
+import os
+import time
+from datetime import timezone
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from rq import Queue, Worker
+from rq.exceptions import DequeueTimeout, NoSuchJobError
+from rq.job import Job, JobStatus
+from rq.utils import now as utc_now
+
+from biz.queue.deferral import JobDeferred
+from biz.utils.log import logger
+
+# 按优先级排列的车道：MR/PR 优先于 push，报告等后台任务最后
+LANES = ('mr', 'push', 'report')
+# 不属于任何项目的任务
+NO_PROJECT = '-'
+# 执行中计数的租约在任务超时后额外保留的时间，worker异常退出后计数自动恢复
+LEASE_MARGIN = 60
+# 入队、出队速率按分钟计数，统计最近 RATE_WINDOW 秒
+RATE_WINDOW = 300
+
+
+def lane_for_event(event_type: str) -> str:
+    if event_type == 'push':
+        return 'push'
+    if event_type in ('merge_request', 'pull_request'):
+        return 'mr'
+    return 'report'
+
+
+def lane_queue_name(url_slug: str, lane: str) -> str:
+    return f"{url_slug}:{lane}"
+
+
+def split_lane(queue_name: str) -> Tuple[str, Optional[str]]:
+    """
+    队列名拆分为 (url_slug, 车道)，升级前的队列没有车道后缀
+    """
+    url_slug, _, lane = queue_name.rpartition(':')
+    if url_slug and lane in LANES:
+        return url_slug, lane
+    return queue_name, None
+
+
+def expand_lanes(queue_names: List[str]) -> List[str]:
+    """
+    worker监听的队列：url_slug 展开为各车道，按车道优先级排列(所有 url_slug 的mr车道在前)，
+    最后是升级前未带车道后缀的队列；已指定车道的队列保持原样
+    """
+    slugs = list(dict.fromkeys(name for name in queue_names if split_lane(name)[1] is None))
+    lanes = [name for name in queue_names if split_lane(name)[1] is not None]
+    expanded = [lane_queue_name(slug, lane) for lane in LANES for slug in slugs]
+    return list(dict.fromkeys(lanes + expanded + slugs))
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """
+    解析项目权重配置，例如 "123=2,group/repo=0.5"，未配置的项目权重为1
+    """
+    weights = {}
+    for item in (value or '').split(','):
+        project, _, weight = item.strip().rpartition('=')
+        if project:
+            try:
+                weights[project.strip()] = float(weight)
+            except ValueError:
+                logger.warn(f"Invalid project weight: {item}")
+    return weights
+
+
+def choose_job(jobs: List[Tuple[str, str]], vtimes: Dict[str, float], system_vtime: float,
+               running: Dict[str, int], max_running: int) -> Optional[Tuple[str, str, float]]:
+    """
+    按 start-time fair queuing 从候选任务中选择下一个：每个项目只考虑最早的任务，
+    跳过执行中任务数达到上限的项目，选择虚拟开始时间最小的项目，相同时按入队顺序。
+    返回 (job_id, 项目, 虚拟开始时间)
+    """
+    chosen, seen = None, set()
+    for job_id, project in jobs:
+        if project in seen:
+            continue
+        seen.add(project)
+        if max_running and running.get(project, 0) >= max_running:
+            continue
+        # 空闲后重新有任务的项目从当前系统虚拟时间开始，不能用积攒的额度抢占其他项目
+        start = max(vtimes.get(project, 0.0), system_vtime)
+        if chosen is None or start < chosen[2]:
+            chosen = (job_id, project, start)
+    return chosen
+
+
+class FairQueue(Queue):
+    """
+    按项目公平调度的RQ队列：任务入队时登记所属项目，worker取任务时在队列前 RQ_FAIR_WINDOW 个任务中
+    按项目权重轮流选择，并限制每个项目同时执行的任务数(RQ_PROJECT_CONCURRENCY)，一个项目的突发事件不会饿死其他项目。
+    推迟的任务保存在延迟集合中，到期后由取任务的worker放回队列，不依赖 rq scheduler。
+    """
+
+    @property
+    def projects_key(self) -> str:
+        return f"{self.key}:projects"
+
+    @property
+    def deferred_key(self) -> str:
+        return f"{self.key}:deferred"
+
+    @property
+    def vtime_key(self) -> str:
+        return f"{self.key}:vtime"
+
+    @property
+    def wait_key(self) -> str:
+        return f"{self.key}:wait"
+
+    @property
+    def url_slug(self) -> str:
+        return split_lane(self.name)[0]
+
+    def count_key(self, kind: str, minute: int) -> str:
+        # 同一 url_slug 各车道共享速率计数
+        return f"rq:fair:{kind}:{self.url_slug}:{minute}"
+
+    def _count(self, pipeline, kind: str):
+        key = self.count_key(kind, int(time.time() // 60))
+        pipeline.incr(key)
+        pipeline.expire(key, RATE_WINDOW + 120)
+
+    def rate(self, kind: str) -> float:
+        """
+        最近 RATE_WINDOW 秒内每秒入队(enqueued)或出队(dequeued)的任务数
+        """
+        now = time.time()
+        minute = int(now // 60)
+        minutes = range(minute - RATE_WINDOW // 60 + 1, minute + 1)
+        counts = self.connection.mget([self.count_key(kind, m) for m in minutes])
+        elapsed = RATE_WINDOW - 60 + (now - minute * 60)
+        return sum(int(count or 0) for count in counts) / elapsed
+
+    @property
+    def service_key(self) -> str:
+        return f"rq:fair:service:{self.url_slug}"
+
+    def record_service_time(self, seconds: float):
+        # 任务执行时间的指数移动平均，用于估算需要的worker数
+        previous = self.connection.get(self.service_key)
+        average = seconds if previous is None else 0.8 * float(previous) + 0.2 * seconds
+        self.connection.set(self.service_key, average, ex=7 * 86400)
+
+    def service_time(self) -> Optional[float]:
+        value = self.connection.get(self.service_key)
+        return float(value) if value is not None else None
+
+    @staticmethod
+    def running_key(url_slug: str, project: str) -> str:
+        # 同一项目各车道共享执行中计数
+        return f"rq:fair:running:{url_slug}:{project}"
+
+    def enqueue_for_project(self, project: Optional[str], function, *args, delay: float = 0) -> Job:
+        """
+        入队并登记所属项目，delay 大于0时先放入延迟集合，到期后才进入队列
+        """
+        job_id = str(uuid4())
+        pipeline = self.connection.pipeline()
+        pipeline.hset(self.projects_key, job_id, project or NO_PROJECT)
+        pipeline.expire(self.projects_key, 7 * 86400)
+        self._count(pipeline, 'enqueued')
+        pipeline.execute()
+        if delay <= 0:
+            return self.enqueue(function, *args, job_id=job_id)
+        job = self.create_job(function, args=args, job_id=job_id, status=JobStatus.SCHEDULED)
+        job.save()
+        self.connection.zadd(self.deferred_key, {job_id: time.time() + delay})
+        return job
+
+    def defer(self, job: Job, delay: float) -> Job:
+        """
+        以新任务重新投递推迟的任务，delay 秒后进入队列
+        """
+        return self.enqueue_for_project(job.meta.get('fair_project'), job.func_name, *job.args, delay=delay)
+
+    def promote_deferred(self) -> int:
+        """
+        将到期的推迟任务放回队列，返回放回的任务数
+        """
+        promoted = 0
+        for job_id in self.connection.zrangebyscore(self.deferred_key, 0, time.time()):
+            # 多个worker同时检查时只有成功移除的worker放回队列
+            if not self.connection.zrem(self.deferred_key, job_id):
+                continue
+            job_id = job_id.decode()
+            try:
+                job = self.job_class.fetch(job_id, connection=self.connection, serializer=self.serializer)
+            except NoSuchJobError:
+                self.connection.hdel(self.projects_key, job_id)
+                continue
+            self.enqueue_job(job)
+            promoted += 1
+        return promoted
+
+    @property
+    def deferred_count(self) -> int:
+        return self.connection.zcard(self.deferred_key)
+
+    @classmethod
+    def dequeue_any(cls, queues: List['Queue'], timeout: Optional[int], connection=None, job_class=None,
+                    serializer=None, death_penalty_class=None):
+        """
+        按车道顺序取任务，车道内按项目公平选择；没有可执行的任务时轮询等待，最多 timeout 秒
+        """
+        poll_interval = float(os.getenv('RQ_FAIR_POLL_INTERVAL', 0.5))
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            for queue in queues:
+                job = queue.dequeue_fair(job_class=job_class, serializer=serializer)
+                if job is not None:
+                    return job, queue
+            if deadline is None:
+                return None
+            if time.time() >= deadline:
+                raise DequeueTimeout(timeout, [queue.key for queue in queues])
+            time.sleep(poll_interval)
+
+    def dequeue_fair(self, job_class=None, serializer=None) -> Optional[Job]:
+        window = int(os.getenv('RQ_FAIR_WINDOW', 100))
+        max_running = int(os.getenv('RQ_PROJECT_CONCURRENCY', 0))
+        weights = parse_weights(os.getenv('RQ_PROJECT_WEIGHTS', ''))
+        url_slug, _ = split_lane(self.name)
+        self.promote_deferred()
+        skipped = set()
+        while True:
+            job_ids = [job_id for job_id in self.get_job_ids(0, window) if job_id not in skipped]
+            if not job_ids:
+                return None
+            projects = self.connection.hmget(self.projects_key, job_ids)
+            jobs = [(job_id, project.decode() if project else NO_PROJECT) for job_id, project in zip(job_ids, projects)]
+            now = time.time()
+            candidates = {project for _, project in jobs}
+            running = {}
+            if max_running:
+                pipeline = self.connection.pipeline()
+                for project in candidates:
+                    pipeline.zremrangebyscore(self.running_key(url_slug, project), 0, now)
+                    pipeline.zcard(self.running_key(url_slug, project))
+                running = dict(zip(candidates, pipeline.execute()[1::2]))
+            vtimes = {project.decode(): float(vtime) for project, vtime in self.connection.hgetall(self.vtime_key).items()}
+            chosen = choose_job(jobs, vtimes, vtimes.get('', 0.0), running, max_running)
+            if chosen is None:
+                return None
+            job_id, project, start = chosen
+            # 多个worker同时选中同一个任务时只有一个能从队列中移除它
+            if not self.connection.lrem(self.key, 1, job_id):
+                skipped.add(job_id)
+                continue
+            try:
+                job = (job_class or self.job_class).fetch(job_id, connection=self.connection,
+                                                          serializer=serializer or self.serializer)
+            except NoSuchJobError:
+                self.connection.hdel(self.projects_key, job_id)
+                skipped.add(job_id)
+                continue
+            if max_running:
+                # 并发取任务时可能同时超过上限，登记后再检查一次，超过则放回队首
+                lease = now + (job.timeout or self.DEFAULT_TIMEOUT) + LEASE_MARGIN
+                pipeline = self.connection.pipeline()
+                pipeline.zadd(self.running_key(url_slug, project), {job_id: lease})
+                pipeline.zcard(self.running_key(url_slug, project))
+                if pipeline.execute()[1] > max_running:
+                    pipeline.zrem(self.running_key(url_slug, project), job_id)
+                    pipeline.lpush(self.key, job_id)
+                    pipeline.execute()
+                    skipped.update(job_id for job_id, job_project in jobs if job_project == project)
+                    continue
+            pipeline = self.connection.pipeline()
+            pipeline.hdel(self.projects_key, job_id)
+            # 虚拟时间按权重增长，权重越大的项目获得的执行机会越多；空字段保存系统虚拟时间
+            pipeline.hset(self.vtime_key, mapping={project: start + 1 / weights.get(project, 1.0), '': start})
+            pipeline.expire(self.vtime_key, 7 * 86400)
+            if job.enqueued_at:
+                wait = now - job.enqueued_at.replace(tzinfo=job.enqueued_at.tzinfo or timezone.utc).timestamp()
+                pipeline.hincrbyfloat(self.wait_key, 'total', max(wait, 0.0))
+                pipeline.hincrby(self.wait_key, 'count', 1)
+                pipeline.hset(self.wait_key, 'last', max(wait, 0.0))
+            self._count(pipeline, 'dequeued')
+            pipeline.execute()
+            job.meta['fair_project'] = project
+            return job
+
+    def release(self, job: Job):
+        """
+        任务执行结束后释放所属项目的执行中计数
+        """
+        project = job.meta.get('fair_project')
+        if project:
+            url_slug, _ = split_lane(self.name)
+            self.connection.zrem(self.running_key(url_slug, project), job.id)
+
+    def wait_stats(self) -> dict:
+        values = {key.decode(): float(value) for key, value in self.connection.hgetall(self.wait_key).items()}
+        count = int(values.get('count', 0))
+        return {
+            'dequeued': count,
+            'avg_wait': values.get('total', 0.0) / count if count else 0.0,
+            'last_wait': values.get('last', 0.0),
+        }
+
+
+class FairWorker(Worker):
+    """
+    按车道和项目公平调度的RQ worker：启动参数中的队列名(url_slug)展开为 mr、push、report 三个车道，
+    高优先级车道有任务时总是先执行，最后处理升级前未带车道后缀的队列。
+    使用方式：rq worker -w biz.queue.fair.FairWorker git_test_com
+    """
+    queue_class = FairQueue
+
+    def __init__(self, queues, *args, **kwargs):
+        names = [queue if isinstance(queue, str) else queue.name for queue in queues]
+        kwargs.pop('queue_class', None)
+        super().__init__(expand_lanes(names), *args, **kwargs)
+        # 当前任务抛出的 JobDeferred：(任务ID, 推迟秒数)
+        self._deferred = None
+
+    def handle_exception(self, job: Job, *exc_info):
+        if isinstance(exc_info[1], JobDeferred):
+            # 推迟不是失败，不记录错误、不调用异常处理器，由 handle_job_failure 重新投递
+            self._deferred = (job.id, exc_info[1].delay)
+            logger.info(f"Job {job.id} {exc_info[1]}")
+            return
+        super().handle_exception(job, *exc_info)
+
+    def handle_job_failure(self, job: Job, queue: Queue, started_job_registry=None, exc_string=''):
+        deferred, self._deferred = self._deferred, None
+        if deferred is None or deferred[0] != job.id or not isinstance(queue, FairQueue):
+            return super().handle_job_failure(job, queue, started_job_registry=started_job_registry,
+                                              exc_string=exc_string)
+        queue.defer(job, deferred[1])
+        # 原任务按完成处理，父进程不会把它当作异常退出的任务
+        job.ended_at = job.ended_at or utc_now()
+        self.handle_job_success(job, queue, started_job_registry or queue.started_job_registry)
+
+    def execute_job(self, job: Job, queue: Queue):
+        started = time.time()
+        try:
+            super().execute_job(job, queue)
+        finally:
+            if isinstance(queue, FairQueue):
+                queue.release(job)
+                try:
+                    queue.record_service_time(time.time() - started)
+                except Exception as e:
+                    logger.warn(f"Failed to record service time for {queue.name}: {e}")
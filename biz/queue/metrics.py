@@ -0,0 +1,127 @@
+import math
+import os
+import time
+from datetime import timezone
+from typing import Optional
+
+from biz.queue.fair import FairQueue, split_lane
+from biz.utils import queue as queue_module
+
+# Prometheus 指标名 => (字段, 说明)
+GAUGES = {
+    'codereview_queue_depth': ('depth', 'Jobs waiting in the queue'),
+    'codereview_queue_oldest_job_age_seconds': ('oldest_age', 'Age of the oldest waiting job'),
+    'codereview_queue_enqueue_rate': ('enqueue_rate', 'Jobs enqueued per second over the last 5 minutes'),
+    'codereview_queue_dequeue_rate': ('dequeue_rate', 'Jobs dequeued per second over the last 5 minutes'),
+    'codereview_queue_service_time_seconds': ('service_time', 'Moving average of job execution time'),
+    'codereview_queue_workers_busy': ('busy_workers', 'Workers currently executing a job'),
+    'codereview_queue_workers_idle': ('idle_workers', 'Workers waiting for jobs'),
+    'codereview_queue_worker_utilization': ('utilization', 'Busy workers / all workers serving the queue'),
+    'codereview_queue_workers_needed': ('workers_needed', 'Workers needed to meet the target latency'),
+}
+
+
+def workers_needed(arrival_rate: float, service_time: Optional[float], depth: int, target_latency: float,
+                   target_utilization: float) -> Optional[int]:
+    """
+    满足目标延迟需要的worker数：稳态下平均忙碌的worker数为 到达速率 × 执行时间(Little定律)，按目标利用率留出余量，
+    再加上在目标延迟内消化当前积压需要的worker数。没有执行时间数据时无法估算，返回None
+    """
+    if service_time is None:
+        return None
+    steady = arrival_rate * service_time / target_utilization
+    backlog = depth * service_time / target_latency
+    return math.ceil(steady + backlog)
+
+
+def rq_queue_metrics(connection) -> dict:
+    """
+    按 url_slug(WORKER_QUEUE) 汇总各车道的积压、速率，以及监听该队列的worker忙碌/空闲数
+    """
+    from rq import Worker
+
+    queues = {}
+    for queue in FairQueue.all(connection=connection):
+        url_slug, lane = split_lane(queue.name)
+        metrics = queues.get(url_slug)
+        if metrics is None:
+            metrics = queues[url_slug] = {
+                'depth': 0, 'oldest_age': 0.0, 'lanes': {},
+                'enqueue_rate': queue.rate('enqueued'), 'dequeue_rate': queue.rate('dequeued'),
+                'service_time': queue.service_time(), 'busy_workers': 0, 'idle_workers': 0,
+            }
+        count = queue.count
+        oldest_age = 0.0
+        job_ids = queue.get_job_ids(0, 1) if count else []
+        job = queue.fetch_job(job_ids[0]) if job_ids else None
+        if job and job.enqueued_at:
+            enqueued_at = job.enqueued_at.replace(tzinfo=job.enqueued_at.tzinfo or timezone.utc).timestamp()
+            oldest_age = max(time.time() - enqueued_at, 0.0)
+        metrics['depth'] += count
+        metrics['oldest_age'] = max(metrics['oldest_age'], oldest_age)
+        metrics['lanes'][lane or 'default'] = {'depth': count, 'oldest_age': oldest_age, **queue.wait_stats()}
+
+    for worker in Worker.all(connection=connection):
+        busy = worker.get_state() == 'busy'
+        for url_slug in {split_lane(name)[0] for name in worker.queue_names()}:
+            if url_slug in queues:
+                queues[url_slug]['busy_workers' if busy else 'idle_workers'] += 1
+    return queues
+
+
+def queue_metrics() -> dict:
+    """
+    各队列的积压、速率、worker利用率和满足目标延迟需要的worker数(QUEUE_TARGET_LATENCY 秒内开始执行)。
+    rq模式按 url_slug 统计所有worker；async/sqlite模式只统计本进程的进程池
+    """
+    target_latency = float(os.getenv('QUEUE_TARGET_LATENCY', 300))
+    target_utilization = float(os.getenv('QUEUE_TARGET_UTILIZATION', 0.8))
+    if queue_module.queue_driver == 'rq':
+        queues = rq_queue_metrics(queue_module._redis_connection())
+    else:
+        stats = queue_module.queue_stats()
+        if queue_module.queue_driver == 'sqlite':
+            pool, depth = stats['pool'], stats['pending']
+        elif 'workers' in stats:
+            pool, depth = stats, stats['queued']
+        else:
+            # 每个事件一个子进程，没有排队
+            pool, depth = {'workers': stats['depth'], 'busy': stats['depth']}, 0
+        queues = {'local': {
+            'depth': depth,
+            'oldest_age': stats['oldest_age'],
+            'busy_workers': pool['busy'],
+            'idle_workers': pool['workers'] - pool['busy'],
+        }}
+
+    for metrics in queues.values():
+        workers = metrics['busy_workers'] + metrics['idle_workers']
+        metrics['utilization'] = metrics['busy_workers'] / workers if workers else 0.0
+        metrics['workers_needed'] = workers_needed(metrics.get('enqueue_rate', 0.0), metrics.get('service_time'),
+                                                   metrics['depth'], target_latency, target_utilization)
+    return {'driver': queue_module.queue_driver, 'target_latency': target_latency, 'queues': queues}
+
+
+def render_prometheus(metrics: dict) -> str:
+    """
+    输出 Prometheus 文本格式
+    """
+    lines = []
+    for name, (field, description) in GAUGES.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        for queue_name, values in metrics['queues'].items():
+            if values.get(field) is not None:
+                lines.append(f'{name}{{queue="{queue_name}"}} {values[field]}')
+    lines.append("# HELP codereview_queue_lane_depth Jobs waiting in each lane")
+    lines.append("# TYPE codereview_queue_lane_depth gauge")
+    for queue_name, values in metrics['queues'].items():
+        for lane, lane_values in values.get('lanes', {}).items():
+            lines.append(f'codereview_queue_lane_depth{{queue="{queue_name}",lane="{lane}"}} {lane_values["depth"]}')
+    lines.append("# HELP codereview_queue_lane_wait_seconds Average wait before a job in each lane starts")
+    lines.append("# TYPE codereview_queue_lane_wait_seconds gauge")
+    for queue_name, values in metrics['queues'].items():
+        for lane, lane_values in values.get('lanes', {}).items():
+            lines.append(f'codereview_queue_lane_wait_seconds{{queue="{queue_name}",lane="{lane}"}} '
+                         f'{lane_values["avg_wait"]}')
+    return '\n'.join(lines) + '\n'
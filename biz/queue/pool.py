@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+from biz.queue.deferral import JobDeferred
+from biz.queue.warmup import warmup
+from biz.utils.log import logger
+from biz.utils.server import api_processes
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class WorkerPool:
+    """
+    QUEUE_DRIVER=async 使用的固定大小的预热进程池：最多 workers 个任务同时执行，
+    最多 max_queue 个任务排队等待，队列满时拒绝新任务(由webhook入口返回429)，避免突发事件导致进程数失控。
+    ASYNC_WORKERS、ASYNC_QUEUE_SIZE 是整个API服务的总量，gunicorn模式下每个worker进程各自创建进程池，按worker数分摊，
+    每个进程至少1个工作进程。
+    通过 submit_deferrable 提交的任务抛出 JobDeferred 时释放工作进程，到期后重新提交，等待期间占用排队名额。
+    """
+
+    def __init__(self, workers: int = None, max_queue: int = None, initializer: Callable = warmup):
+        processes = api_processes()
+        self.workers = workers or max(1, int(os.getenv('ASYNC_WORKERS', 8)) // processes)
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv('ASYNC_QUEUE_SIZE', 100)) // processes
+        self.initializer = initializer
+        self._executor = None
+        self._lock = threading.Lock()
+        # 已提交未完成的任务 => 提交时间
+        self._pending = {}
+        # 等待重新提交(推迟)的任务数
+        self._scheduled = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.deferred = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # 在第一次提交时创建，gunicorn 等多进程模式下由各worker进程各自创建
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=self.initializer)
+            processes = api_processes()
+            logger.info(f"Async worker pool started with {self.workers} processes, queue size {self.max_queue} "
+                        f"({self.workers * processes} processes, queue size {self.max_queue * processes} "
+                        f"across {processes} API workers)")
+        return self._executor
+
+    def start(self):
+        """
+        预先启动全部工作进程并完成预热，第一个事件无需等待进程启动
+        """
+        with self._lock:
+            executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(time.sleep, 0.1)
+
+    def submit(self, function: Callable, *args) -> Future:
+        with self._lock:
+            self._check_capacity()
+            future = self._submit_locked(function, args)
+        future.add_done_callback(self._done)
+        return future
+
+    def submit_deferrable(self, function: Callable, *args, delay: float = 0):
+        """
+        提交可推迟的任务：delay 秒后执行，处理函数抛出 JobDeferred 时按其 delay 重新提交。
+        只在首次提交时检查队列是否已满，已接受的任务重新提交时不会被拒绝
+        """
+        with self._lock:
+            self._check_capacity()
+            self._scheduled += 1
+        self._schedule(delay, function, args)
+
+    def _check_capacity(self):
+        if len(self._pending) + self._scheduled >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"Async worker pool is full ({len(self._pending) + self._scheduled} pending jobs)")
+
+    def _submit_locked(self, function: Callable, args: tuple) -> Future:
+        try:
+            future = self._get_executor().submit(function, *args)
+        except BrokenProcessPool:
+            # 工作进程异常退出后进程池不可用，重新创建
+            logger.warn("Async worker pool is broken, restarting.")
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            future = self._get_executor().submit(function, *args)
+        self._pending[future] = time.time()
+        self.submitted += 1
+        return future
+
+    def _schedule(self, delay: float, function: Callable, args: tuple):
+        if delay <= 0:
+            self._submit_scheduled(function, args)
+            return
+        timer = threading.Timer(delay, self._submit_scheduled, args=(function, args))
+        timer.daemon = True
+        timer.start()
+
+    def _submit_scheduled(self, function: Callable, args: tuple):
+        with self._lock:
+            self._scheduled -= 1
+            future = self._submit_locked(function, args)
+        future.add_done_callback(self._done)
+        future.add_done_callback(lambda f: self._resubmit_deferred(f, function, args))
+
+    def _resubmit_deferred(self, future: Future, function: Callable, args: tuple):
+        error = None if future.cancelled() else future.exception()
+        if isinstance(error, JobDeferred):
+            with self._lock:
+                self._scheduled += 1
+            self._schedule(error.delay, function, args)
+
+    def _done(self, future: Future):
+        with self._lock:
+            self._pending.pop(future, None)
+            error = None if future.cancelled() else future.exception()
+            if isinstance(error, JobDeferred):
+                self.deferred += 1
+            elif future.cancelled() or error is not None:
+                self.failed += 1
+                if not future.cancelled():
+                    logger.error(f"Async job failed: {error}")
+            else:
+                self.completed += 1
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            pending = len(self._pending)
+            oldest = min(self._pending.values(), default=None)
+            busy = min(pending, self.workers)
+            return {
+                'depth': pending + self._scheduled,
+                'queued': pending - busy,
+                'scheduled': self._scheduled,
+                'oldest_age': now - oldest if oldest else 0.0,
+                'workers': self.workers,
+                'busy': busy,
+                'utilization': busy / self.workers,
+                'max_queue': self.max_queue,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'deferred': self.deferred,
+            }
+
+    def drain(self, timeout: float = None):
+        """
+        进程退出前调用：最多等待 timeout 秒让已提交的任务执行完成后关闭进程池，等待重新提交的推迟任务不再执行
+        """
+        with self._lock:
+            pending = list(self._pending)
+        if pending:
+            logger.info(f"Waiting for {len(pending)} async jobs before exit.")
+            _, not_done = wait_futures(pending, timeout=timeout)
+            if not_done:
+                logger.warn(f"{len(not_done)} async jobs still running after {timeout}s, exiting anyway.")
+        self.shutdown(wait=False)
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,38 @@
+import os
+
+from rq.worker import SimpleWorker
+
+from biz.queue.fair import FairWorker
+from biz.queue.warmup import warmup
+from biz.utils.log import logger
+
+
+class PreloadedWorker(FairWorker):
+    """
+    预热后再fork的RQ worker：启动时在父进程中导入处理函数，加载tokenizer、大模型客户端、提示词和SQLite表结构，
+    每个任务fork出的子进程直接继承，不再重复初始化。任务崩溃或泄漏内存只影响子进程。
+    使用方式：rq worker -w biz.queue.preload.PreloadedWorker git_test_com
+    """
+    # 执行多少个任务后退出，由 supervisord 重启，0表示不限制
+    default_max_jobs = 0
+
+    def __init__(self, queues, *args, **kwargs):
+        super().__init__(queues, *args, **kwargs)
+        # Worker.all() 等查询也会创建worker实例，只有真正执行任务的worker需要预热
+        if kwargs.get('prepare_for_work', True):
+            warmup()
+
+    def work(self, *args, max_jobs=None, **kwargs):
+        max_jobs = max_jobs or int(os.getenv('RQ_WORKER_MAX_JOBS', self.default_max_jobs)) or None
+        if max_jobs:
+            logger.info(f"Worker {self.name} will exit after {max_jobs} jobs")
+        return super().work(*args, max_jobs=max_jobs, **kwargs)
+
+
+class InProcessWorker(PreloadedWorker, SimpleWorker):
+    """
+    不fork的RQ worker：在预热后的进程内直接执行任务，大模型客户端的连接池也在任务间复用，单任务开销最低。
+    任务之间的内存泄漏会累积，默认执行 RQ_WORKER_MAX_JOBS(500) 个任务后退出，由 supervisord 重启新进程。
+    使用方式：rq worker -w biz.queue.preload.InProcessWorker git_test_com
+    """
+    default_max_jobs = 500
@@ -0,0 +1,110 @@
+import functools
+import os
+import socket
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from biz.queue.debounce import review_debouncer, review_key
+from biz.queue.deferral import JobDeferred
+from biz.utils.kv_store import KVStore, get_kv_store
+from biz.utils.log import logger
+from biz.utils.queue import load_payload
+
+
+class ReviewSerializer:
+    """
+    同一个MR/PR或分支(并发key：域名+项目+编号/分支)的任务串行执行，不同key的任务完全并行。
+    执行中的任务持有KVStore中的租约并定期续约，进程异常退出后租约过期，后续任务继续执行。
+    key正在执行时，后到的任务抛出 JobDeferred 释放worker，REVIEW_LOCK_RETRY_DELAY 秒后由队列重新投递；
+    开启去抖或取代(REVIEW_SUPERSEDE_ENABLED)时，已被同一key更新的事件取代的任务直接跳过。
+    """
+
+    def __init__(self, store: KVStore = None, ttl: float = None, retry_delay: float = None):
+        self._store = store
+        self.enabled = os.getenv('REVIEW_SERIALIZE_ENABLED', '1') == '1'
+        self.ttl = ttl or float(os.getenv('REVIEW_LOCK_TTL', 60))
+        self.retry_delay = retry_delay or float(os.getenv('REVIEW_LOCK_RETRY_DELAY', 5))
+
+    @property
+    def store(self) -> KVStore:
+        if self._store is None:
+            self._store = get_kv_store()
+        return self._store
+
+    def _renew(self, lock_key: str, owner: str, stop: threading.Event):
+        while not stop.wait(self.ttl / 3):
+            try:
+                # 只有仍持有锁时才续约，比较和续约原子完成，不会覆盖其他worker在租约过期后获取的锁
+                if not self.store.compare_and_set(lock_key, owner, owner, ttl=self.ttl):
+                    logger.warn(f"Review lock {lock_key} lost while running.")
+                    return
+            except Exception as e:
+                logger.warn(f"Failed to renew review lock {lock_key}: {e}")
+
+    def _acquire(self, key: str, lock_key: str, owner: str, superseded: Callable[[], bool] = None) -> Optional[bool]:
+        """
+        尝试获取锁，已被取代时返回False，存储不可用时返回None；key正在执行时抛出 JobDeferred
+        """
+        try:
+            if self.store.add(lock_key, owner, ttl=self.ttl):
+                return True
+            if superseded and superseded():
+                logger.info(f"Review lock: {key} superseded while waiting, skipped.")
+                return False
+        except Exception as e:
+            logger.warn(f"Failed to acquire review lock for {key}: {e}")
+            return None
+        raise JobDeferred(self.retry_delay, f"{key} is being reviewed by another worker")
+
+    @contextmanager
+    def hold(self, key: Optional[str], superseded: Callable[[], bool] = None):
+        """
+        获取key的执行权，返回是否应继续执行：已被取代时返回False，key正在执行时抛出 JobDeferred。
+        获取锁失败(存储不可用等)时不阻塞任务，直接执行
+        """
+        if not self.enabled or not key:
+            yield True
+            return
+        lock_key = f"review_lock:{key}"
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        acquired = self._acquire(key, lock_key, owner, superseded)
+        if not acquired:
+            yield acquired is None
+            return
+
+        stop = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(lock_key, owner, stop), daemon=True)
+        renewer.start()
+        try:
+            yield True
+        finally:
+            stop.set()
+            try:
+                self.store.compare_and_delete(lock_key, owner)
+            except Exception as e:
+                logger.warn(f"Failed to release review lock for {key}: {e}")
+
+
+review_serializer = ReviewSerializer()
+
+
+def serialized(provider: str, event_type: str):
+    """
+    worker处理函数的装饰器：按并发key串行执行同一个MR/PR或分支的任务
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(webhook_data, token: str, url: str, url_slug: str):
+            webhook_data = load_payload(webhook_data)
+            key = review_key(provider, event_type, url_slug, webhook_data)
+            superseded = functools.partial(review_debouncer.superseded, provider, event_type, url_slug, webhook_data)
+            with review_serializer.hold(key, superseded) as proceed:
+                if proceed:
+                    return function(webhook_data, token, url, url_slug)
+
+        return wrapper
+
+    return decorator
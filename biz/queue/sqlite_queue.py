@@ -0,0 +1,326 @@
+import importlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+from biz.queue.deferral import JobDeferred
+from biz.queue.pool import WorkerPool
+from biz.utils.log import logger
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_FAILED = 'failed'
+
+
+def function_path(function: Callable) -> str:
+    return f"{function.__module__}.{function.__qualname__}"
+
+
+def load_function(path: str) -> Callable:
+    module_name, func_name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def run_job(path: str, args: list):
+    """
+    在进程池中执行任务，按路径加载处理函数
+    """
+    return load_function(path)(*args)
+
+
+def _owner_alive(owner: str) -> bool:
+    # owner 格式为 host:pid，只能判断本机进程是否存活
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+class SqliteJobQueue:
+    """
+    持久化到本地 SQLite 文件的任务队列(QUEUE_DRIVER=sqlite)，无需 Redis，服务重启不会丢失待处理的事件。
+    任务按租约领取，执行中定期续约，超过可见性超时未续约(进程崩溃等)的任务重新变为可领取；
+    执行进程崩溃的任务按指数退避重新投递，超过最大次数后标记为失败。
+    处理函数的失败由任务台账(@tracked)记录，并由 retry_due 通过 handle_queue 作为新任务重新入队，
+    队列本身不重试处理函数抛出的异常，避免与台账的重试叠加；抛出 JobDeferred 的任务推迟到期后再领取，不计执行次数。
+    """
+
+    def __init__(self, db_file: str = None):
+        self.db_file = db_file or os.getenv('SQLITE_QUEUE_DB_FILE', 'data/queue.db')
+        self.visibility_timeout = float(os.getenv('SQLITE_QUEUE_VISIBILITY_TIMEOUT', 300))
+        self.max_attempts = int(os.getenv('SQLITE_QUEUE_MAX_ATTEMPTS', 3))
+        self.backoff = float(os.getenv('SQLITE_QUEUE_BACKOFF', 30))
+        self.max_backoff = float(os.getenv('SQLITE_QUEUE_MAX_BACKOFF', 1800))
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if not self._initialized:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    queue TEXT,
+                    function TEXT,
+                    args TEXT,
+                    status TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    available_at REAL,
+                    lease_owner TEXT DEFAULT '',
+                    last_error TEXT DEFAULT '',
+                    created_at REAL,
+                    updated_at REAL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, available_at)')
+            self._initialized = True
+        return conn
+
+    def enqueue(self, function: Callable, data, token: str, url: str, url_slug: str, delay: float = 0) -> int:
+        """
+        token 应为 token_ref() 生成的令牌引用，由处理函数的 @tracked 装饰器在执行时解析，队列文件中不保存明文令牌；
+        delay 秒后才能被领取
+        """
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode('utf-8')
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''
+                INSERT INTO jobs (queue, function, args, status, available_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (url_slug, function_path(function), json.dumps([data, token, url, url_slug]), STATUS_PENDING,
+                  now + max(delay, 0), now, now))
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def claim(self, owner: str, limit: int) -> list:
+        """
+        领取可执行的任务：待执行且到期的任务，以及租约已过期的执行中任务
+        """
+        if limit <= 0:
+            return []
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('''
+                SELECT id, function, args, attempts FROM jobs
+                WHERE status IN (?, ?) AND available_at <= ? ORDER BY available_at, id LIMIT ?
+            ''', (STATUS_PENDING, STATUS_RUNNING, now, limit)).fetchall()
+            for row in rows:
+                conn.execute('UPDATE jobs SET status = ?, attempts = attempts + 1, available_at = ?, lease_owner = ?, '
+                             'updated_at = ? WHERE id = ?',
+                             (STATUS_RUNNING, now + self.visibility_timeout, owner, now, row[0]))
+            conn.execute('COMMIT')
+        except sqlite3.DatabaseError:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return [{'id': row[0], 'function': row[1], 'args': json.loads(row[2]), 'attempts': row[3] + 1}
+                for row in rows]
+
+    def extend(self, job_ids: list, owner: str):
+        """
+        为执行中的任务续约
+        """
+        if not job_ids:
+            return
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.executemany('UPDATE jobs SET available_at = ?, updated_at = ? WHERE id = ? AND lease_owner = ? '
+                             'AND status = ?',
+                             [(now + self.visibility_timeout, now, job_id, owner, STATUS_RUNNING) for job_id in job_ids])
+        finally:
+            conn.close()
+
+    def complete(self, job_id: int):
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        finally:
+            conn.close()
+
+    def fail(self, job_id: int, attempts: int, error: str, retry: bool = True):
+        """
+        记录一次执行失败：retry 为True且未超过最大次数时按指数退避重新投递，否则标记为失败
+        """
+        now = time.time()
+        if not retry:
+            status, available_at = STATUS_FAILED, now
+            logger.error(f"Job {job_id} raised, not retried by the queue: {error}")
+        elif attempts >= self.max_attempts:
+            status, available_at = STATUS_FAILED, now
+            logger.error(f"Job {job_id} failed after {attempts} attempts, giving up: {error}")
+        else:
+            status = STATUS_PENDING
+            available_at = now + min(self.backoff * (2 ** (attempts - 1)), self.max_backoff)
+            logger.warn(f"Job {job_id} failed (attempt {attempts}/{self.max_attempts}), "
+                        f"retrying in {available_at - now:.0f}s: {error}")
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE jobs SET status = ?, available_at = ?, lease_owner = ?, last_error = ?, updated_at = ? '
+                         'WHERE id = ?', (status, available_at, '', error[:1000], now, job_id))
+            if status == STATUS_FAILED:
+                # 不再执行的任务清除令牌参数
+                conn.execute("UPDATE jobs SET args = json_set(args, '$[1]', '') WHERE id = ?", (job_id,))
+        finally:
+            conn.close()
+
+    def defer(self, job_id: int, delay: float):
+        """
+        推迟任务：重新变为待执行，delay 秒后才能被领取，本次领取不计入执行次数
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), available_at = ?, lease_owner = ?, '
+                         'updated_at = ? WHERE id = ?', (STATUS_PENDING, now + delay, '', now, job_id))
+        finally:
+            conn.close()
+
+    def recover(self) -> int:
+        """
+        启动时恢复崩溃前未完成的任务：执行者进程已不存在的任务立即变为可领取，无需等待租约过期
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT id, lease_owner FROM jobs WHERE status = ?', (STATUS_RUNNING,)).fetchall()
+            orphaned = [row[0] for row in rows if not _owner_alive(row[1])]
+            conn.executemany('UPDATE jobs SET status = ?, available_at = ?, lease_owner = ?, updated_at = ? '
+                             'WHERE id = ? AND status = ?',
+                             [(STATUS_PENDING, now, '', now, job_id, STATUS_RUNNING) for job_id in orphaned])
+        finally:
+            conn.close()
+        if orphaned:
+            logger.info(f"Recovered {len(orphaned)} interrupted jobs from {self.db_file}")
+        return len(orphaned)
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        try:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            oldest = conn.execute('SELECT MIN(created_at) FROM jobs WHERE status IN (?, ?)',
+                                  (STATUS_PENDING, STATUS_RUNNING)).fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            'depth': counts.get(STATUS_PENDING, 0) + counts.get(STATUS_RUNNING, 0),
+            'pending': counts.get(STATUS_PENDING, 0),
+            'running': counts.get(STATUS_RUNNING, 0),
+            'failed': counts.get(STATUS_FAILED, 0),
+            'oldest_age': time.time() - oldest if oldest else 0.0,
+        }
+
+
+class SqliteQueueConsumer:
+    """
+    从 SQLite 队列领取任务交给进程池执行，只领取进程池空闲数量的任务，执行中定期续约；
+    进程退出前通过 drain 停止领取新任务，等待执行中的任务完成
+    """
+
+    def __init__(self, job_queue: SqliteJobQueue, pool: WorkerPool, poll_interval: float = None):
+        self.job_queue = job_queue
+        self.pool = pool
+        self.poll_interval = poll_interval or float(os.getenv('SQLITE_QUEUE_POLL_INTERVAL', 0.5))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._running = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._draining = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        # gunicorn 等多进程模式下在fork后启动，owner使用当前进程号
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.job_queue.recover()
+        self._thread = threading.Thread(target=self._run, name='sqlite-queue', daemon=True)
+        self._thread.start()
+        logger.info(f"SQLite queue consumer started: {self.job_queue.db_file}")
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def drain(self, timeout: float = None):
+        """
+        停止领取新任务，等待执行中的任务完成(期间继续续约)后停止；超时后停止续约，未完成的任务租约过期后由其他进程重新领取
+        """
+        self._draining.set()
+        self._wakeup.set()
+        deadline = time.time() + timeout if timeout is not None else None
+        while self._running and (deadline is None or time.time() < deadline):
+            time.sleep(self.poll_interval)
+        self.stop()
+
+    def notify(self):
+        """有新任务入队时立即唤醒"""
+        self._wakeup.set()
+
+    def free_slots(self) -> int:
+        with self._lock:
+            return self.pool.workers - len(self._running)
+
+    def dispatch_once(self) -> int:
+        jobs = self.job_queue.claim(self.owner, self.free_slots())
+        for job in jobs:
+            with self._lock:
+                self._running[job['id']] = job
+            future = self.pool.submit(run_job, job['function'], job['args'])
+            future.add_done_callback(lambda f, job=job: self._done(job, f))
+        return len(jobs)
+
+    def _done(self, job: dict, future):
+        with self._lock:
+            self._running.pop(job['id'], None)
+        try:
+            error = future.exception()
+            if error is None:
+                self.job_queue.complete(job['id'])
+            elif isinstance(error, JobDeferred):
+                self.job_queue.defer(job['id'], error.delay)
+            else:
+                # 只有执行进程崩溃时重新投递，处理函数抛出的异常由任务台账负责重试
+                self.job_queue.fail(job['id'], job['attempts'], str(error) or error.__class__.__name__,
+                                    retry=isinstance(error, BrokenProcessPool))
+        except Exception as e:
+            logger.error(f"Failed to update job {job['id']}: {e}")
+        self._wakeup.set()
+
+    def _run(self):
+        last_extend = time.time()
+        while not self._stop.is_set():
+            try:
+                if self._draining.is_set() or not self.dispatch_once():
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                if time.time() - last_extend > self.job_queue.visibility_timeout / 3:
+                    last_extend = time.time()
+                    with self._lock:
+                        job_ids = list(self._running)
+                    self.job_queue.extend(job_ids, self.owner)
+            except Exception as e:
+                logger.error(f"SQLite queue consumer error: {e}")
+                self._stop.wait(self.poll_interval)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import os
+import tempfile
+import time
+from unittest import TestCase, main, mock
+
+from biz.queue.debounce import ReviewDebouncer, review_head, review_key
+from biz.queue.deferral import JobDeferred
+from biz.utils.kv_store import SqliteKVStore
+
+
+def push_data(before: str, after: str) -> dict:
+    return {'project': {'id': 1}, 'ref': 'refs/heads/main', 'before': before, 'after': after,
+            'commits': [{'id': after}]}
+
+
+def mr_data(head: str) -> dict:
+    return {'project': {'id': 1}, 'object_attributes': {'iid': 7, 'last_commit': {'id': head}}}
+
+
+def coding_mr_data(head: str) -> dict:
+    return {'repository': {'full_name': 'dev/app'}, 'mergeRequest': {'number': 3, 'head': {'sha': head}}}
+
+
+# @Describe:
+class TestReviewDebouncer(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.debouncer = ReviewDebouncer(SqliteKVStore(os.path.join(self.tmp_dir.name, 'kv.db')), window=0.2)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def wait_window(self):
+        time.sleep(self.debouncer.window)
+
+    def test_older_head_skipped(self):
+        """测试窗口内有新的更新时，旧head的任务被跳过，只review最新的head"""
+        self.debouncer.register('gitlab', 'merge_request', 'host', mr_data('a1'))
+        self.debouncer.register('gitlab', 'merge_request', 'host', mr_data('b2'))
+        self.wait_window()
+        self.assertIsNone(self.debouncer.begin('gitlab', 'merge_request', 'host', mr_data('a1')))
+        self.assertEqual(self.debouncer.begin('gitlab', 'merge_request', 'host', mr_data('b2')), mr_data('b2'))
+
+    def test_begin_deferred_in_window(self):
+        """测试登记返回去抖窗口作为任务延迟，窗口未结束时任务推迟而不等待，窗口内到达的更新使其被取代"""
+        self.assertEqual(self.debouncer.register('gitlab', 'merge_request', 'host', mr_data('a1'))[0], 0.2)
+        with self.assertRaises(JobDeferred) as context:
+            self.debouncer.begin('gitlab', 'merge_request', 'host', mr_data('a1'))
+        self.assertTrue(0 < context.exception.delay <= 0.2)
+        # 同一head的重复登记不延长窗口
+        self.assertLessEqual(self.debouncer.register('gitlab', 'merge_request', 'host', mr_data('a1'))[0],
+                             context.exception.delay)
+
+        self.debouncer.register('gitlab', 'merge_request', 'host', mr_data('b2'))
+        self.assertIsNone(self.debouncer.begin('gitlab', 'merge_request', 'host', mr_data('a1')))
+        self.wait_window()
+        self.assertEqual(self.debouncer.begin('gitlab', 'merge_request', 'host', mr_data('b2')), mr_data('b2'))
+
+    def test_restore_registration(self):
+        """测试入队失败时恢复登记前的状态，旧任务不被未入队的新head取代；之后有新的登记时不恢复"""
+        self.debouncer.register('gitlab', 'merge_request', 'host', mr_data('a1'))
+        _, registration = self.debouncer.register('gitlab', 'merge_request', 'host', mr_data('b2'))
+        self.debouncer.restore(registration)
+        self.wait_window()
+        self.assertEqual(self.debouncer.begin('gitlab', 'merge_request', 'host', mr_data('a1')), mr_data('a1'))
+
+        _, registration = self.debouncer.register('gitlab', 'merge_request', 'host', mr_data('b2'))
+        self.debouncer.register('gitlab', 'merge_request', 'host', mr_data('c3'))
+        self.debouncer.restore(registration)
+        self.assertTrue(self.debouncer.superseded('gitlab', 'merge_request', 'host', mr_data('b2')))
+
+        # 登记前没有状态时删除登记
+        _, registration = self.debouncer.register('gitlab', 'push', 'host', push_data('c0', 'c1'))
+        self.debouncer.restore(registration)
+        self.assertFalse(self.debouncer.superseded('gitlab', 'push', 'host', push_data('c1', 'c2')))
+
+    def test_superseded_during_review(self):
+        """测试review过程中被取代的任务丢弃结果"""
+        self.debouncer.register('github', 'pull_request', 'host', mr_data('a1'))
+        self.wait_window()
+        self.assertIsNotNone(self.debouncer.begin('github', 'pull_request', 'host', mr_data('a1')))
+        self.debouncer.register('github', 'pull_request', 'host', mr_data('b2'))
+        self.assertFalse(self.debouncer.finish('github', 'pull_request', 'host', mr_data('a1')))
+        self.assertTrue(self.debouncer.finish('github', 'pull_request', 'host', mr_data('b2')))
+
+    def test_pushes_coalesced(self):
+        """测试连续的push合并为一次review，从最早的before开始比较"""
+        self.debouncer.register('gitlab', 'push', 'host', push_data('c0', 'c1'))
+        self.debouncer.register('gitlab', 'push', 'host', push_data('c1', 'c2'))
+        self.wait_window()
+        data = self.debouncer.begin('gitlab', 'push', 'host', push_data('c1', 'c2'))
+        self.assertEqual(data['before'], 'c0')
+        self.assertEqual([commit['id'] for commit in data['commits']], ['c1', 'c2'])
+        self.assertTrue(self.debouncer.finish('gitlab', 'push', 'host', data))
+
+        # review完成后的push重新开始计算
+        self.debouncer.register('gitlab', 'push', 'host', push_data('c2', 'c3'))
+        self.wait_window()
+        self.assertEqual(self.debouncer.begin('gitlab', 'push', 'host', push_data('c2', 'c3'))['before'], 'c2')
+
+    def test_coding_merge_request_key(self):
+        """测试Coding的mergeRequest事件按编号生成key，按head提交去抖"""
+        self.assertEqual(review_key('coding', 'pull_request', 'host', coding_mr_data('a1')),
+                         'coding:host:dev/app:mr:3')
+        self.assertEqual(review_head('pull_request', coding_mr_data('a1')), 'a1')
+        self.debouncer.register('coding', 'pull_request', 'host', coding_mr_data('a1'))
+        self.debouncer.register('coding', 'pull_request', 'host', coding_mr_data('b2'))
+        self.assertIsNone(self.debouncer.begin('coding', 'pull_request', 'host', coding_mr_data('a1')))
+
+    def test_supersede_opt_in(self):
+        """测试不去抖时默认不取代排队中的任务，需单独开启REVIEW_SUPERSEDE_ENABLED"""
+        store = SqliteKVStore(os.path.join(self.tmp_dir.name, 'kv.db'))
+        with mock.patch.dict(os.environ, {'REVIEW_SERIALIZE_ENABLED': '1'}):
+            self.assertFalse(ReviewDebouncer(store, window=0).enabled)
+        with mock.patch.dict(os.environ, {'REVIEW_SUPERSEDE_ENABLED': '1'}):
+            self.assertTrue(ReviewDebouncer(store, window=0).enabled)
+
+
+if __name__ == '__main__':
+    main()
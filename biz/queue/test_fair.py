@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import os
+import time
+from collections import Counter
+from unittest import TestCase, main, skipIf
+from unittest.mock import patch
+
+from rq.job import JobStatus
+from rq.worker import SimpleWorker
+
+from biz.queue.deferral import JobDeferred
+from biz.queue.fair import choose_job, expand_lanes, FairQueue, FairWorker, lane_for_event, parse_weights
+
+try:
+    import fakeredis
+except ImportError:
+    # 依赖 Redis 的用例使用 fakeredis，未安装时跳过
+    fakeredis = None
+
+# 任务执行记录，测试worker在当前进程内执行任务
+calls = []
+
+
+def record(name: str):
+    calls.append(name)
+
+
+def defer_once(name: str):
+    calls.append(name)
+    if calls.count(name) == 1:
+        raise JobDeferred(60, 'busy')
+
+
+class InlineFairWorker(FairWorker, SimpleWorker):
+    """在当前进程内执行任务的 FairWorker"""
+
+
+def simulate(jobs, picks, weights=None, running=None, max_running=0):
+    """按 FairQueue 的方式连续取任务，返回取出任务的项目"""
+    weights = weights or {}
+    vtimes, system_vtime, order = {}, 0.0, []
+    jobs = list(jobs)
+    for _ in range(picks):
+        chosen = choose_job(jobs, vtimes, system_vtime, running or {}, max_running)
+        if chosen is None:
+            break
+        job_id, project, start = chosen
+        jobs.remove((job_id, project))
+        vtimes[project] = start + 1 / weights.get(project, 1.0)
+        system_vtime = start
+        order.append(project)
+    return order
+
+
+# @Describe:
+class TestFairScheduling(TestCase):
+    def test_burst_does_not_starve_other_projects(self):
+        """测试一个项目的大量任务排在前面时，其他项目的任务仍然轮流执行"""
+        jobs = [(f'big-{i}', 'big') for i in range(50)] + [('a-0', 'a'), ('b-0', 'b')]
+        self.assertEqual(simulate(jobs, 4), ['big', 'a', 'b', 'big'])
+
+    def test_weights(self):
+        """测试权重大的项目获得成比例的执行机会"""
+        jobs = [(f'x-{i}', 'x') for i in range(30)] + [(f'y-{i}', 'y') for i in range(30)]
+        counts = Counter(simulate(jobs, 30, weights={'x': 2}))
+        self.assertEqual((counts['x'], counts['y']), (20, 10))
+
+    def test_concurrency_cap(self):
+        """测试执行中任务数达到上限的项目被跳过，全部达到上限时不取任务"""
+        jobs = [('x-0', 'x'), ('y-0', 'y')]
+        self.assertEqual(choose_job(jobs, {}, 0.0, {'x': 2}, 2)[1], 'y')
+        self.assertIsNone(choose_job(jobs, {}, 0.0, {'x': 2, 'y': 2}, 2))
+        self.assertEqual(choose_job(jobs, {}, 0.0, {'x': 2, 'y': 2}, 0)[1], 'x')
+
+    def test_lanes(self):
+        """测试车道按优先级展开，兼容升级前的队列和配置"""
+        self.assertEqual(expand_lanes(['a_com', 'b_com']),
+                         ['a_com:mr', 'b_com:mr', 'a_com:push', 'b_com:push', 'a_com:report', 'b_com:report',
+                          'a_com', 'b_com'])
+        self.assertEqual(expand_lanes(['a_com:push']), ['a_com:push'])
+        self.assertEqual([lane_for_event(e) for e in ('merge_request', 'pull_request', 'push', 'other')],
+                         ['mr', 'mr', 'push', 'report'])
+        self.assertEqual(parse_weights('123=2, group/repo=0.5,bad=x'), {'123': 2.0, 'group/repo': 0.5})
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+class TestFairQueueRedis(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.connection = fakeredis.FakeRedis()
+        calls.clear()
+
+    def worker(self, *names):
+        return InlineFairWorker(list(names), connection=self.connection)
+
+    def test_deferred_job_requeued(self):
+        """测试抛出 JobDeferred 的任务按完成处理，到期后作为新任务重新执行"""
+        queue = FairQueue('slug:mr', connection=self.connection)
+        job = queue.enqueue_for_project('p1', defer_once, 'a')
+        self.worker('slug').work(burst=True)
+        self.assertEqual(calls, ['a'])
+        self.assertEqual(job.get_status(), JobStatus.FINISHED)
+        self.assertEqual((queue.deferred_count, queue.count), (1, 0))
+
+        # 未到期时不放回队列
+        self.worker('slug').work(burst=True)
+        self.assertEqual(calls, ['a'])
+        # 模拟推迟时间已到
+        self.connection.zadd(queue.deferred_key, {job_id: 0 for job_id in self.connection.zrange(queue.deferred_key, 0, -1)})
+        self.worker('slug').work(burst=True)
+        self.assertEqual(calls, ['a', 'a'])
+        self.assertEqual((queue.deferred_count, queue.count), (0, 0))
+
+    def test_mr_lane_before_push_lane(self):
+        """测试 mr 车道有任务时先于先入队的 push 车道任务执行"""
+        push_queue = FairQueue('slug:push', connection=self.connection)
+        mr_queue = FairQueue('slug:mr', connection=self.connection)
+        push_queue.enqueue_for_project('p1', record, 'push-1')
+        push_queue.enqueue_for_project('p2', record, 'push-2')
+        mr_queue.enqueue_for_project('p1', record, 'mr-1')
+
+        job, queue = FairQueue.dequeue_any([mr_queue, push_queue], None, connection=self.connection)
+        self.assertEqual((job.args, queue.name), (('mr-1',), 'slug:mr'))
+        push_queue.enqueue_for_project('p3', record, 'push-3')
+        mr_queue.enqueue_for_project('p2', record, 'mr-2')
+        self.worker('slug').work(burst=True)
+        self.assertEqual(calls[0], 'mr-2')
+        self.assertEqual(sorted(calls[1:]), ['push-1', 'push-2', 'push-3'])
+
+    def test_project_concurrency_cap(self):
+        """测试项目执行中的任务数达到 RQ_PROJECT_CONCURRENCY 时跳过该项目，释放后才取该项目的任务"""
+        queue = FairQueue('slug:push', connection=self.connection)
+        first = queue.enqueue_for_project('p1', record, 'a')
+        queue.enqueue_for_project('p1', record, 'b')
+        queue.enqueue_for_project('p2', record, 'c')
+        # p1 在其他车道有一个执行中的任务，同一项目各车道共享计数
+        running_key = FairQueue.running_key('slug', 'p1')
+        self.connection.zadd(running_key, {'other': time.time() + 60})
+        with patch.dict(os.environ, {'RQ_PROJECT_CONCURRENCY': '1'}):
+            self.assertEqual(queue.dequeue_fair().args, ('c',))
+            self.assertIsNone(queue.dequeue_fair())
+            self.assertEqual(queue.count, 2)
+
+            self.connection.zrem(running_key, 'other')
+            job = queue.dequeue_fair()
+            self.assertEqual(job.id, first.id)
+            self.assertEqual(self.connection.zcard(running_key), 1)
+            self.assertIsNone(queue.dequeue_fair())
+
+            queue.release(job)
+            self.assertEqual(queue.dequeue_fair().args, ('b',))
+
+    def test_expired_running_lease_ignored(self):
+        """测试执行中登记的租约过期(worker异常退出)后不再计入项目的执行中任务数"""
+        queue = FairQueue('slug:push', connection=self.connection)
+        queue.enqueue_for_project('p1', record, 'a')
+        self.connection.zadd(FairQueue.running_key('slug', 'p1'), {'lost': time.time() - 1})
+        with patch.dict(os.environ, {'RQ_PROJECT_CONCURRENCY': '1'}):
+            self.assertEqual(queue.dequeue_fair().args, ('a',))
+
+
+if __name__ == '__main__':
+    main()
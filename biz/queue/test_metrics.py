@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+from unittest import TestCase, main
+
+from biz.queue.metrics import render_prometheus, workers_needed
+
+
+# @Describe:
+class TestQueueMetrics(TestCase):
+    def test_workers_needed(self):
+        """测试按到达速率、执行时间和积压估算需要的worker数"""
+        # 每10秒一个任务，每个任务60秒：稳态6个忙碌worker，按0.8利用率需要7.5个
+        self.assertEqual(workers_needed(0.1, 60, 0, 300, 0.8), 8)
+        # 额外20个积压任务需要在300秒内消化：20*60/300=4
+        self.assertEqual(workers_needed(0.1, 60, 20, 300, 0.8), 12)
+        self.assertEqual(workers_needed(0, 60, 0, 300, 0.8), 0)
+        self.assertIsNone(workers_needed(0.1, None, 5, 300, 0.8))
+
+    def test_render_prometheus(self):
+        """测试 Prometheus 文本格式输出，缺失的指标不输出样本"""
+        text = render_prometheus({'queues': {'git_test_com': {
+            'depth': 3, 'oldest_age': 12.5, 'busy_workers': 2, 'idle_workers': 0, 'workers_needed': None,
+            'lanes': {'mr': {'depth': 1, 'avg_wait': 4.0}, 'push': {'depth': 2, 'avg_wait': 30.0}},
+        }}})
+        self.assertIn('# TYPE codereview_queue_depth gauge', text)
+        self.assertIn('codereview_queue_depth{queue="git_test_com"} 3', text)
+        self.assertIn('codereview_queue_lane_depth{queue="git_test_com",lane="push"} 2', text)
+        self.assertIn('codereview_queue_lane_wait_seconds{queue="git_test_com",lane="mr"} 4.0', text)
+        self.assertNotIn('codereview_queue_workers_needed{', text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import os
+import tempfile
+import time
+from unittest import TestCase, main, mock
+
+from biz.queue.deferral import JobDeferred
+from biz.queue.pool import QueueFullError, WorkerPool
+
+
+def defer_once(path: str):
+    # 第一次执行时推迟，重新提交后完成
+    if not os.path.exists(path):
+        open(path, 'w').close()
+        raise JobDeferred(0.2, 'first attempt')
+    with open(path, 'a') as f:
+        f.write('done')
+
+
+# @Describe:
+class TestWorkerPool(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.pool = WorkerPool(workers=2, max_queue=1, initializer=None)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_bounded_queue(self):
+        """测试执行中和排队的任务数达到上限后拒绝新任务，完成后恢复"""
+        futures = [self.pool.submit(time.sleep, 0.3) for _ in range(3)]
+        with self.assertRaises(QueueFullError):
+            self.pool.submit(time.sleep, 0.3)
+        stats = self.pool.stats()
+        self.assertEqual((stats['depth'], stats['busy'], stats['queued'], stats['rejected']), (3, 2, 1, 1))
+
+        for future in futures:
+            future.result(timeout=5)
+        time.sleep(0.05)
+        self.assertEqual(self.pool.stats()['completed'], 3)
+        self.pool.submit(time.sleep, 0).result(timeout=5)
+
+    def test_failed_job_counted(self):
+        """测试任务异常被记录，不影响进程池"""
+        future = self.pool.submit(int, 'not a number')
+        with self.assertRaises(ValueError):
+            future.result(timeout=5)
+        time.sleep(0.05)
+        self.assertEqual(self.pool.stats()['failed'], 1)
+
+    def test_deferred_job_resubmitted(self):
+        """测试推迟的任务释放工作进程，到期后重新提交执行，等待期间计入队列深度"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'marker')
+            self.pool.submit_deferrable(defer_once, path)
+            deadline = time.time() + 5
+            while not self.pool.stats()['deferred'] and time.time() < deadline:
+                time.sleep(0.02)
+            stats = self.pool.stats()
+            self.assertEqual((stats['busy'], stats['scheduled'], stats['depth']), (0, 1, 1))
+            while self.pool.stats()['completed'] < 1 and time.time() < deadline:
+                time.sleep(0.02)
+            with open(path) as f:
+                self.assertEqual(f.read(), 'done')
+        stats = self.pool.stats()
+        self.assertEqual((stats['deferred'], stats['failed'], stats['depth']), (1, 0, 0))
+
+    def test_drain_waits_for_running_jobs(self):
+        """测试退出前等待执行中的任务完成后关闭进程池"""
+        future = self.pool.submit(time.sleep, 0.3)
+        self.pool.drain(timeout=5)
+        self.assertTrue(future.done())
+        self.assertEqual(self.pool.stats()['completed'], 1)
+
+    def test_limits_divided_across_api_workers(self):
+        """测试gunicorn模式下进程数和队列上限按API worker数分摊"""
+        env = {'API_SERVER': 'gunicorn', 'API_WORKERS': '4', 'ASYNC_WORKERS': '8', 'ASYNC_QUEUE_SIZE': '100'}
+        with mock.patch.dict(os.environ, env):
+            pool = WorkerPool(initializer=None)
+            self.assertEqual((pool.workers, pool.max_queue), (2, 25))
+        with mock.patch.dict(os.environ, dict(env, API_WORKERS='16')):
+            pool = WorkerPool(initializer=None)
+            self.assertEqual((pool.workers, pool.max_queue), (1, 6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import os
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from redis import Redis
+from rq.worker import Worker
+
+from biz.llm.factory import Factory
+from biz.queue.preload import InProcessWorker, PreloadedWorker
+
+
+# @Describe:
+class TestPreloadedWorker(TestCase):
+    def create(self, worker_class):
+        # prepare_for_work=False 时创建worker不连接Redis，与 Worker.all() 查询一致
+        return worker_class(['git_test_com'], connection=Redis(port=1), prepare_for_work=False)
+
+    def test_no_warmup_for_queries(self):
+        """测试 Worker.all() 等查询创建的实例不预热，队列仍按车道展开"""
+        with patch('biz.queue.preload.warmup') as warmup:
+            worker = self.create(InProcessWorker)
+            warmup.assert_not_called()
+        self.assertEqual(worker.queue_names()[0], 'git_test_com:mr')
+
+    def test_max_jobs(self):
+        """测试进程内执行的worker默认执行500个任务后退出，fork模式默认不限制，命令行参数优先"""
+        with patch('biz.queue.preload.warmup'), patch.object(Worker, 'work') as work:
+            self.create(InProcessWorker).work(burst=True)
+            self.assertEqual(work.call_args.kwargs['max_jobs'], 500)
+            self.create(PreloadedWorker).work(burst=True)
+            self.assertIsNone(work.call_args.kwargs['max_jobs'])
+            self.create(InProcessWorker).work(max_jobs=3)
+            self.assertEqual(work.call_args.kwargs['max_jobs'], 3)
+            with patch.dict(os.environ, {'RQ_WORKER_MAX_JOBS': '20'}):
+                self.create(PreloadedWorker).work()
+            self.assertEqual(work.call_args.kwargs['max_jobs'], 20)
+
+    def test_llm_client_reused_per_process(self):
+        """测试同一进程复用大模型客户端，fork后的子进程重新创建"""
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test'}):
+            client = Factory.getClient('openai')
+            self.assertIs(Factory.getClient('openai'), client)
+            Factory._pid = -1  # 模拟fork后的子进程
+            self.assertIsNot(Factory.getClient('openai'), client)
+
+
+if __name__ == '__main__':
+    main()
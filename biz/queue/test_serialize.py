@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase, main
+
+from biz.queue.debounce import ReviewDebouncer
+from biz.queue.deferral import JobDeferred
+from biz.queue.serialize import ReviewSerializer
+from biz.utils.kv_store import SqliteKVStore
+
+
+def mr_data(head: str) -> dict:
+    return {'project': {'id': 1}, 'object_attributes': {'iid': 7, 'last_commit': {'id': head}}}
+
+
+# @Describe:
+class TestReviewSerializer(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        store = SqliteKVStore(os.path.join(self.tmp_dir.name, 'kv.db'))
+        self.store = store
+        self.serializer = ReviewSerializer(store, ttl=5, retry_delay=3)
+        self.serializer.enabled = True
+        self.debouncer = ReviewDebouncer(store, window=0, supersede=True)
+        self.events = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_job(self, key: str, name: str, superseded=None):
+        try:
+            with self.serializer.hold(key, superseded) as proceed:
+                if not proceed:
+                    self.events.append(f'{name}-skipped')
+                    return
+                self.events.append(f'{name}-start')
+                time.sleep(0.1)
+                self.events.append(f'{name}-end')
+        except JobDeferred as e:
+            self.events.append(f'{name}-deferred-{e.delay:.0f}')
+
+    def run_all(self, jobs):
+        threads = [threading.Thread(target=self.run_job, args=job) for job in jobs]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join(5)
+
+    def test_same_key_deferred(self):
+        """测试同一key正在执行时后到的任务推迟重新投递，不占用worker等待，不同key的任务并行执行"""
+        self.run_all([('k1', 'a'), ('k1', 'b'), ('k2', 'c')])
+        self.assertEqual(self.events, ['a-start', 'b-deferred-3', 'c-start', 'a-end', 'c-end'])
+        # 锁释放后重新投递的任务可以执行
+        self.run_job('k1', 'b')
+        self.assertEqual(self.events[-2:], ['b-start', 'b-end'])
+
+    def test_waiting_job_superseded(self):
+        """测试同一MR正在执行时，已被更新事件取代的旧任务直接跳过，最新的任务推迟"""
+        def superseded(head):
+            return lambda: self.debouncer.superseded('gitlab', 'merge_request', 'host', mr_data(head))
+
+        self.debouncer.register('gitlab', 'merge_request', 'host', mr_data('a1'))
+        self.debouncer.register('gitlab', 'merge_request', 'host', mr_data('b2'))
+        self.run_all([('k', 'running'), ('k', 'a1', superseded('a1')), ('k', 'b2', superseded('b2'))])
+        self.assertEqual(self.events, ['running-start', 'a1-skipped', 'b2-deferred-3', 'running-end'])
+
+    def test_lost_lock_not_renewed_or_released(self):
+        """测试租约过期被其他worker获取的锁，不会被原持有者续约覆盖或释放时删除"""
+        self.serializer.ttl = 0.3
+        with self.serializer.hold('k') as proceed:
+            self.assertTrue(proceed)
+            self.store.set('review_lock:k', 'other', ttl=5)
+            time.sleep(0.25)
+            self.assertEqual(self.store.get('review_lock:k'), 'other')
+        self.assertEqual(self.store.get('review_lock:k'), 'other')
+
+
+if __name__ == '__main__':
+    main()
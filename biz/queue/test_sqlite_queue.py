@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import json
+import os
+import socket
+import tempfile
+import time
+from unittest import TestCase, main
+
+from biz.queue.pool import WorkerPool
+from biz.queue.sqlite_queue import SqliteJobQueue, SqliteQueueConsumer
+
+
+def record(data, token, url, url_slug):
+    with open(url_slug, 'a') as f:
+        f.write(data)
+
+
+def explode(data, token, url, url_slug):
+    raise ValueError('boom')
+
+
+# @Describe:
+class TestSqliteJobQueue(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.queue = SqliteJobQueue(os.path.join(self.tmpdir.name, 'queue.db'))
+        self.queue.backoff = 0
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lease_and_retry(self):
+        """测试任务领取后不可重复领取，租约过期后重新领取，执行进程崩溃后重新投递直至标记失败"""
+        job_id = self.queue.enqueue(record, b'{"a": 1}', 'token', 'url', 'slug')
+        jobs = self.queue.claim('host:1', 10)
+        self.assertEqual([(job['id'], job['attempts']) for job in jobs], [(job_id, 1)])
+        self.assertEqual(jobs[0]['args'], ['{"a": 1}', 'token', 'url', 'slug'])
+        self.assertEqual(self.queue.claim('host:2', 10), [])
+
+        self.queue.visibility_timeout = 0
+        self.queue.extend([job_id], 'host:1')
+        self.assertEqual(self.queue.claim('host:2', 10)[0]['attempts'], 2)
+
+        self.queue.fail(job_id, 2, 'boom')
+        self.assertEqual(self.queue.claim('host:2', 10)[0]['attempts'], 3)
+        self.queue.fail(job_id, 3, 'boom')
+        self.assertEqual(self.queue.claim('host:2', 10), [])
+        self.assertEqual(self.queue.stats()['failed'], 1)
+        conn = self.queue._connect()
+        try:
+            args = conn.execute('SELECT args FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+        finally:
+            conn.close()
+        self.assertEqual(json.loads(args), ['{"a": 1}', '', 'url', 'slug'])
+
+    def test_handler_error_not_retried(self):
+        """测试处理函数抛出的异常不在队列中重试，由任务台账负责"""
+        job_id = self.queue.enqueue(record, '{}', 'token', 'url', 'slug')
+        self.queue.claim('host:1', 10)
+        self.queue.fail(job_id, 1, 'boom', retry=False)
+        self.assertEqual(self.queue.claim('host:2', 10), [])
+        self.assertEqual(self.queue.stats()['failed'], 1)
+
+    def test_deferred_job_not_counted(self):
+        """测试推迟的任务到期后才能再次领取，推迟不计入执行次数"""
+        job_id = self.queue.enqueue(record, '{}', 'token', 'url', 'slug')
+        self.queue.claim('host:1', 10)
+        self.queue.defer(job_id, 0.2)
+        self.assertEqual(self.queue.claim('host:1', 10), [])
+        time.sleep(0.25)
+        self.assertEqual(self.queue.claim('host:1', 10)[0]['attempts'], 1)
+
+    def test_delayed_enqueue(self):
+        """测试延迟入队的任务到期后才能领取"""
+        self.queue.enqueue(record, '{}', 'token', 'url', 'slug', delay=0.2)
+        self.assertEqual(self.queue.claim('host:1', 10), [])
+        time.sleep(0.25)
+        self.assertEqual(len(self.queue.claim('host:1', 10)), 1)
+
+    def test_recover_orphaned_jobs(self):
+        """测试启动时立即恢复已退出进程领取的任务，不影响存活进程的任务"""
+        self.queue.enqueue(record, '{}', 'token', 'url', 'slug')
+        self.queue.enqueue(record, '{}', 'token', 'url', 'slug')
+        self.queue.claim(f'{socket.gethostname()}:{os.getpid()}', 1)
+        self.queue.claim(f'{socket.gethostname()}:999999999', 1)
+        self.assertEqual(self.queue.recover(), 1)
+        self.assertEqual(self.queue.stats()['pending'], 1)
+
+    def test_consumer_runs_jobs(self):
+        """测试消费者通过进程池执行任务，完成后从队列删除"""
+        output = os.path.join(self.tmpdir.name, 'output')
+        for i in range(3):
+            self.queue.enqueue(record, str(i), 'token', 'url', output)
+        pool = WorkerPool(workers=2, max_queue=0, initializer=None)
+        consumer = SqliteQueueConsumer(self.queue, pool, poll_interval=0.05)
+        consumer.start()
+        try:
+            deadline = time.time() + 10
+            while self.queue.stats()['depth'] and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            consumer.stop(timeout=5)
+            pool.shutdown()
+        self.assertEqual(self.queue.stats()['depth'], 0)
+        with open(output) as f:
+            self.assertEqual(sorted(f.read()), ['0', '1', '2'])
+
+    def test_consumer_drain(self):
+        """测试退出前停止领取新任务，等待执行中的任务完成"""
+        output = os.path.join(self.tmpdir.name, 'output')
+        self.queue.enqueue(record, '0', 'token', 'url', output)
+        pool = WorkerPool(workers=2, max_queue=0, initializer=None)
+        consumer = SqliteQueueConsumer(self.queue, pool, poll_interval=0.05)
+        consumer.start()
+        try:
+            deadline = time.time() + 10
+            while not consumer._running and self.queue.stats()['depth'] and time.time() < deadline:
+                time.sleep(0.01)
+            consumer.drain(timeout=10)
+            self.queue.enqueue(record, '1', 'token', 'url', output)
+            time.sleep(0.2)
+        finally:
+            pool.shutdown()
+        self.assertEqual(self.queue.stats()['depth'], 1)
+        with open(output) as f:
+            self.assertEqual(f.read(), '0')
+
+    def test_consumer_does_not_retry_handler_errors(self):
+        """测试处理函数抛出异常的任务标记为失败，不重新投递"""
+        self.queue.enqueue(explode, '{}', 'token', 'url', 'slug')
+        pool = WorkerPool(workers=1, max_queue=0, initializer=None)
+        consumer = SqliteQueueConsumer(self.queue, pool, poll_interval=0.05)
+        consumer.start()
+        try:
+            deadline = time.time() + 10
+            while not self.queue.stats()['failed'] and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            consumer.stop(timeout=5)
+            pool.shutdown()
+        stats = self.queue.stats()
+        self.assertEqual((stats['failed'], stats['depth']), (1, 0))
+
+
+if __name__ == '__main__':
+    main()
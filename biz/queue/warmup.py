@@ -0,0 +1,46 @@
+import time
+
+from biz.utils.log import logger
+
+
+def _load_tokenizer():
+    import tiktoken
+
+    tiktoken.get_encoding("cl100k_base")
+
+
+def _load_reviewer():
+    # 创建大模型客户端并渲染提示词，之后每个任务复用
+    from biz.utils.code_reviewer import CodeReviewer
+
+    CodeReviewer()
+
+
+def _open_stores():
+    # 建表、切换WAL等只需执行一次
+    from biz.service.job_ledger import job_ledger
+    from biz.utils.kv_store import get_kv_store
+
+    get_kv_store()
+    if job_ledger.enabled:
+        job_ledger._connect().close()
+
+
+def warmup():
+    """
+    预热worker进程：提前导入处理函数，加载tokenizer、大模型客户端、提示词和SQLite表结构，避免每个任务重复初始化。
+    预热失败不影响任务执行，任务中会再次按需加载
+    """
+    started = time.time()
+    try:
+        import biz.coding.webhook_handler  # noqa: F401
+        import biz.queue.worker  # noqa: F401
+    except Exception as e:
+        logger.warn(f"Worker warmup failed: {e}")
+        return
+    for step in (_load_tokenizer, _load_reviewer, _open_stores):
+        try:
+            step()
+        except Exception as e:
+            logger.warn(f"Worker warmup step {step.__name__} failed: {e}")
+    logger.debug(f"Worker warmed up in {time.time() - started:.2f}s")
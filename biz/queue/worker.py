@@ -4,23 +4,39 @@ from datetime import datetime
 
 from biz.entity.review_entity import MergeRequestReviewEntity, PushReviewEntity
 from biz.event.event_manager import event_manager
-from biz.gitlab.webhook_handler import filter_changes, MergeRequestHandler, PushHandler
+from biz.git_provider.call_planner import ProviderCallPlanner
+from biz.gitlab.webhook_handler import filter_changes, iter_filter_changes, MergeRequestHandler, PushHandler
 from biz.github.webhook_handler import filter_changes as filter_github_changes, PullRequestHandler as GithubPullRequestHandler, PushHandler as GithubPushHandler
 from biz.gitea.webhook_handler import filter_changes as filter_gitea_changes, PullRequestHandler as GiteaPullRequestHandler, \
     PushHandler as GiteaPushHandler
+from biz.queue.debounce import review_debouncer
+from biz.queue.deferral import JobDeferred
+from biz.queue.serialize import serialized
+from biz.service.job_ledger import job_stage, record_job_error, tracked
+from biz.service.outbox_service import note_outbox
 from biz.service.review_service import ReviewService
 from biz.utils.code_reviewer import CodeReviewer
 from biz.utils.im import notifier
 from biz.utils.log import logger
+from biz.utils.queue import load_payload
+from biz.utils.token_util import take_changes_within_budget
 
 
 
+@tracked('gitlab', 'push')
+@serialized('gitlab', 'push')
 def handle_push_event(webhook_data: dict, gitlab_token: str, gitlab_url: str, gitlab_url_slug: str):
+    webhook_data = load_payload(webhook_data)
+    # 同一MR/PR或分支的连续更新只review最新的head
+    webhook_data = review_debouncer.begin('gitlab', 'push', gitlab_url_slug, webhook_data)
+    if webhook_data is None:
+        return
     push_review_enabled = os.environ.get('PUSH_REVIEW_ENABLED', '0') == '1'
     try:
         handler = PushHandler(webhook_data, gitlab_token, gitlab_url)
         logger.info('Push Hook event received')
-        commits = handler.get_push_commits()
+        with job_stage('fetch'):
+            commits = handler.get_push_commits()
         if not commits:
             logger.error('Failed to get commits')
             return
@@ -31,22 +47,29 @@ def handle_push_event(webhook_data: dict, gitlab_token: str, gitlab_url: str, gi
         deletions = 0
         if push_review_enabled:
             # 获取PUSH的changes
-            changes = handler.get_push_changes()
+            with job_stage('fetch'):
+                changes = handler.get_push_changes()
             logger.info('changes: %s', changes)
-            changes = filter_changes(changes)
+            with job_stage('filter'):
+                changes = filter_changes(changes)
             if not changes:
                 logger.info('未检测到PUSH代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             review_result = "关注的文件没有修改"
 
             if len(changes) > 0:
                 commits_text = ';'.join(commit.get('message', '').strip() for commit in commits)
-                review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
+                with job_stage('llm'):
+                    review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
                 score = CodeReviewer.parse_review_score(review_text=review_result)
                 for item in changes:
                     additions += item['additions']
                     deletions += item['deletions']
+            if not review_debouncer.finish('gitlab', 'push', gitlab_url_slug, webhook_data):
+                return
             # 将review结果提交到Gitlab的 notes
-            handler.add_push_notes(f'Auto Review Result: \n{review_result}')
+            with job_stage('write_back'):
+                note_outbox.deliver('gitlab', 'push', webhook_data, gitlab_token, gitlab_url,
+                                    f'Auto Review Result: \n{review_result}')
 
         event_manager['push_reviewed'].send(PushReviewEntity(
             project_name=webhook_data['project']['name'],
@@ -62,12 +85,17 @@ def handle_push_event(webhook_data: dict, gitlab_token: str, gitlab_url: str, gi
             deletions=deletions,
         ))
 
+    except JobDeferred:
+        raise
     except Exception as e:
         error_message = f'服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
         notifier.send_notification(content=error_message)
+        record_job_error(e)
         logger.error('出现未知错误: %s', error_message)
 
 
+@tracked('gitlab', 'merge_request')
+@serialized('gitlab', 'merge_request')
 def handle_merge_request_event(webhook_data: dict, gitlab_token: str, gitlab_url: str, gitlab_url_slug: str):
     '''
     处理Merge Request Hook事件
@@ -77,6 +105,11 @@ def handle_merge_request_event(webhook_data: dict, gitlab_token: str, gitlab_url
     :param gitlab_url_slug:
     :return:
     '''
+    webhook_data = load_payload(webhook_data)
+    # 同一MR/PR或分支的连续更新只review最新的head
+    webhook_data = review_debouncer.begin('gitlab', 'merge_request', gitlab_url_slug, webhook_data)
+    if webhook_data is None:
+        return
     merge_review_only_protected_branches = os.environ.get('MERGE_REVIEW_ONLY_PROTECTED_BRANCHES_ENABLED', '0') == '1'
     try:
         # 解析Webhook数据
@@ -92,53 +125,65 @@ def handle_merge_request_event(webhook_data: dict, gitlab_token: str, gitlab_url
             logger.info("MR为draft，仅发送通知，不触发AI review。")
             return
 
-        # 如果开启了仅review projected branches的，判断当前目标分支是否为projected branches
-        if merge_review_only_protected_branches and not handler.target_branch_protected():
-            logger.info("Merge Request target branch not match protected branches, ignored.")
-            return
-
         if handler.action not in ['open', 'update']:
             logger.info(f"Merge Request Hook event, action={handler.action}, ignored.")
             return
 
-        # 检查last_commit_id是否已经存在，如果存在则跳过处理
+        # 先并发检查受保护分支和last_commit_id，需要review时再并发获取changes、commits，跳过的事件不再获取、轮询变更
         last_commit_id = object_attributes.get('last_commit', {}).get('id', '')
+        project_name = webhook_data['project']['name']
+        # 两个阶段共用同一个 planner，共享一个 PROVIDER_CALL_DEADLINE
+        planner = ProviderCallPlanner()
+        if merge_review_only_protected_branches:
+            planner.add('protected', handler.target_branch_protected)
         if last_commit_id:
-            project_name = webhook_data['project']['name']
-            source_branch = object_attributes.get('source_branch', '')
-            target_branch = object_attributes.get('target_branch', '')
-            
-            if ReviewService.check_mr_last_commit_id_exists(project_name, source_branch, target_branch, last_commit_id):
-                logger.info(f"Merge Request with last_commit_id {last_commit_id} already exists, skipping review for {project_name}.")
-                return
+            planner.add('reviewed', ReviewService.check_mr_last_commit_id_exists, project_name,
+                        object_attributes.get('source_branch', ''), object_attributes.get('target_branch', ''),
+                        last_commit_id)
+        with job_stage('fetch'):
+            results = planner.run()
+
+        # 如果开启了仅review projected branches的，判断当前目标分支是否为projected branches
+        if merge_review_only_protected_branches and not results['protected']:
+            logger.info("Merge Request target branch not match protected branches, ignored.")
+            return
+
+        # 检查last_commit_id是否已经存在，如果存在则跳过处理
+        if results.get('reviewed'):
+            logger.info(f"Merge Request with last_commit_id {last_commit_id} already exists, skipping review for {project_name}.")
+            return
+
+        planner.add('changes', handler.iter_merge_request_changes)
+        planner.add('commits', handler.get_merge_request_commits)
+        with job_stage('fetch'):
+            results.update(planner.run())
 
         # 仅仅在MR创建或更新时进行Code Review
-        # 获取Merge Request的changes
-        changes = handler.get_merge_request_changes()
-        logger.info('changes: %s', changes)
-        changes = filter_changes(changes)
+        # changes 按页流式获取，逐个文件经过 过滤 → token预算 后再进行review，
+        # 预算用完后继续获取剩余分页，只统计新增、删除的代码数，不保留diff
+        with job_stage('filter'):
+            changes, additions, deletions = take_changes_within_budget(iter_filter_changes(results['changes']))
+        logger.info('changes: %d files within review budget', len(changes))
         if not changes:
             logger.info('未检测到有关代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             return
-        # 统计本次新增、删除的代码总数
-        additions = 0
-        deletions = 0
-        for item in changes:
-            additions += item.get('additions', 0)
-            deletions += item.get('deletions', 0)
 
-        # 获取Merge Request的commits
-        commits = handler.get_merge_request_commits()
+        commits = results['commits']
         if not commits:
             logger.error('Failed to get commits')
             return
 
         # review 代码
         commits_text = ';'.join(commit['title'] for commit in commits)
-        review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
+        with job_stage('llm'):
+            review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
 
+        if not review_debouncer.finish('gitlab', 'merge_request', gitlab_url_slug, webhook_data):
+            return
         # 将review结果提交到Gitlab的 notes
-        handler.add_merge_request_notes(f'Auto Review Result: \n{review_result}')
+        with job_stage('write_back'):
+            note_outbox.deliver('gitlab', 'merge_request', webhook_data, gitlab_token, gitlab_url,
+                                f'Auto Review Result: \n{review_result}')
 
         # dispatch merge_request_reviewed event
         event_manager['merge_request_reviewed'].send(
@@ -160,17 +205,28 @@ def handle_merge_request_event(webhook_data: dict, gitlab_token: str, gitlab_url
             )
         )
 
+    except JobDeferred:
+        raise
     except Exception as e:
         error_message = f'AI Code Review 服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
         notifier.send_notification(content=error_message)
+        record_job_error(e)
         logger.error('出现未知错误: %s', error_message)
 
+@tracked('github', 'push')
+@serialized('github', 'push')
 def handle_github_push_event(webhook_data: dict, github_token: str, github_url: str, github_url_slug: str):
+    webhook_data = load_payload(webhook_data)
+    # 同一MR/PR或分支的连续更新只review最新的head
+    webhook_data = review_debouncer.begin('github', 'push', github_url_slug, webhook_data)
+    if webhook_data is None:
+        return
     push_review_enabled = os.environ.get('PUSH_REVIEW_ENABLED', '0') == '1'
     try:
         handler = GithubPushHandler(webhook_data, github_token, github_url)
         logger.info('GitHub Push event received')
-        commits = handler.get_push_commits()
+        with job_stage('fetch'):
+            commits = handler.get_push_commits()
         if not commits:
             logger.error('Failed to get commits')
             return
@@ -181,22 +237,29 @@ def handle_github_push_event(webhook_data: dict, github_token: str, github_url:
         deletions = 0
         if push_review_enabled:
             # 获取PUSH的changes
-            changes = handler.get_push_changes()
+            with job_stage('fetch'):
+                changes = handler.get_push_changes()
             logger.info('changes: %s', changes)
-            changes = filter_github_changes(changes)
+            with job_stage('filter'):
+                changes = filter_github_changes(changes)
             if not changes:
                 logger.info('未检测到PUSH代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             review_result = "关注的文件没有修改"
 
             if len(changes) > 0:
                 commits_text = ';'.join(commit.get('message', '').strip() for commit in commits)
-                review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
+                with job_stage('llm'):
+                    review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
                 score = CodeReviewer.parse_review_score(review_text=review_result)
                 for item in changes:
                     additions += item.get('additions', 0)
                     deletions += item.get('deletions', 0)
+            if not review_debouncer.finish('github', 'push', github_url_slug, webhook_data):
+                return
             # 将review结果提交到GitHub的 notes
-            handler.add_push_notes(f'Auto Review Result: \n{review_result}')
+            with job_stage('write_back'):
+                note_outbox.deliver('github', 'push', webhook_data, github_token, github_url,
+                                    f'Auto Review Result: \n{review_result}')
 
         event_manager['push_reviewed'].send(PushReviewEntity(
             project_name=webhook_data['repository']['name'],
@@ -212,12 +275,17 @@ def handle_github_push_event(webhook_data: dict, github_token: str, github_url:
             deletions=deletions,
         ))
 
+    except JobDeferred:
+        raise
     except Exception as e:
         error_message = f'服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
         notifier.send_notification(content=error_message)
+        record_job_error(e)
         logger.error('出现未知错误: %s', error_message)
 
 
+@tracked('github', 'pull_request')
+@serialized('github', 'pull_request')
 def handle_github_pull_request_event(webhook_data: dict, github_token: str, github_url: str, github_url_slug: str):
     '''
     处理GitHub Pull Request 事件
@@ -227,36 +295,54 @@ def handle_github_pull_request_event(webhook_data: dict, github_token: str, gith
     :param github_url_slug:
     :return:
     '''
+    webhook_data = load_payload(webhook_data)
+    # 同一MR/PR或分支的连续更新只review最新的head
+    webhook_data = review_debouncer.begin('github', 'pull_request', github_url_slug, webhook_data)
+    if webhook_data is None:
+        return
     merge_review_only_protected_branches = os.environ.get('MERGE_REVIEW_ONLY_PROTECTED_BRANCHES_ENABLED', '0') == '1'
     try:
         # 解析Webhook数据
         handler = GithubPullRequestHandler(webhook_data, github_token, github_url)
         logger.info('GitHub Pull Request event received')
-        # 如果开启了仅review projected branches的，判断当前目标分支是否为projected branches
-        if merge_review_only_protected_branches and not handler.target_branch_protected():
-            logger.info("Merge Request target branch not match protected branches, ignored.")
-            return
-
         if handler.action not in ['opened', 'synchronize']:
             logger.info(f"Pull Request Hook event, action={handler.action}, ignored.")
             return
 
-        # 检查GitHub Pull Request的last_commit_id是否已经存在，如果存在则跳过处理
+        # 先并发检查受保护分支和last_commit_id，需要review时再并发获取changes、commits，跳过的事件不再获取、轮询变更
         github_last_commit_id = webhook_data['pull_request']['head']['sha']
+        project_name = webhook_data['repository']['name']
+        # 两个阶段共用同一个 planner，共享一个 PROVIDER_CALL_DEADLINE
+        planner = ProviderCallPlanner()
+        if merge_review_only_protected_branches:
+            planner.add('protected', handler.target_branch_protected)
         if github_last_commit_id:
-            project_name = webhook_data['repository']['name']
-            source_branch = webhook_data['pull_request']['head']['ref']
-            target_branch = webhook_data['pull_request']['base']['ref']
-            
-            if ReviewService.check_mr_last_commit_id_exists(project_name, source_branch, target_branch, github_last_commit_id):
-                logger.info(f"Pull Request with last_commit_id {github_last_commit_id} already exists, skipping review for {project_name}.")
-                return
+            planner.add('reviewed', ReviewService.check_mr_last_commit_id_exists, project_name,
+                        webhook_data['pull_request']['head']['ref'], webhook_data['pull_request']['base']['ref'],
+                        github_last_commit_id)
+        with job_stage('fetch'):
+            results = planner.run()
+
+        # 如果开启了仅review projected branches的，判断当前目标分支是否为projected branches
+        if merge_review_only_protected_branches and not results['protected']:
+            logger.info("Merge Request target branch not match protected branches, ignored.")
+            return
+
+        # 检查GitHub Pull Request的last_commit_id是否已经存在，如果存在则跳过处理
+        if results.get('reviewed'):
+            logger.info(f"Pull Request with last_commit_id {github_last_commit_id} already exists, skipping review for {project_name}.")
+            return
+
+        planner.add('changes', handler.get_pull_request_changes)
+        planner.add('commits', handler.get_pull_request_commits)
+        with job_stage('fetch'):
+            results.update(planner.run())
 
         # 仅仅在PR创建或更新时进行Code Review
-        # 获取Pull Request的changes
-        changes = handler.get_pull_request_changes()
+        changes = results['changes']
         logger.info('changes: %s', changes)
-        changes = filter_github_changes(changes)
+        with job_stage('filter'):
+            changes = filter_github_changes(changes)
         if not changes:
             logger.info('未检测到有关代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             return
@@ -267,18 +353,22 @@ def handle_github_pull_request_event(webhook_data: dict, github_token: str, gith
             additions += item.get('additions', 0)
             deletions += item.get('deletions', 0)
 
-        # 获取Pull Request的commits
-        commits = handler.get_pull_request_commits()
+        commits = results['commits']
         if not commits:
             logger.error('Failed to get commits')
             return
 
         # review 代码
         commits_text = ';'.join(commit['title'] for commit in commits)
-        review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
+        with job_stage('llm'):
+            review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
 
+        if not review_debouncer.finish('github', 'pull_request', github_url_slug, webhook_data):
+            return
         # 将review结果提交到GitHub的 notes
-        handler.add_pull_request_notes(f'Auto Review Result: \n{review_result}')
+        with job_stage('write_back'):
+            note_outbox.deliver('github', 'pull_request', webhook_data, github_token, github_url,
+                                f'Auto Review Result: \n{review_result}')
 
         # dispatch pull_request_reviewed event
         event_manager['merge_request_reviewed'].send(
@@ -299,18 +389,29 @@ def handle_github_pull_request_event(webhook_data: dict, github_token: str, gith
                 last_commit_id=github_last_commit_id,
             ))
 
+    except JobDeferred:
+        raise
     except Exception as e:
         error_message = f'服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
         notifier.send_notification(content=error_message)
+        record_job_error(e)
         logger.error('出现未知错误: %s', error_message)
 
 
+@tracked('gitea', 'push')
+@serialized('gitea', 'push')
 def handle_gitea_push_event(webhook_data: dict, gitea_token: str, gitea_url: str, gitea_url_slug: str):
+    webhook_data = load_payload(webhook_data)
+    # 同一MR/PR或分支的连续更新只review最新的head
+    webhook_data = review_debouncer.begin('gitea', 'push', gitea_url_slug, webhook_data)
+    if webhook_data is None:
+        return
     push_review_enabled = os.environ.get('PUSH_REVIEW_ENABLED', '0') == '1'
     try:
         handler = GiteaPushHandler(webhook_data, gitea_token, gitea_url)
         logger.info('Gitea Push event received')
-        commits = handler.get_push_commits()
+        with job_stage('fetch'):
+            commits = handler.get_push_commits()
         if not commits:
             logger.error('Failed to get commits')
             return
@@ -320,21 +421,28 @@ def handle_gitea_push_event(webhook_data: dict, gitea_token: str, gitea_url: str
         additions = 0
         deletions = 0
         if push_review_enabled:
-            changes = handler.get_push_changes()
+            with job_stage('fetch'):
+                changes = handler.get_push_changes()
             logger.info('changes: %s', changes)
-            changes = filter_gitea_changes(changes)
+            with job_stage('filter'):
+                changes = filter_gitea_changes(changes)
             if not changes:
                 logger.info('未检测到PUSH代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             review_result = "关注的文件没有修改"
 
             if len(changes) > 0:
                 commits_text = ';'.join(commit.get('message', '').strip() for commit in commits)
-                review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
+                with job_stage('llm'):
+                    review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
                 score = CodeReviewer.parse_review_score(review_text=review_result)
                 for item in changes:
                     additions += item.get('additions', 0)
                     deletions += item.get('deletions', 0)
-            handler.add_push_notes(f'Auto Review Result: \n{review_result}')
+            if not review_debouncer.finish('gitea', 'push', gitea_url_slug, webhook_data):
+                return
+            with job_stage('write_back'):
+                note_outbox.deliver('gitea', 'push', webhook_data, gitea_token, gitea_url,
+                                    f'Auto Review Result: \n{review_result}')
 
         repository = webhook_data.get('repository', {})
         sender = webhook_data.get('sender', {}) or webhook_data.get('pusher', {}) or {}
@@ -353,13 +461,23 @@ def handle_gitea_push_event(webhook_data: dict, gitea_token: str, gitea_url: str
             deletions=deletions,
         ))
 
+    except JobDeferred:
+        raise
     except Exception as e:
         error_message = f'服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
         notifier.send_notification(content=error_message)
+        record_job_error(e)
         logger.error('出现未知错误: %s', error_message)
 
 
+@tracked('gitea', 'pull_request')
+@serialized('gitea', 'pull_request')
 def handle_gitea_pull_request_event(webhook_data: dict, gitea_token: str, gitea_url: str, gitea_url_slug: str):
+    webhook_data = load_payload(webhook_data)
+    # 同一MR/PR或分支的连续更新只review最新的head
+    webhook_data = review_debouncer.begin('gitea', 'pull_request', gitea_url_slug, webhook_data)
+    if webhook_data is None:
+        return
     merge_review_only_protected_branches = os.environ.get('MERGE_REVIEW_ONLY_PROTECTED_BRANCHES_ENABLED', '0') == '1'
     try:
         handler = GiteaPullRequestHandler(webhook_data, gitea_token, gitea_url)
@@ -367,10 +485,6 @@ def handle_gitea_pull_request_event(webhook_data: dict, gitea_token: str, gitea_
 
         pull_request = webhook_data.get('pull_request', {})
 
-        if merge_review_only_protected_branches and not handler.target_branch_protected():
-            logger.info("Pull Request target branch not match protected branches, ignored.")
-            return
-
         if handler.action not in ['opened', 'open', 'reopened', 'synchronize', 'synchronized']:
             logger.info(f"Pull Request Hook event, action={handler.action}, ignored.")
             return
@@ -378,19 +492,37 @@ def handle_gitea_pull_request_event(webhook_data: dict, gitea_token: str, gitea_
         head_info = pull_request.get('head') or {}
         base_info = pull_request.get('base') or {}
 
+        # 先并发检查受保护分支和last_commit_id，需要review时再并发获取changes、commits，跳过的事件不再获取、轮询变更
         last_commit_id = head_info.get('sha') or pull_request.get('merge_commit_sha') or pull_request.get('last_commit_id')
+        project_name = webhook_data.get('repository', {}).get('name')
+        # 两个阶段共用同一个 planner，共享一个 PROVIDER_CALL_DEADLINE
+        planner = ProviderCallPlanner()
+        if merge_review_only_protected_branches:
+            planner.add('protected', handler.target_branch_protected)
         if last_commit_id:
-            project_name = webhook_data.get('repository', {}).get('name')
-            source_branch = head_info.get('ref') or pull_request.get('head_branch', '')
-            target_branch = base_info.get('ref') or pull_request.get('base_branch', '')
+            planner.add('reviewed', ReviewService.check_mr_last_commit_id_exists, project_name,
+                        head_info.get('ref') or pull_request.get('head_branch', ''),
+                        base_info.get('ref') or pull_request.get('base_branch', ''), last_commit_id)
+        with job_stage('fetch'):
+            results = planner.run()
 
-            if ReviewService.check_mr_last_commit_id_exists(project_name, source_branch, target_branch, last_commit_id):
-                logger.info(f"Pull Request with last_commit_id {last_commit_id} already exists, skipping review for {project_name}.")
-                return
+        if merge_review_only_protected_branches and not results['protected']:
+            logger.info("Pull Request target branch not match protected branches, ignored.")
+            return
+
+        if results.get('reviewed'):
+            logger.info(f"Pull Request with last_commit_id {last_commit_id} already exists, skipping review for {project_name}.")
+            return
 
-        changes = handler.get_pull_request_changes()
+        planner.add('changes', handler.get_pull_request_changes)
+        planner.add('commits', handler.get_pull_request_commits)
+        with job_stage('fetch'):
+            results.update(planner.run())
+
+        changes = results['changes']
         logger.info('changes: %s', changes)
-        changes = filter_gitea_changes(changes)
+        with job_stage('filter'):
+            changes = filter_gitea_changes(changes)
         if not changes:
             logger.info('未检测到有关代码的修改,修改文件可能不满足SUPPORTED_EXTENSIONS。')
             return
@@ -401,15 +533,20 @@ def handle_gitea_pull_request_event(webhook_data: dict, gitea_token: str, gitea_
             additions += item.get('additions', 0)
             deletions += item.get('deletions', 0)
 
-        commits = handler.get_pull_request_commits()
+        commits = results['commits']
         if not commits:
             logger.error('Failed to get commits for Gitea pull request')
             return
 
         commits_text = ';'.join(commit.get('title', '') for commit in commits)
-        review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
+        with job_stage('llm'):
+            review_result = CodeReviewer().review_and_strip_code(str(changes), commits_text)
 
-        handler.add_pull_request_notes(f'Auto Review Result: \n{review_result}')
+        if not review_debouncer.finish('gitea', 'pull_request', gitea_url_slug, webhook_data):
+            return
+        with job_stage('write_back'):
+            note_outbox.deliver('gitea', 'pull_request', webhook_data, gitea_token, gitea_url,
+                                f'Auto Review Result: \n{review_result}')
 
         repository = webhook_data.get('repository', {})
         author_info = pull_request.get('user', {}) or webhook_data.get('sender', {}) or {}
@@ -432,7 +569,10 @@ def handle_gitea_pull_request_event(webhook_data: dict, gitea_token: str, gitea_
                 last_commit_id=last_commit_id,
             ))
 
+    except JobDeferred:
+        raise
     except Exception as e:
         error_message = f'AI Code Review 服务出现未知错误: {str(e)}\n{traceback.format_exc()}'
         notifier.send_notification(content=error_message)
+        record_job_error(e)
         logger.error('出现未知错误: %s', error_message)
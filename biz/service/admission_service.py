@@ -0,0 +1,148 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Mapping, Optional
+
+from biz.utils.log import logger
+from biz.utils.queue import queue_stats
+
+# 各平台携带webhook令牌或签名的header：GitLab 直接比较 Secret Token，其他平台为请求体的 HMAC 签名
+SIGNATURE_HEADERS = {
+    'gitlab': 'X-Gitlab-Token',
+    'github': 'X-Hub-Signature-256',
+    'gitea': 'X-Gitea-Signature',
+    'coding': 'X-Coding-Signature',
+}
+
+
+def verify_signature(provider: str, secret: str, headers: Mapping[str, str], raw_body: bytes) -> bool:
+    """
+    校验webhook的令牌或签名，只依赖请求头和原始请求体，不需要解析JSON
+    """
+    received = headers.get(SIGNATURE_HEADERS.get(provider, ''), '')
+    if not received:
+        return False
+    if provider == 'gitlab':
+        expected = secret
+    elif provider == 'github':
+        expected = 'sha256=' + hmac.new(secret.encode('utf-8'), raw_body, hashlib.sha256).hexdigest()
+    elif provider == 'coding':
+        expected = 'sha1=' + hmac.new(secret.encode('utf-8'), raw_body, hashlib.sha1).hexdigest()
+    else:
+        expected = hmac.new(secret.encode('utf-8'), raw_body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(received, expected)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """
+        取一个令牌，成功返回0，否则返回需要等待的秒数
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Rejection:
+    def __init__(self, status: int, message: str, retry_after: float = None):
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    webhook入口的准入控制：请求体大小限制、令牌/签名校验、按来源限流，以及队列积压时按优先级丢弃事件
+    (先丢弃push，积压更严重时再丢弃MR/PR)，被拒绝的请求返回 429 和 Retry-After，平台稍后重试。
+    所有检查都在解析JSON之前完成，洪峰下服务保持可用。
+    """
+
+    def __init__(self, stats_loader: Callable[[], dict] = queue_stats):
+        self.max_body_bytes = int(os.getenv('WEBHOOK_MAX_BODY_BYTES', 25 * 1024 * 1024))
+        self.rate = float(os.getenv('WEBHOOK_RATE_LIMIT', 0))
+        self.burst = float(os.getenv('WEBHOOK_RATE_BURST', 0)) or max(self.rate * 2, 1)
+        self.shed_push_depth = int(os.getenv('WEBHOOK_SHED_PUSH_DEPTH', 0))
+        self.shed_push_age = float(os.getenv('WEBHOOK_SHED_PUSH_AGE', 0))
+        self.shed_all_depth = int(os.getenv('WEBHOOK_SHED_ALL_DEPTH', 0))
+        self.shed_all_age = float(os.getenv('WEBHOOK_SHED_ALL_AGE', 0))
+        self.retry_after = int(os.getenv('WEBHOOK_RETRY_AFTER', 60))
+        self.stats_loader = stats_loader
+        self._buckets = OrderedDict()
+        self._max_sources = 10000
+        self._stats = {'depth': 0, 'oldest_age': 0.0}
+        self._stats_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def shedding_enabled(self) -> bool:
+        return any((self.shed_push_depth, self.shed_push_age, self.shed_all_depth, self.shed_all_age))
+
+    def check_body_size(self, content_length: Optional[int]) -> Optional[Rejection]:
+        if content_length is not None and content_length > self.max_body_bytes:
+            return Rejection(413, f'Payload too large: {content_length} bytes, limit {self.max_body_bytes}')
+        return None
+
+    def check_signature(self, provider: str, headers: Mapping[str, str], raw_body: bytes) -> Optional[Rejection]:
+        # 未配置密钥时不校验，兼容现有部署
+        secret = os.getenv(f'{provider.upper()}_WEBHOOK_SECRET') or os.getenv('WEBHOOK_SECRET')
+        if not secret or verify_signature(provider, secret, headers, raw_body):
+            return None
+        return Rejection(401, f'Invalid {provider} webhook token or signature')
+
+    def check_rate(self, source: str) -> Optional[Rejection]:
+        if self.rate <= 0:
+            return None
+        with self._lock:
+            bucket = self._buckets.get(source)
+            if bucket is None:
+                bucket = self._buckets[source] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self._max_sources:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(source)
+            wait = bucket.take()
+        if wait:
+            return Rejection(429, f'Rate limit exceeded for {source}', retry_after=wait)
+        return None
+
+    def _queue_stats(self) -> dict:
+        # 队列统计可能需要访问Redis，最多每秒刷新一次
+        now = time.monotonic()
+        if now - self._stats_at >= 1:
+            self._stats_at = now
+            try:
+                self._stats = self.stats_loader()
+            except Exception as e:
+                logger.warn(f"Failed to load queue stats for admission control: {e}")
+        return self._stats
+
+    def check_queue(self, event_type: str) -> Optional[Rejection]:
+        if not self.shedding_enabled:
+            return None
+        stats = self._queue_stats()
+        depth, age = stats['depth'], stats['oldest_age']
+        overloaded = (self.shed_all_depth and depth >= self.shed_all_depth) or \
+                     (self.shed_all_age and age >= self.shed_all_age)
+        if event_type == 'push':
+            overloaded = overloaded or (self.shed_push_depth and depth >= self.shed_push_depth) or \
+                         (self.shed_push_age and age >= self.shed_push_age)
+        if overloaded:
+            return Rejection(429, f'Review queue overloaded (depth={depth}, oldest={age:.0f}s), '
+                                  f'{event_type} event shed', retry_after=self.retry_after)
+        return None
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,80 @@
+import hashlib
+import os
+import time
+from typing import Mapping, Optional
+
+from biz.utils.kv_store import KVStore, get_kv_store
+from biz.utils.log import logger
+
+# 各平台每次投递的唯一ID，平台重试或手动重新投递时ID不变
+DELIVERY_ID_HEADERS = ('X-Gitlab-Event-UUID', 'X-GitHub-Delivery', 'X-Gitea-Delivery')
+
+
+class WebhookDeduplicator:
+    """
+    webhook 投递去重：在入队前记录投递ID和请求体哈希，TTL内重复的投递直接丢弃。
+    可覆盖平台超时重试、重新投递，以及群组和项目同时配置了webhook导致的重复事件。
+    记录保存在KVStore中，QUEUE_DRIVER=rq 或 KV_STORE_DRIVER=redis 时多个API节点共享。
+    """
+
+    def __init__(self, store: KVStore = None, ttl: float = None):
+        self._store = store
+        self.ttl = ttl if ttl is not None else float(os.getenv('WEBHOOK_DEDUP_TTL', 86400))
+        self._last_purge = 0.0
+
+    @property
+    def store(self) -> KVStore:
+        if self._store is None:
+            self._store = get_kv_store()
+        return self._store
+
+    @staticmethod
+    def delivery_keys(headers: Mapping[str, str], raw_body: bytes) -> list:
+        keys = []
+        for header_name in DELIVERY_ID_HEADERS:
+            delivery_id = headers.get(header_name)
+            if delivery_id:
+                keys.append(f"webhook_delivery:{delivery_id}")
+        # 同一事件的重复投递请求体完全相同，不同事件的请求体包含不同的时间戳或提交
+        keys.append(f"webhook_payload:{hashlib.sha256(raw_body).hexdigest()}")
+        return keys
+
+    def check_and_mark(self, headers: Mapping[str, str], raw_body: bytes) -> Optional[list]:
+        """
+        检查并记录本次投递，返回记录的key；重复投递返回None。去重存储不可用时不丢弃事件
+        """
+        if self.ttl <= 0:
+            return []
+        keys = self.delivery_keys(headers, raw_body)
+        marked = []
+        try:
+            for key in keys:
+                if not self.store.add(key, time.time(), ttl=self.ttl):
+                    logger.info(f"Duplicate webhook delivery ignored: {key}")
+                    # 同一投递的其他key保留，之后以另一种形式重复的投递同样会被丢弃
+                    return None
+                marked.append(key)
+            self._purge_expired()
+        except Exception as e:
+            logger.warn(f"Webhook dedup store unavailable, accepting delivery: {e}")
+        return marked
+
+    def release(self, keys: list):
+        """
+        入队失败时删除记录，使平台的重试可以再次入队
+        """
+        for key in keys or []:
+            try:
+                self.store.delete(key)
+            except Exception as e:
+                logger.warn(f"Failed to release webhook dedup key {key}: {e}")
+
+    def _purge_expired(self):
+        # Redis 的key自动过期，SQLite 定期清理过期记录，避免无限增长
+        purge = getattr(self.store, 'purge_expired', None)
+        if purge and time.time() - self._last_purge > 3600:
+            self._last_purge = time.time()
+            purge()
+
+
+webhook_deduplicator = WebhookDeduplicator()
@@ -0,0 +1,310 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from biz.git_provider.manager import resolve_token
+from biz.queue.debounce import review_project
+from biz.queue.deferral import deferrable, JobDeferred
+from biz.utils.log import logger
+
+# 发表评论、调用大模型之前的阶段，任务可以推迟后重新投递(JobDeferred)，不会重复已完成的操作
+DEFERRABLE_STAGES = ('fetch', 'filter')
+
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+STATUS_QUEUED = 'queued'
+STATUS_DEAD = 'dead'
+# 评论已发表后失败(通知、写入数据库等)，重新执行会重复调用大模型并重复发表评论，只记录不重试
+STATUS_PARTIAL = 'partial'
+
+# 任务各阶段：获取变更、过滤、调用大模型、发表评论、IM通知、写入数据库
+STAGES = ('fetch', 'filter', 'llm', 'write_back', 'notify', 'persist')
+# 进入这些阶段后失败的任务不再重试，发表评论本身失败(评论没有发出或没有写入发件箱)的除外
+AFTER_WRITE_BACK_STAGES = ('write_back', 'notify', 'persist')
+
+_current = threading.local()
+
+
+def job_id_of(function_path: str, payload: str) -> str:
+    # 相同处理函数和请求体的任务(平台重试、重放)记录为同一个任务
+    return hashlib.sha256(f"{function_path}\n{payload}".encode('utf-8')).hexdigest()[:32]
+
+
+@contextmanager
+def job_stage(name: str):
+    """
+    记录当前任务某个阶段的耗时，同一阶段多次执行时累加；不在任务中执行时不记录。
+    DEFERRABLE_STAGES 中的阶段允许 Provider API 限流时推迟任务
+    """
+    job = getattr(_current, 'job', None)
+    started = time.perf_counter()
+    try:
+        with deferrable(name in DEFERRABLE_STAGES):
+            yield
+    except Exception:
+        if job is not None:
+            job.setdefault('failed_stage', name)
+        raise
+    finally:
+        if job is not None:
+            job['stages'][name] = round(job['stages'].get(name, 0.0) + time.perf_counter() - started, 3)
+
+
+def record_job_error(error):
+    """
+    处理函数捕获异常后调用，标记当前任务失败
+    """
+    job = getattr(_current, 'job', None)
+    if job is not None:
+        job['error'] = str(error) or error.__class__.__name__
+
+
+class JobLedger:
+    """
+    任务台账：记录每个review任务的执行次数、各阶段耗时和错误，存储在 SQLite(data/jobs.db)。
+    每次投递只执行一次：发表评论前或发表评论时失败的任务标记为 failed，按指数退避由 retry_due 通过队列重新入队，
+    达到 JOB_MAX_ATTEMPTS 后进入死信状态(dead)，保留请求体，平台恢复后通过 python -m biz.cmd.replay 批量重放；
+    发表评论后失败的任务标记为 partial，不再重新执行。成功的任务清除请求体和令牌。
+    """
+
+    def __init__(self, db_file: str = None):
+        self.db_file = db_file or os.getenv('JOB_LEDGER_DB_FILE', 'data/jobs.db')
+        self.max_attempts = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+        self.backoff = float(os.getenv('JOB_RETRY_BACKOFF', 10))
+        self.retention = float(os.getenv('JOB_LEDGER_RETENTION_DAYS', 7)) * 86400
+        self._initialized = False
+        self._last_purge = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return os.getenv('JOB_LEDGER_ENABLED', '1') == '1'
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        if not self._initialized:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    function TEXT,
+                    provider TEXT,
+                    event_type TEXT,
+                    url_slug TEXT,
+                    project TEXT,
+                    payload TEXT,
+                    token TEXT,
+                    url TEXT,
+                    status TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    stages TEXT DEFAULT '{}',
+                    error TEXT DEFAULT '',
+                    duration REAL DEFAULT 0,
+                    created_at REAL,
+                    updated_at REAL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, updated_at)')
+            self._initialized = True
+        return conn
+
+    def start(self, function_path: str, provider: str, event_type: str, payload: str, token: str, url: str,
+              url_slug: str, project: Optional[str]) -> str:
+        job_id = job_id_of(function_path, payload)
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('''
+                INSERT INTO jobs (id, function, provider, event_type, url_slug, project, payload, token, url, status,
+                                  created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET payload = excluded.payload, token = excluded.token, url = excluded.url,
+                    status = excluded.status, updated_at = excluded.updated_at
+            ''', (job_id, function_path, provider, event_type, url_slug, project, payload, token, url, STATUS_RUNNING,
+                  now, now))
+        finally:
+            conn.close()
+        self._purge_expired()
+        return job_id
+
+    def record_attempt(self, job_id: str, succeeded: bool, stages: dict, error: str, duration: float,
+                       failed_stage: str = '') -> str:
+        """
+        记录一次执行，返回任务的新状态。failed_stage 为抛出异常的阶段：在发表评论阶段失败时评论没有发出，仍可重试
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            if succeeded:
+                status = STATUS_SUCCEEDED
+            elif failed_stage != 'write_back' and any(stage in stages for stage in AFTER_WRITE_BACK_STAGES):
+                status = STATUS_PARTIAL
+            else:
+                status = STATUS_DEAD if attempts >= self.max_attempts else STATUS_FAILED
+            # 成功的任务不再需要重放，清除请求体和令牌
+            conn.execute(f'''
+                UPDATE jobs SET status = ?, attempts = ?, stages = ?, error = ?, duration = ?, updated_at = ?
+                    {", payload = '', token = ''" if succeeded else ''}
+                WHERE id = ?
+            ''', (status, attempts, json.dumps(stages), (error or '')[:2000], round(duration, 3), time.time(), job_id))
+        finally:
+            conn.close()
+        return status
+
+    def mark_queued(self, job_id: str):
+        """
+        任务被推迟(JobDeferred)，等待队列重新投递，不计入执行次数
+        """
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?', (STATUS_QUEUED, time.time(), job_id))
+        finally:
+            conn.close()
+
+    def retry_delay(self, attempts: int) -> float:
+        return self.backoff * (2 ** (attempts - 1))
+
+    def retry_due(self, enqueue: Callable[[dict], None], limit: int = 100) -> int:
+        """
+        将退避时间已到的失败任务通过 enqueue(job) 重新入队，返回入队的任务数；
+        入队前标记为 queued，避免重复入队，入队失败(如队列已满)时恢复为 failed 等待下次重试
+        """
+        now = time.time()
+        jobs = [job for job in self.list_jobs(status=STATUS_FAILED, limit=limit)
+                if job['payload'] and job['updated_at'] + self.retry_delay(job['attempts']) <= now]
+        enqueued = 0
+        for job in jobs:
+            conn = self._connect()
+            try:
+                claimed = conn.execute('UPDATE jobs SET status = ? WHERE id = ? AND status = ?',
+                                       (STATUS_QUEUED, job['id'], STATUS_FAILED)).rowcount == 1
+                if not claimed:
+                    continue
+                try:
+                    enqueue(job)
+                    enqueued += 1
+                except Exception as e:
+                    logger.warn(f"Failed to re-enqueue job {job['id']}: {e}")
+                    conn.execute('UPDATE jobs SET status = ? WHERE id = ? AND status = ?',
+                                 (STATUS_FAILED, job['id'], STATUS_QUEUED))
+            finally:
+                conn.close()
+        if enqueued:
+            logger.info(f"Re-enqueued {enqueued} failed jobs.")
+        return enqueued
+
+    def list_jobs(self, status: str = None, provider: str = None, project: str = None, job_ids: list = None,
+                  limit: int = 100) -> list:
+        conditions, params = [], []
+        for column, value in (('status', status), ('provider', provider), ('project', project)):
+            if value:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if job_ids:
+            conditions.append(f"id IN ({', '.join('?' * len(job_ids))})")
+            params.extend(job_ids)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        conn = self._connect()
+        try:
+            rows = conn.execute(f'''
+                SELECT id, function, provider, event_type, url_slug, project, payload, token, url, status, attempts,
+                       stages, error, duration, created_at, updated_at
+                FROM jobs {where} ORDER BY updated_at LIMIT ?
+            ''', (*params, limit)).fetchall()
+        finally:
+            conn.close()
+        columns = ('id', 'function', 'provider', 'event_type', 'url_slug', 'project', 'payload', 'token', 'url',
+                   'status', 'attempts', 'stages', 'error', 'duration', 'created_at', 'updated_at')
+        jobs = [dict(zip(columns, row)) for row in rows]
+        for job in jobs:
+            job['stages'] = json.loads(job['stages'] or '{}')
+        return jobs
+
+    def _purge_expired(self):
+        # 每小时清理一次超过保留时间的成功任务
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        try:
+            conn = self._connect()
+            try:
+                conn.execute('DELETE FROM jobs WHERE status = ? AND updated_at < ?',
+                             (STATUS_SUCCEEDED, now - self.retention))
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.warn(f"Failed to purge job ledger: {e}")
+
+    def run(self, function, provider: str, event_type: str, webhook_data, token: str, url: str, url_slug: str):
+        """
+        执行一次任务并记录台账：处理函数捕获异常后通过 record_job_error 标记失败，不在进程内等待重试，
+        由 retry_due 通过队列重新入队；抛出 JobDeferred 的任务标记为 queued 后重新抛出，由队列推迟后重新投递。token 为 token_ref() 引用时台账中只保存引用，执行时才解析为访问令牌
+        """
+        path = f"{function.__module__}.{function.__qualname__}"
+        payload = webhook_data.decode('utf-8') if isinstance(webhook_data, (bytes, bytearray)) else \
+            webhook_data if isinstance(webhook_data, str) else json.dumps(webhook_data)
+        try:
+            project = review_project(json.loads(payload))
+            job_id = self.start(path, provider, event_type, payload, token, url, url_slug, project)
+        except Exception as e:
+            logger.warn(f"Failed to record job in ledger: {e}")
+            return function(webhook_data, resolve_token(token), url, url_slug)
+
+        job = _current.job = {'stages': {}, 'error': ''}
+        started = time.perf_counter()
+        try:
+            function(webhook_data, resolve_token(token), url, url_slug)
+        except JobDeferred:
+            # 推迟不是一次执行，由队列重新投递
+            _current.job = None
+            try:
+                self.mark_queued(job_id)
+            except Exception as e:
+                logger.warn(f"Failed to update job {job_id} in ledger: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} raised: {e}")
+            job['error'] = job['error'] or str(e) or e.__class__.__name__
+        finally:
+            _current.job = None
+        try:
+            status = self.record_attempt(job_id, not job['error'], job['stages'], job['error'],
+                                         time.perf_counter() - started, job.get('failed_stage', ''))
+        except Exception as e:
+            logger.warn(f"Failed to update job {job_id} in ledger: {e}")
+            return
+        if status == STATUS_DEAD:
+            logger.error(f"Job {job_id} failed after {self.max_attempts} attempts, moved to dead letters: "
+                         f"{job['error']}")
+        elif status == STATUS_PARTIAL:
+            logger.error(f"Job {job_id} failed after the review was written back, not retried: {job['error']}")
+        elif status == STATUS_FAILED:
+            logger.warn(f"Job {job_id} failed, waiting to be re-enqueued: {job['error']}")
+
+
+job_ledger = JobLedger()
+
+
+def tracked(provider: str, event_type: str):
+    """
+    worker处理函数的装饰器：记录任务台账，失败的任务等待重新入队，多次失败后进入死信；将入队的令牌引用解析为访问令牌
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(webhook_data, token: str, url: str, url_slug: str):
+            if not job_ledger.enabled:
+                return function(webhook_data, resolve_token(token), url, url_slug)
+            return job_ledger.run(function, provider, event_type, webhook_data, token, url, url_slug)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,236 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from biz.git_provider.manager import resolve_token, token_ref
+from biz.gitea.webhook_handler import PullRequestHandler as GiteaPullRequestHandler, PushHandler as GiteaPushHandler
+from biz.github.webhook_handler import PullRequestHandler as GithubPullRequestHandler, PushHandler as GithubPushHandler
+from biz.gitlab.webhook_handler import MergeRequestHandler, PushHandler
+from biz.utils.log import logger
+
+# (平台, 事件类型) => (handler类, 发表评论的方法名)
+NOTE_TARGETS = {
+    ('gitlab', 'merge_request'): (MergeRequestHandler, 'add_merge_request_notes'),
+    ('gitlab', 'push'): (PushHandler, 'add_push_notes'),
+    ('github', 'pull_request'): (GithubPullRequestHandler, 'add_pull_request_notes'),
+    ('github', 'push'): (GithubPushHandler, 'add_push_notes'),
+    ('gitea', 'pull_request'): (GiteaPullRequestHandler, 'add_pull_request_notes'),
+    ('gitea', 'push'): (GiteaPushHandler, 'add_push_notes'),
+}
+
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+def post_note(provider: str, event_type: str, webhook_data: dict, token: str, url: str, body: str) -> bool:
+    """
+    根据webhook数据重建handler并发表评论，返回是否成功
+    """
+    handler_class, method = NOTE_TARGETS[(provider, event_type)]
+    handler = handler_class(webhook_data, token, url)
+    return bool(getattr(handler, method)(body))
+
+
+class NoteOutbox:
+    """
+    持久化的评论发件箱：review 结果先写入 SQLite，由独立的线程池异步发表到 Git 平台，
+    失败时按指数退避重试，review worker 无需等待 Git 平台响应。
+    发件箱中不保存访问令牌，只保存平台名引用，发送时从环境变量解析；发送成功后清除webhook数据。
+    """
+
+    def __init__(self, db_file: str = None):
+        self.db_file = db_file or os.getenv('NOTE_OUTBOX_DB_FILE', 'data/outbox.db')
+        self.max_attempts = int(os.getenv('NOTE_OUTBOX_MAX_ATTEMPTS', 8))
+        self.backoff = float(os.getenv('NOTE_OUTBOX_BACKOFF', 5))
+        self.max_backoff = float(os.getenv('NOTE_OUTBOX_MAX_BACKOFF', 600))
+        # 发送中的记录超过租约时间未完成(进程退出等)，重新发送
+        self.lease = float(os.getenv('NOTE_OUTBOX_LEASE', 120))
+        self._initialized = False
+
+    @property
+    def enabled(self) -> bool:
+        return os.getenv('NOTE_OUTBOX_ENABLED', '0') == '1'
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        if not self._initialized:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS note_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    provider TEXT,
+                    event_type TEXT,
+                    webhook_data TEXT,
+                    token TEXT,
+                    url TEXT,
+                    body TEXT,
+                    status TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at REAL,
+                    last_error TEXT DEFAULT '',
+                    created_at REAL,
+                    updated_at REAL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_note_outbox_status ON note_outbox (status, next_attempt_at)')
+            self._initialized = True
+        return conn
+
+    def deliver(self, provider: str, event_type: str, webhook_data: dict, token: str, url: str, body: str):
+        """
+        发表 review 评论：开启 NOTE_OUTBOX_ENABLED 时写入发件箱后立即返回，否则同步发表，
+        发表失败时抛出异常，由任务台账重试整个任务
+        """
+        if not self.enabled:
+            if not post_note(provider, event_type, webhook_data, token, url, body):
+                raise RuntimeError(f"Failed to post review note to {provider} {event_type}: provider rejected the note")
+            return
+        note_id = self.enqueue(provider, event_type, webhook_data, token, url, body)
+        logger.info(f"Review note queued in outbox: id={note_id}, {provider} {event_type}")
+
+    def enqueue(self, provider: str, event_type: str, webhook_data: dict, token: str, url: str, body: str) -> int:
+        if (provider, event_type) not in NOTE_TARGETS:
+            raise ValueError(f"Unsupported note target: {provider} {event_type}")
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''
+                INSERT INTO note_outbox (provider, event_type, webhook_data, token, url, body, status,
+                                         next_attempt_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (provider, event_type, json.dumps(webhook_data), token_ref(provider), url, body, STATUS_PENDING, now, now,
+                  now))
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def claim_due(self, limit: int) -> list:
+        """
+        领取到期待发送的记录，标记为发送中并设置租约
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('''
+                SELECT id, provider, event_type, webhook_data, token, url, body, attempts FROM note_outbox
+                WHERE status IN (?, ?) AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?
+            ''', (STATUS_PENDING, STATUS_SENDING, now, limit)).fetchall()
+            for row in rows:
+                conn.execute('UPDATE note_outbox SET status = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?',
+                             (STATUS_SENDING, now + self.lease, now, row[0]))
+            conn.execute('COMMIT')
+        except sqlite3.DatabaseError:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return [{'id': row[0], 'provider': row[1], 'event_type': row[2], 'webhook_data': json.loads(row[3]),
+                 'token': row[4], 'url': row[5], 'body': row[6], 'attempts': row[7]} for row in rows]
+
+    def mark_sent(self, note_id: int):
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE note_outbox SET status = ?, attempts = attempts + 1, last_error = ?, webhook_data = ?, '
+                         'token = ?, updated_at = ? WHERE id = ?', (STATUS_SENT, '', '{}', '', time.time(), note_id))
+        finally:
+            conn.close()
+
+    def mark_failed(self, note_id: int, attempts: int, error: str):
+        """
+        记录一次发送失败，未超过最大次数时按指数退避安排重试
+        """
+        now = time.time()
+        attempts += 1
+        if attempts >= self.max_attempts:
+            status, next_attempt_at = STATUS_FAILED, now
+            logger.error(f"Review note {note_id} failed after {attempts} attempts, giving up: {error}")
+        else:
+            status = STATUS_PENDING
+            next_attempt_at = now + min(self.backoff * (2 ** (attempts - 1)), self.max_backoff)
+            logger.warn(f"Review note {note_id} failed (attempt {attempts}/{self.max_attempts}), "
+                        f"retrying in {next_attempt_at - now:.0f}s: {error}")
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE note_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, '
+                         'updated_at = ? WHERE id = ?', (status, attempts, next_attempt_at, error[:1000], now, note_id))
+            if status == STATUS_FAILED:
+                conn.execute("UPDATE note_outbox SET token = '' WHERE id = ?", (note_id,))
+        finally:
+            conn.close()
+
+    def purge_sent(self, older_than: float):
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM note_outbox WHERE status = ? AND updated_at < ?',
+                         (STATUS_SENT, time.time() - older_than))
+        finally:
+            conn.close()
+
+    def send(self, note: dict) -> bool:
+        try:
+            ok = post_note(note['provider'], note['event_type'], note['webhook_data'], resolve_token(note['token']),
+                           note['url'], note['body'])
+            error = '' if ok else 'provider rejected the note'
+        except Exception as e:
+            ok, error = False, str(e)
+        if ok:
+            self.mark_sent(note['id'])
+        else:
+            self.mark_failed(note['id'], note['attempts'], error)
+        return ok
+
+
+class NoteOutboxDispatcher:
+    """
+    后台线程轮询发件箱，将到期的评论交给固定大小的线程池发送
+    """
+
+    def __init__(self, outbox: NoteOutbox, workers: int = None, poll_interval: float = None):
+        self.outbox = outbox
+        self.workers = workers or int(os.getenv('NOTE_OUTBOX_WORKERS', 2))
+        self.poll_interval = poll_interval or float(os.getenv('NOTE_OUTBOX_POLL_INTERVAL', 1))
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_purge = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        logger.info(f"Note outbox dispatcher started with {self.workers} workers.")
+        self._thread = threading.Thread(target=self._run, name='note-outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def dispatch_once(self, executor: ThreadPoolExecutor) -> int:
+        notes = self.outbox.claim_due(self.workers)
+        # 等待本批发送完成再领取下一批，同时在途的请求不超过线程数
+        list(executor.map(self.outbox.send, notes))
+        return len(notes)
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='note-outbox') as executor:
+            while not self._stop.is_set():
+                try:
+                    if not self.dispatch_once(executor):
+                        self._stop.wait(self.poll_interval)
+                    if time.time() - self._last_purge > 3600:
+                        self._last_purge = time.time()
+                        self.outbox.purge_sent(older_than=7 * 24 * 3600)
+                except Exception as e:
+                    logger.error(f"Note outbox dispatcher error: {e}")
+                    self._stop.wait(self.poll_interval)
+
+
+note_outbox = NoteOutbox()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import hashlib
+import hmac
+from unittest import TestCase, main
+
+from biz.service.admission_service import AdmissionController, verify_signature
+
+
+# @Describe:
+class TestAdmissionController(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.stats = {'depth': 0, 'oldest_age': 0.0}
+        self.controller = AdmissionController(stats_loader=lambda: dict(self.stats))
+
+    def test_verify_signature(self):
+        """测试GitLab令牌和GitHub请求体签名校验"""
+        body = b'{"action": "opened"}'
+        signature = 'sha256=' + hmac.new(b'secret', body, hashlib.sha256).hexdigest()
+        self.assertTrue(verify_signature('github', 'secret', {'X-Hub-Signature-256': signature}, body))
+        self.assertFalse(verify_signature('github', 'secret', {'X-Hub-Signature-256': signature}, body + b' '))
+        self.assertTrue(verify_signature('gitlab', 'secret', {'X-Gitlab-Token': 'secret'}, body))
+        self.assertFalse(verify_signature('gitlab', 'secret', {}, body))
+
+    def test_rate_limit_per_source(self):
+        """测试按来源限流，超出突发数后返回429和等待时间"""
+        self.controller.rate, self.controller.burst = 1, 2
+        self.assertIsNone(self.controller.check_rate('10.0.0.1'))
+        self.assertIsNone(self.controller.check_rate('10.0.0.1'))
+        rejection = self.controller.check_rate('10.0.0.1')
+        self.assertEqual(rejection.status, 429)
+        self.assertGreater(rejection.retry_after, 0)
+        self.assertIsNone(self.controller.check_rate('10.0.0.2'))
+
+    def test_shed_push_before_merge_request(self):
+        """测试队列积压时先丢弃push，积压更严重时再丢弃MR"""
+        self.controller.shed_push_depth, self.controller.shed_all_depth = 10, 50
+        self.stats['depth'] = 20
+        self.assertEqual(self.controller.check_queue('push').status, 429)
+        self.assertIsNone(self.controller.check_queue('pull_request'))
+
+        self.stats['depth'] = 60
+        self.controller._stats_at = 0
+        rejection = self.controller.check_queue('pull_request')
+        self.assertEqual((rejection.status, rejection.retry_after), (429, self.controller.retry_after))
+
+
+if __name__ == '__main__':
+    main()
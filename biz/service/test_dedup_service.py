@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import os
+import tempfile
+from unittest import TestCase, main
+
+from biz.service.dedup_service import WebhookDeduplicator
+from biz.utils.kv_store import SqliteKVStore
+
+
+# @Describe:
+class TestWebhookDeduplicator(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dedup = WebhookDeduplicator(SqliteKVStore(os.path.join(self.tmp_dir.name, 'kv.db')), ttl=60)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_duplicate_delivery_id(self):
+        """测试相同投递ID的重试被丢弃"""
+        headers = {'X-Gitlab-Event-UUID': 'uuid-1'}
+        self.assertIsNotNone(self.dedup.check_and_mark(headers, b'{"a": 1}'))
+        self.assertIsNone(self.dedup.check_and_mark(headers, b'{"a": 1, "retry": true}'))
+
+    def test_duplicate_payload_with_different_delivery_id(self):
+        """测试群组和项目级webhook投递的相同请求体被丢弃"""
+        self.assertIsNotNone(self.dedup.check_and_mark({'X-GitHub-Delivery': 'd-1'}, b'{"a": 1}'))
+        self.assertIsNone(self.dedup.check_and_mark({'X-GitHub-Delivery': 'd-2'}, b'{"a": 1}'))
+        self.assertIsNotNone(self.dedup.check_and_mark({'X-GitHub-Delivery': 'd-3'}, b'{"a": 2}'))
+
+    def test_release_allows_retry(self):
+        """测试入队失败释放记录后，重试可以再次入队"""
+        headers = {'X-Gitea-Delivery': 'g-1'}
+        keys = self.dedup.check_and_mark(headers, b'{}')
+        self.dedup.release(keys)
+        self.assertIsNotNone(self.dedup.check_and_mark(headers, b'{}'))
+
+
+if __name__ == '__main__':
+    main()
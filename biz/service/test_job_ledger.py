@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import json
+import os
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from biz.git_provider.manager import token_ref
+from biz.queue.deferral import JobDeferred
+from biz.service.job_ledger import JobLedger, job_stage, record_job_error
+
+calls = []
+
+
+def review_ok(webhook_data, token, url, url_slug):
+    calls.append(token)
+    with job_stage('fetch'):
+        pass
+    with job_stage('llm'):
+        pass
+
+
+def review_notify_fails(webhook_data, token, url, url_slug):
+    calls.append('notify')
+    with job_stage('write_back'):
+        pass
+    with job_stage('notify'):
+        record_job_error(ConnectionError('im unavailable'))
+
+
+def review_write_back_fails(webhook_data, token, url, url_slug):
+    calls.append('write_back')
+    try:
+        with job_stage('llm'):
+            pass
+        with job_stage('write_back'):
+            raise ConnectionError('provider unavailable')
+    except Exception as e:
+        record_job_error(e)
+
+
+def review_fails(webhook_data, token, url, url_slug):
+    calls.append('fail')
+    try:
+        raise ConnectionError('provider unavailable')
+    except Exception as e:
+        record_job_error(e)
+
+
+def review_deferred_once(webhook_data, token, url, url_slug):
+    calls.append('deferred' if not calls else 'run')
+    if calls == ['deferred']:
+        raise JobDeferred(5, 'lock held')
+
+
+# @Describe:
+class TestJobLedger(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.ledger = JobLedger(os.path.join(self.tmp_dir.name, 'jobs.db'))
+        self.ledger.max_attempts = 2
+        self.ledger.backoff = 0
+        self.payload = json.dumps({'project': {'id': 1}, 'ref': 'refs/heads/main'}).encode('utf-8')
+        calls.clear()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_success_records_stages(self):
+        """测试成功的任务记录各阶段耗时，并清除请求体和令牌"""
+        self.ledger.run(review_ok, 'gitlab', 'push', self.payload, 'token', 'url', 'slug')
+        job, = self.ledger.list_jobs()
+        self.assertEqual((job['status'], job['attempts'], job['project'], job['payload'], job['token']),
+                         ('succeeded', 1, '1', '', ''))
+        self.assertEqual(set(job['stages']), {'fetch', 'llm'})
+
+    def test_failure_moves_to_dead_letters(self):
+        """测试失败的任务只执行一次，重新入队后再次失败进入死信，保留请求体用于重放，重放同一请求体记录为同一任务"""
+        self.ledger.run(review_fails, 'gitlab', 'push', self.payload, 'token', 'url', 'slug')
+        self.assertEqual(calls, ['fail'])
+        job, = self.ledger.list_jobs(status='failed')
+        self.assertEqual((job['attempts'], job['payload'], job['token'], job['error']),
+                         (1, self.payload.decode('utf-8'), 'token', 'provider unavailable'))
+        self.assertTrue(job['function'].endswith('test_job_ledger.review_fails'))
+
+        enqueued = []
+        self.assertEqual(self.ledger.retry_due(enqueued.append), 1)
+        self.assertEqual(self.ledger.retry_due(enqueued.append), 0)
+        self.assertEqual([queued['id'] for queued in enqueued], [job['id']])
+        self.assertEqual(self.ledger.list_jobs()[0]['status'], 'queued')
+
+        self.ledger.run(review_fails, 'gitlab', 'push', job['payload'], 'token', 'url', 'slug')
+        job, = self.ledger.list_jobs()
+        self.assertEqual((job['status'], job['attempts']), ('dead', 2))
+        self.assertEqual(self.ledger.retry_due(enqueued.append), 0)
+
+    def test_retry_waits_for_backoff(self):
+        """测试退避时间未到的失败任务不重新入队，入队失败时恢复为failed"""
+        self.ledger.backoff = 60
+        self.ledger.run(review_fails, 'gitlab', 'push', self.payload, 'token', 'url', 'slug')
+        self.assertEqual(self.ledger.retry_due(lambda job: None), 0)
+
+        self.ledger.backoff = 0
+
+        def queue_full(job):
+            raise RuntimeError('queue full')
+
+        self.assertEqual(self.ledger.retry_due(queue_full), 0)
+        self.assertEqual(self.ledger.list_jobs()[0]['status'], 'failed')
+
+    def test_deferred_not_counted(self):
+        """测试推迟的任务重新抛出JobDeferred，标记为queued且不计入执行次数，不由台账重新入队"""
+        with self.assertRaises(JobDeferred):
+            self.ledger.run(review_deferred_once, 'gitlab', 'push', self.payload, 'token', 'url', 'slug')
+        job, = self.ledger.list_jobs()
+        self.assertEqual((job['status'], job['attempts']), ('queued', 0))
+        self.assertEqual(self.ledger.retry_due(lambda job: calls.append('retry')), 0)
+
+        self.ledger.run(review_deferred_once, 'gitlab', 'push', self.payload, 'token', 'url', 'slug')
+        self.assertEqual(calls, ['deferred', 'run'])
+        job, = self.ledger.list_jobs()
+        self.assertEqual((job['status'], job['attempts']), ('succeeded', 1))
+
+    def test_failure_after_write_back_not_retried(self):
+        """测试发表评论后失败的任务记录为partial，不再重新执行"""
+        self.ledger.run(review_notify_fails, 'gitlab', 'merge_request', self.payload, 'token', 'url', 'slug')
+        self.assertEqual(calls, ['notify'])
+        job, = self.ledger.list_jobs()
+        self.assertEqual((job['status'], job['error']), ('partial', 'im unavailable'))
+        self.assertEqual(self.ledger.retry_due(lambda job: calls.append('retry')), 0)
+        self.assertEqual(calls, ['notify'])
+
+    def test_write_back_failure_retried(self):
+        """测试发表评论本身失败的任务评论没有发出，记录为failed等待重试"""
+        self.ledger.run(review_write_back_fails, 'gitlab', 'merge_request', self.payload, 'token', 'url', 'slug')
+        job, = self.ledger.list_jobs()
+        self.assertEqual((job['status'], job['error']), ('failed', 'provider unavailable'))
+        self.assertEqual(self.ledger.retry_due(lambda job: calls.append('retry')), 1)
+        self.assertEqual(calls, ['write_back', 'retry'])
+
+    def test_token_ref_resolved_at_run(self):
+        """测试台账中只保存令牌引用，处理函数收到从环境变量解析的访问令牌"""
+        with patch.dict(os.environ, {'GITLAB_ACCESS_TOKEN': 'env-token'}):
+            self.ledger.run(review_fails, 'gitlab', 'push', self.payload, token_ref('gitlab'), 'url', 'slug')
+            self.ledger.run(review_ok, 'gitlab', 'merge_request', self.payload, token_ref('gitlab'), 'url', 'slug')
+        job, = self.ledger.list_jobs(status='failed')
+        self.assertEqual(job['token'], token_ref('gitlab'))
+        self.assertEqual(calls[-1], 'env-token')
+
+
+if __name__ == '__main__':
+    main()
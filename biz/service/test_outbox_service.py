@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from biz.service.outbox_service import NoteOutbox, NoteOutboxDispatcher, STATUS_FAILED
+
+
+# @Describe:
+class TestNoteOutbox(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.outbox = NoteOutbox(db_file=os.path.join(self.tmp_dir.name, 'outbox.db'))
+        self.outbox.backoff = 0
+        self.dispatcher = NoteOutboxDispatcher(self.outbox, workers=2)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.tmp_dir.cleanup()
+
+    def status(self, note_id: int):
+        conn = self.outbox._connect()
+        try:
+            return conn.execute('SELECT status, attempts FROM note_outbox WHERE id = ?', (note_id,)).fetchone()
+        finally:
+            conn.close()
+
+    def test_retry_until_sent(self):
+        """测试发送失败后重试，成功后不再发送"""
+        note_id = self.outbox.enqueue('gitlab', 'merge_request', {'object_kind': 'merge_request'}, 't',
+                                      'https://gitlab.example.com', 'LGTM')
+        with patch('biz.service.outbox_service.post_note', side_effect=[ConnectionError('down'), True]) as post:
+            self.assertEqual(self.dispatcher.dispatch_once(self.executor), 1)
+            self.assertEqual(self.status(note_id), ('pending', 1))
+            self.assertEqual(self.dispatcher.dispatch_once(self.executor), 1)
+            self.assertEqual(self.dispatcher.dispatch_once(self.executor), 0)
+
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(post.call_args.args[5], 'LGTM')
+        self.assertEqual(self.status(note_id), ('sent', 2))
+
+    def test_token_not_stored(self):
+        """测试发件箱只保存令牌引用，发送时从环境变量解析，发送成功后清除webhook数据"""
+        note_id = self.outbox.enqueue('gitlab', 'merge_request', {'object_kind': 'merge_request'}, 'secret',
+                                      'https://gitlab.example.com', 'LGTM')
+        conn = self.outbox._connect()
+        try:
+            stored = conn.execute('SELECT token FROM note_outbox WHERE id = ?', (note_id,)).fetchone()[0]
+        finally:
+            conn.close()
+        self.assertNotIn('secret', stored)
+
+        with patch.dict('os.environ', {'GITLAB_ACCESS_TOKEN': 'env-token'}), \
+                patch('biz.service.outbox_service.post_note', return_value=True) as post:
+            self.dispatcher.dispatch_once(self.executor)
+        self.assertEqual(post.call_args.args[3], 'env-token')
+        conn = self.outbox._connect()
+        try:
+            row = conn.execute('SELECT webhook_data, token FROM note_outbox WHERE id = ?', (note_id,)).fetchone()
+        finally:
+            conn.close()
+        self.assertEqual(row, ('{}', ''))
+
+    def test_give_up_after_max_attempts(self):
+        """测试超过最大重试次数后标记为失败"""
+        self.outbox.max_attempts = 2
+        note_id = self.outbox.enqueue('github', 'pull_request', {}, 't', 'https://github.com', 'LGTM')
+        with patch('biz.service.outbox_service.post_note', return_value=False):
+            self.dispatcher.dispatch_once(self.executor)
+            self.dispatcher.dispatch_once(self.executor)
+        self.assertEqual(self.status(note_id), (STATUS_FAILED, 2))
+
+    def test_deliver_disabled_posts_directly(self):
+        """测试未开启发件箱时同步发表，平台拒绝时抛出异常由任务台账重试"""
+        with patch.dict('os.environ', {'NOTE_OUTBOX_ENABLED': '0'}), \
+                patch('biz.service.outbox_service.post_note') as post:
+            self.outbox.deliver('gitea', 'push', {}, 't', 'https://gitea.com', 'LGTM')
+            post.assert_called_once()
+            self.assertEqual(self.outbox.claim_due(10), [])
+            post.return_value = False
+            with self.assertRaises(RuntimeError):
+                self.outbox.deliver('gitea', 'push', {}, 't', 'https://gitea.com', 'LGTM')
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,9 @@ from biz.llm.factory import Factory
 from biz.utils.log import logger
 from biz.utils.token_util import count_tokens, truncate_text_by_tokens
 
+# (prompt_key, style, 文件修改时间) => 渲染后的提示词
+_prompt_cache: Dict[tuple, Dict[str, Any]] = {}
+
 
 class BaseReviewer(abc.ABC):
     """代码审查基类"""
@@ -19,28 +22,36 @@ class BaseReviewer(abc.ABC):
         self.prompts = self._load_prompts(prompt_key, os.getenv("REVIEW_STYLE", "professional"))
 
     def _load_prompts(self, prompt_key: str, style="professional") -> Dict[str, Any]:
-        """加载提示词配置"""
+        """加载提示词配置，按文件修改时间缓存渲染结果，常驻worker中修改配置后仍会重新加载"""
         prompt_templates_file = "conf/prompt_templates.yml"
         try:
-            # 在打开 YAML 文件时显式指定编码为 UTF-8，避免使用系统默认的 GBK 编码。
-            with open(prompt_templates_file, "r", encoding="utf-8") as file:
-                prompts = yaml.safe_load(file).get(prompt_key, {})
-
-                # 使用Jinja2渲染模板
-                def render_template(template_str: str) -> str:
-                    return Template(template_str).render(style=style)
-
-                system_prompt = render_template(prompts["system_prompt"])
-                user_prompt = render_template(prompts["user_prompt"])
-
-                return {
-                    "system_message": {"role": "system", "content": system_prompt},
-                    "user_message": {"role": "user", "content": user_prompt},
-                }
-        except (FileNotFoundError, KeyError, yaml.YAMLError) as e:
+            cache_key = (prompt_key, style, os.path.getmtime(prompt_templates_file))
+            if cache_key not in _prompt_cache:
+                _prompt_cache[cache_key] = self._render_prompts(prompt_templates_file, prompt_key, style)
+            prompts = _prompt_cache[cache_key]
+            return {name: dict(message) for name, message in prompts.items()}
+        except (FileNotFoundError, OSError, KeyError, yaml.YAMLError) as e:
             logger.error(f"加载提示词配置失败: {e}")
             raise Exception(f"提示词配置加载失败: {e}")
 
+    @staticmethod
+    def _render_prompts(prompt_templates_file: str, prompt_key: str, style: str) -> Dict[str, Any]:
+        # 在打开 YAML 文件时显式指定编码为 UTF-8，避免使用系统默认的 GBK 编码。
+        with open(prompt_templates_file, "r", encoding="utf-8") as file:
+            prompts = yaml.safe_load(file).get(prompt_key, {})
+
+        # 使用Jinja2渲染模板
+        def render_template(template_str: str) -> str:
+            return Template(template_str).render(style=style)
+
+        system_prompt = render_template(prompts["system_prompt"])
+        user_prompt = render_template(prompts["user_prompt"])
+
+        return {
+            "system_message": {"role": "system", "content": system_prompt},
+            "user_message": {"role": "user", "content": user_prompt},
+        }
+
     def call_llm(self, messages: List[Dict[str, Any]]) -> str:
         """调用 LLM 进行代码审核"""
         logger.info(f"向 AI 发送代码 Review 请求, messages: {messages}")
@@ -0,0 +1,198 @@
+import abc
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from biz.utils.log import logger
+
+
+class KVStore(abc.ABC):
+    """
+    跨进程共享的带过期时间的键值存储，值以JSON序列化保存。
+    单机部署使用 SQLite 文件，使用 Redis 队列(QUEUE_DRIVER=rq)时使用 Redis，以便多个节点共享。
+    """
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Any, ttl: float = None):
+        pass
+
+    @abc.abstractmethod
+    def add(self, key: str, value: Any, ttl: float = None) -> bool:
+        """仅当key不存在(或已过期)时写入，返回是否写入成功"""
+        pass
+
+    @abc.abstractmethod
+    def compare_and_set(self, key: str, expected: Any, value: Any, ttl: float = None) -> bool:
+        """仅当key当前的值等于expected时原子地写入，返回是否写入成功"""
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abc.abstractmethod
+    def compare_and_delete(self, key: str, expected: Any) -> bool:
+        """仅当key当前的值等于expected时原子地删除，返回是否删除成功"""
+        pass
+
+    @abc.abstractmethod
+    def delete_prefix(self, prefix: str):
+        pass
+
+
+class SqliteKVStore(KVStore):
+    def __init__(self, db_file: str = "data/kv.db"):
+        self.db_file = db_file
+        self._local = threading.local()
+        self._init_db()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite连接不能跨线程、跨fork使用，每个线程各自持有一个连接，fork后的子进程重新连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_db(self):
+        self._conn().execute('''
+            CREATE TABLE IF NOT EXISTS kv_store (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                expires_at REAL
+            )
+        ''')
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._conn().execute('SELECT value, expires_at FROM kv_store WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            self._conn().execute('DELETE FROM kv_store WHERE key = ? AND expires_at <= ?', (key, time.time()))
+            return None
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        expires_at = time.time() + ttl if ttl else None
+        self._conn().execute('INSERT OR REPLACE INTO kv_store (key, value, expires_at) VALUES (?, ?, ?)',
+                             (key, json.dumps(value), expires_at))
+
+    def add(self, key: str, value: Any, ttl: float = None) -> bool:
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM kv_store WHERE key = ? AND expires_at <= ?', (key, now))
+            cursor = conn.execute('INSERT OR IGNORE INTO kv_store (key, value, expires_at) VALUES (?, ?, ?)',
+                                  (key, json.dumps(value), expires_at))
+            conn.execute('COMMIT')
+            return cursor.rowcount == 1
+        except sqlite3.DatabaseError:
+            conn.execute('ROLLBACK')
+            raise
+
+    def compare_and_set(self, key: str, expected: Any, value: Any, ttl: float = None) -> bool:
+        # 比较和写入在同一条UPDATE中完成，其他进程无法在两者之间写入
+        now = time.time()
+        cursor = self._conn().execute(
+            'UPDATE kv_store SET value = ?, expires_at = ? WHERE key = ? AND value = ? '
+            'AND (expires_at IS NULL OR expires_at > ?)',
+            (json.dumps(value), now + ttl if ttl else None, key, json.dumps(expected), now))
+        return cursor.rowcount == 1
+
+    def delete(self, key: str):
+        self._conn().execute('DELETE FROM kv_store WHERE key = ?', (key,))
+
+    def compare_and_delete(self, key: str, expected: Any) -> bool:
+        cursor = self._conn().execute('DELETE FROM kv_store WHERE key = ? AND value = ?', (key, json.dumps(expected)))
+        return cursor.rowcount == 1
+
+    def delete_prefix(self, prefix: str):
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        self._conn().execute("DELETE FROM kv_store WHERE key LIKE ? ESCAPE '\\'", (escaped + '%',))
+
+    def purge_expired(self):
+        self._conn().execute('DELETE FROM kv_store WHERE expires_at <= ?', (time.time(),))
+
+
+class RedisKVStore(KVStore):
+    # 比较和写入/删除在一个Lua脚本中原子执行
+    COMPARE_AND_SET = """
+        if redis.call('get', KEYS[1]) ~= ARGV[1] then return 0 end
+        if tonumber(ARGV[3]) > 0 then redis.call('set', KEYS[1], ARGV[2], 'PX', ARGV[3])
+        else redis.call('set', KEYS[1], ARGV[2]) end
+        return 1
+    """
+    COMPARE_AND_DELETE = """
+        if redis.call('get', KEYS[1]) ~= ARGV[1] then return 0 end
+        return redis.call('del', KEYS[1])
+    """
+
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+        self._compare_and_set = redis_conn.register_script(self.COMPARE_AND_SET)
+        self._compare_and_delete = redis_conn.register_script(self.COMPARE_AND_DELETE)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.redis.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        self.redis.set(key, json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    def add(self, key: str, value: Any, ttl: float = None) -> bool:
+        return bool(self.redis.set(key, json.dumps(value), px=int(ttl * 1000) if ttl else None, nx=True))
+
+    def compare_and_set(self, key: str, expected: Any, value: Any, ttl: float = None) -> bool:
+        return bool(self._compare_and_set(keys=[key], args=[json.dumps(expected), json.dumps(value),
+                                                             int(ttl * 1000) if ttl else 0]))
+
+    def delete(self, key: str):
+        self.redis.delete(key)
+
+    def compare_and_delete(self, key: str, expected: Any) -> bool:
+        return bool(self._compare_and_delete(keys=[key], args=[json.dumps(expected)]))
+
+    def delete_prefix(self, prefix: str):
+        keys = list(self.redis.scan_iter(match=f"{prefix}*"))
+        if keys:
+            self.redis.delete(*keys)
+
+
+_kv_store = None
+_kv_store_lock = threading.Lock()
+
+
+def get_redis_connection():
+    from redis import Redis
+    return Redis(os.getenv('REDIS_HOST', '127.0.0.1'), os.getenv('REDIS_PORT', 6379))
+
+
+def get_kv_store() -> KVStore:
+    """
+    获取进程内共享的KVStore，驱动由 KV_STORE_DRIVER(sqlite, redis) 决定，
+    未配置时 QUEUE_DRIVER=rq 使用 Redis，否则使用 SQLite。
+    """
+    global _kv_store
+    if _kv_store is None:
+        with _kv_store_lock:
+            if _kv_store is None:
+                default_driver = 'redis' if os.getenv('QUEUE_DRIVER', 'async') == 'rq' else 'sqlite'
+                driver = os.getenv('KV_STORE_DRIVER', default_driver)
+                logger.info(f"KV store driver: {driver}")
+                if driver == 'redis':
+                    _kv_store = RedisKVStore(get_redis_connection())
+                else:
+                    _kv_store = SqliteKVStore(os.getenv('KV_STORE_DB_FILE', 'data/kv.db'))
+    return _kv_store
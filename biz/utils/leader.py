@@ -0,0 +1,89 @@
+import os
+import socket
+import threading
+import uuid
+from typing import Callable, Optional
+
+from biz.utils.kv_store import KVStore, get_kv_store
+from biz.utils.log import logger
+
+
+class LeaderElector:
+    """
+    基于KVStore租约的主节点选举：多个进程(或节点)中只有持有租约的一个执行定时任务等单例工作。
+    单机部署使用 SQLite 文件(data/kv.db)，QUEUE_DRIVER=rq 或 KV_STORE_DRIVER=redis 时使用 Redis，多个节点间选举。
+    持有者定期续约，进程退出或续约失败后租约过期，由其他进程接替。
+    """
+
+    def __init__(self, name: str, on_elected: Callable[[], None], on_lost: Callable[[], None] = None,
+                 store: KVStore = None, ttl: float = None, renew_interval: float = None):
+        self.name = name
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self._store = store
+        self.ttl = ttl or float(os.getenv('LEADER_LOCK_TTL', 30))
+        self.renew_interval = renew_interval or self.ttl / 3
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def store(self) -> KVStore:
+        if self._store is None:
+            self._store = get_kv_store()
+        return self._store
+
+    @property
+    def key(self) -> str:
+        return f"leader:{self.name}"
+
+    def _try_acquire(self) -> bool:
+        if self.is_leader:
+            # 续约：只有租约仍属于自己时才延长，比较和写入原子完成，不会覆盖其他进程刚获得的租约
+            return self.store.compare_and_set(self.key, self.owner, self.owner, ttl=self.ttl)
+        return self.store.add(self.key, self.owner, ttl=self.ttl)
+
+    def run_once(self):
+        try:
+            acquired = self._try_acquire()
+        except Exception as e:
+            logger.warn(f"Leader election for {self.name} failed: {e}")
+            acquired = False
+        if acquired and not self.is_leader:
+            self.is_leader = True
+            logger.info(f"Elected as {self.name} leader: {self.owner}")
+            self.on_elected()
+        elif not acquired and self.is_leader:
+            self.is_leader = False
+            logger.warn(f"Lost {self.name} leadership: {self.owner}")
+            if self.on_lost:
+                self.on_lost()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=f'leader-{self.name}', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.renew_interval)
+
+    def stop(self):
+        """
+        停止选举并释放租约，使其他进程可以立即接替
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.renew_interval + 1)
+            self._thread = None
+        if self.is_leader:
+            self.is_leader = False
+            if self.on_lost:
+                self.on_lost()
+            try:
+                self.store.compare_and_delete(self.key, self.owner)
+            except Exception as e:
+                logger.warn(f"Failed to release {self.name} leadership: {e}")
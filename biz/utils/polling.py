@@ -0,0 +1,49 @@
+import os
+import time
+from typing import Callable, TypeVar
+
+from biz.utils.log import logger
+
+T = TypeVar('T')
+
+
+def ready_or_failed(result) -> bool:
+    """
+    变更接口的就绪判断：请求失败(None)时不再重试，返回非空数据时就绪，空数据表示平台尚未生成diff，继续轮询
+    """
+    return result is None or len(result) > 0
+
+
+def poll_until(fetch: Callable[[], T], is_ready: Callable[[T], bool], description: str = '',
+               initial_delay: float = None, max_wait: float = None, backoff_factor: float = 2.0,
+               max_delay: float = 8.0) -> T:
+    """
+    轮询直到数据就绪，重试间隔按指数退避增长，首个间隔较短，总等待时间不超过 max_wait。
+    :param fetch: 获取数据的函数
+    :param is_ready: 判断数据是否就绪的函数
+    :param description: 日志中使用的描述信息
+    :param initial_delay: 首次重试间隔（秒），默认读取 CHANGES_READY_INITIAL_DELAY
+    :param max_wait: 总等待时间上限（秒），默认读取 CHANGES_READY_MAX_WAIT
+    :param backoff_factor: 退避倍数
+    :param max_delay: 单次重试间隔上限（秒）
+    :return: 最后一次获取到的数据（可能仍未就绪）
+    """
+    delay = initial_delay if initial_delay is not None else float(os.getenv('CHANGES_READY_INITIAL_DELAY', 1))
+    max_wait = max_wait if max_wait is not None else float(os.getenv('CHANGES_READY_MAX_WAIT', 30))
+
+    waited = 0.0
+    attempt = 1
+    while True:
+        result = fetch()
+        if is_ready(result):
+            return result
+        if waited >= max_wait:
+            logger.warning(f"{description} still not ready after waiting {waited:.1f}s ({attempt} attempts).")
+            return result
+
+        sleep_time = min(delay, max_delay, max_wait - waited)
+        logger.info(f"{description} not ready, retrying in {sleep_time:.1f} seconds... (attempt {attempt})")
+        time.sleep(sleep_time)
+        waited += sleep_time
+        delay *= backoff_factor
+        attempt += 1
@@ -1,25 +1,128 @@
+import json
 import os
+import time
+from datetime import timezone
 from multiprocessing import Process
 
 from redis import Redis
-from rq import Queue
 
+from biz.queue.deferral import run_deferrable
+from biz.queue.fair import FairQueue, lane_queue_name, split_lane
+from biz.queue.pool import WorkerPool
+from biz.queue.sqlite_queue import SqliteJobQueue, SqliteQueueConsumer
 from biz.utils.log import logger
 
 queue_driver = os.getenv('QUEUE_DRIVER', 'async')
 
 if queue_driver == 'rq':
     queues = {}
+elif queue_driver == 'sqlite':
+    # sqlite模式任务持久化到本地文件，由进程池执行，重启后继续处理未完成的任务
+    worker_pool = WorkerPool()
+    sqlite_job_queue = SqliteJobQueue()
+    sqlite_consumer = SqliteQueueConsumer(sqlite_job_queue, worker_pool)
+else:
+    # async模式默认使用固定大小的预热进程池，ASYNC_WORKERS=0 时每个事件启动一个子进程
+    worker_pool = WorkerPool() if int(os.getenv('ASYNC_WORKERS', 8)) > 0 else None
+    # 每个事件一个子进程时正在运行的子进程及其启动时间
+    processes = []
 
 
-def handle_queue(function: callable, data: any, token: str, url: str, url_slug: str):
+def load_payload(data) -> dict:
+    """
+    webhook入口直接将原始请求体(bytes)入队，避免重复序列化，由worker解析为dict
+    """
+    if isinstance(data, (bytes, bytearray, str)):
+        return json.loads(data)
+    return data
+
+
+def handle_queue(function: callable, data: any, token: str, url: str, url_slug: str, lane: str = 'mr',
+                 project: str = None, delay: float = 0):
+    """
+    rq模式下按 url_slug 和车道(mr, push, report)入队，并登记所属项目，由 FairWorker 按车道优先级和项目公平调度。
+    delay 大于0时任务延迟执行(去抖窗口)；处理函数抛出 JobDeferred 时由各模式的队列推迟后重新投递，
+    每个事件一个子进程时在子进程内等待
+    """
     if queue_driver == 'rq':
-        if url_slug not in queues:
+        name = lane_queue_name(url_slug, lane)
+        if name not in queues:
             logger.info(f'REDIS_HOST: {os.getenv("REDIS_HOST", "127.0.0.1")}，REDIS_PORT: {os.getenv("REDIS_PORT", 6379)}')
-            queues[url_slug] = Queue(url_slug, connection=Redis(os.getenv('REDIS_HOST', '127.0.0.1'),
-                                                                              os.getenv('REDIS_PORT', 6379)))
+            queues[name] = FairQueue(name, connection=_redis_connection())
 
-        queues[url_slug].enqueue(function, data, token, url, url_slug)
+        queues[name].enqueue_for_project(project, function, data, token, url, url_slug, delay=delay)
+    elif queue_driver == 'sqlite':
+        sqlite_job_queue.enqueue(function, data, token, url, url_slug, delay=delay)
+        sqlite_consumer.notify()
+    elif worker_pool is not None:
+        worker_pool.submit_deferrable(function, data, token, url, url_slug, delay=delay)
     else:
-        process = Process(target=function, args=(data, token, url, url_slug))
+        process = Process(target=run_deferrable, args=(function, data, token, url, url_slug), kwargs={'delay': delay})
         process.start()
+        processes.append((process, time.time()))
+
+
+def start_workers():
+    """
+    启动并预热async/sqlite模式的进程池，在API服务启动(多进程模式下每个worker启动)后调用
+    """
+    if queue_driver != 'rq' and worker_pool is not None:
+        worker_pool.start()
+    if queue_driver == 'sqlite':
+        sqlite_consumer.start()
+
+
+def stop_workers(timeout: float = None):
+    """
+    API服务进程退出前调用：async/sqlite模式停止领取新任务，最多等待 timeout 秒让进程池中执行中的任务完成，
+    避免 gunicorn 重启worker时中断review
+    """
+    if queue_driver == 'sqlite':
+        sqlite_consumer.drain(timeout)
+    if queue_driver != 'rq' and worker_pool is not None:
+        worker_pool.drain(timeout)
+
+
+def _redis_connection() -> Redis:
+    return Redis(os.getenv('REDIS_HOST', '127.0.0.1'), os.getenv('REDIS_PORT', 6379))
+
+
+def queue_stats() -> dict:
+    """
+    当前积压的任务数和最早任务的等待时间(秒)：rq模式统计Redis中的所有队列，sqlite模式统计队列文件，async模式统计本进程的进程池或仍在运行的子进程
+    """
+    now = time.time()
+    if queue_driver == 'rq':
+        depth, oldest, lanes = 0, None, {}
+        for queue in FairQueue.all(connection=_redis_connection()):
+            lane = split_lane(queue.name)[1] or 'default'
+            lane_stats = lanes.setdefault(lane, {'depth': 0, 'oldest_age': 0.0, 'dequeued': 0, 'wait_total': 0.0})
+            wait = queue.wait_stats()
+            lane_stats['dequeued'] += wait['dequeued']
+            lane_stats['wait_total'] += wait['avg_wait'] * wait['dequeued']
+            count = queue.count
+            depth += count
+            lane_stats['depth'] += count
+            if not count:
+                continue
+            job_ids = queue.get_job_ids(0, 1)
+            job = queue.fetch_job(job_ids[0]) if job_ids else None
+            if job and job.enqueued_at:
+                enqueued_at = job.enqueued_at.replace(tzinfo=job.enqueued_at.tzinfo or timezone.utc).timestamp()
+                oldest = enqueued_at if oldest is None else min(oldest, enqueued_at)
+                lane_stats['oldest_age'] = max(lane_stats['oldest_age'], now - enqueued_at)
+        # 各车道的积压任务数、最早任务等待时间，以及已取出任务的平均等待时间
+        for lane_stats in lanes.values():
+            wait_total = lane_stats.pop('wait_total')
+            lane_stats['avg_wait'] = wait_total / lane_stats['dequeued'] if lane_stats['dequeued'] else 0.0
+        return {'depth': depth, 'oldest_age': now - oldest if oldest else 0.0, 'lanes': lanes}
+
+    if queue_driver == 'sqlite':
+        stats = sqlite_job_queue.stats()
+        stats['pool'] = worker_pool.stats()
+        return stats
+    if worker_pool is not None:
+        return worker_pool.stats()
+    processes[:] = [(process, started_at) for process, started_at in processes if process.is_alive()]
+    oldest = min((started_at for _, started_at in processes), default=None)
+    return {'depth': len(processes), 'oldest_age': now - oldest if oldest else 0.0}
@@ -0,0 +1,61 @@
+import multiprocessing
+import os
+from typing import Callable
+
+from biz.utils.log import logger
+
+
+def default_workers() -> int:
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def api_processes() -> int:
+    """
+    API服务的进程数：gunicorn模式下每个worker进程各自持有进程池等资源，按进程数分摊全局上限
+    """
+    if os.getenv('API_SERVER', 'flask') != 'gunicorn':
+        return 1
+    return max(1, int(os.getenv('API_WORKERS', default_workers())))
+
+
+def run_gunicorn(app, on_worker_start: Callable[[], None], port: int,
+                 on_worker_exit: Callable[[float], None] = None):
+    """
+    使用 gunicorn 多进程运行 WSGI 应用：主进程预加载应用后 fork 出 worker，
+    后台线程(定时任务、发件箱等)不能在fork前启动，由 on_worker_start 在每个worker启动后调用；
+    worker退出(重启、停止服务)时调用 on_worker_exit(graceful_timeout)，等待worker进程中执行中的任务
+    """
+    from gunicorn.app.base import BaseApplication
+
+    graceful_timeout = int(os.getenv('API_GRACEFUL_TIMEOUT', 30))
+    # async/sqlite模式的review在worker进程的进程池中执行，按请求数重启worker会中断执行中的review，默认不重启
+    default_max_requests = 10000 if os.getenv('QUEUE_DRIVER', 'async') == 'rq' else 0
+    options = {
+        'bind': f"0.0.0.0:{port}",
+        'workers': int(os.getenv('API_WORKERS', default_workers())),
+        'worker_class': 'gthread',
+        'threads': int(os.getenv('API_THREADS', 4)),
+        'timeout': int(os.getenv('API_TIMEOUT', 60)),
+        'graceful_timeout': graceful_timeout,
+        'keepalive': int(os.getenv('API_KEEPALIVE', 5)),
+        # 请求处理一定数量后重启worker，释放可能的内存泄漏
+        'max_requests': int(os.getenv('API_MAX_REQUESTS', default_max_requests)),
+        'max_requests_jitter': int(os.getenv('API_MAX_REQUESTS_JITTER', 1000)),
+        'preload_app': True,
+        'accesslog': None,
+        'errorlog': '-',
+        'post_worker_init': lambda worker: on_worker_start(),
+    }
+    if on_worker_exit is not None:
+        options['worker_exit'] = lambda server, worker: on_worker_exit(graceful_timeout)
+
+    class StandaloneApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    logger.info(f"Starting gunicorn with {options['workers']} workers x {options['threads']} threads on port {port}")
+    StandaloneApplication().run()
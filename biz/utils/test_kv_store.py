@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import os
+import tempfile
+import time
+from unittest import TestCase, main
+
+from biz.git_provider.metadata_cache import ProjectMetadataCache
+from biz.utils.kv_store import SqliteKVStore
+
+
+# @Describe:
+class TestSqliteKVStore(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = SqliteKVStore(os.path.join(self.tmp_dir.name, 'kv.db'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_set_get_with_ttl(self):
+        """测试写入、读取以及过期"""
+        self.store.set('a', {'x': 1})
+        self.store.set('b', [1, 2], ttl=0.05)
+        self.assertEqual(self.store.get('a'), {'x': 1})
+        self.assertEqual(self.store.get('b'), [1, 2])
+        time.sleep(0.1)
+        self.assertIsNone(self.store.get('b'))
+
+    def test_add_only_if_absent(self):
+        """测试仅在不存在时写入"""
+        self.assertTrue(self.store.add('lock', 'owner-1', ttl=0.05))
+        self.assertFalse(self.store.add('lock', 'owner-2', ttl=0.05))
+        time.sleep(0.1)
+        self.assertTrue(self.store.add('lock', 'owner-2', ttl=1))
+        self.assertEqual(self.store.get('lock'), 'owner-2')
+
+    def test_delete_prefix(self):
+        """测试按前缀删除"""
+        self.store.set('p:1:a', 1)
+        self.store.set('p:1:b', 2)
+        self.store.set('p:10:a', 3)
+        self.store.delete_prefix('p:1:')
+        self.assertIsNone(self.store.get('p:1:a'))
+        self.assertIsNone(self.store.get('p:1:b'))
+        self.assertEqual(self.store.get('p:10:a'), 3)
+
+
+class TestProjectMetadataCache(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ProjectMetadataCache(SqliteKVStore(os.path.join(self.tmp_dir.name, 'kv.db')), ttl=60)
+        self.load_count = 0
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _loader(self):
+        self.load_count += 1
+        return ['main', 'release/*']
+
+    def test_get_or_load_until_expired(self):
+        """测试缓存命中，TTL过期后重新加载"""
+        for _ in range(3):
+            self.assertEqual(self.cache.get_or_load('https://gitlab', 1, 'protected_branches', self._loader),
+                             ['main', 'release/*'])
+        self.assertEqual(self.load_count, 1)
+
+        self.cache.ttl = 0.05
+        self.cache.get_or_load('https://gitlab', 3, 'protected_branches', self._loader)
+        time.sleep(0.1)
+        self.cache.get_or_load('https://gitlab', 3, 'protected_branches', self._loader)
+        self.assertEqual(self.load_count, 3)
+
+    def test_invalidate(self):
+        """测试显式失效单个字段或项目的全部元数据，不影响其他项目"""
+        for project in (1, 12):
+            self.cache.get_or_load('https://gitlab', project, 'protected_branches', self._loader)
+            self.cache.get_or_load('https://gitlab', project, 'default_branch', self._loader)
+        self.assertEqual(self.load_count, 4)
+
+        self.cache.invalidate('https://gitlab', 1, 'protected_branches')
+        self.cache.get_or_load('https://gitlab', 1, 'protected_branches', self._loader)
+        self.cache.get_or_load('https://gitlab', 1, 'default_branch', self._loader)
+        self.assertEqual(self.load_count, 5)
+
+        self.cache.invalidate('https://gitlab', 1)
+        for project in (1, 12):
+            self.cache.get_or_load('https://gitlab', project, 'protected_branches', self._loader)
+            self.cache.get_or_load('https://gitlab', project, 'default_branch', self._loader)
+        self.assertEqual(self.load_count, 7)
+
+    def test_failed_load_not_cached(self):
+        """测试加载失败时不写入缓存"""
+        self.assertIsNone(self.cache.get_or_load('https://gitlab', 2, 'protected_branches', lambda: None))
+        self.cache.get_or_load('https://gitlab', 2, 'protected_branches', self._loader)
+        self.assertEqual(self.load_count, 1)
+
+
+if __name__ == '__main__':
+    main()
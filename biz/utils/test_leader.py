@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+import os
+import tempfile
+import time
+from unittest import TestCase, main
+
+from biz.utils.kv_store import SqliteKVStore
+from biz.utils.leader import LeaderElector
+
+
+# @Describe:
+class TestLeaderElector(TestCase):
+    def setUp(self):
+        """设置测试环境"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = SqliteKVStore(os.path.join(self.tmp_dir.name, 'kv.db'))
+        self.events = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def elector(self, name: str) -> LeaderElector:
+        return LeaderElector('scheduler', on_elected=lambda: self.events.append(f'{name} elected'),
+                             on_lost=lambda: self.events.append(f'{name} lost'), store=self.store, ttl=30)
+
+    def test_single_leader_and_failover(self):
+        """测试同时只有一个进程当选，主进程释放租约后由其他进程接替"""
+        first, second = self.elector('first'), self.elector('second')
+        first.run_once()
+        second.run_once()
+        first.run_once()
+        self.assertTrue(first.is_leader)
+        self.assertFalse(second.is_leader)
+
+        first.stop()
+        second.run_once()
+        self.assertTrue(second.is_leader)
+        self.assertEqual(self.events, ['first elected', 'first lost', 'second elected'])
+
+    def test_lost_when_lease_taken_over(self):
+        """测试租约过期被其他进程获得后，原主进程续约失败并停止"""
+        first = self.elector('first')
+        first.run_once()
+        self.store.set(first.key, 'other-node', ttl=30)
+        first.run_once()
+        self.assertFalse(first.is_leader)
+        self.assertEqual(self.events, ['first elected', 'first lost'])
+
+    def test_competing_electors_after_lease_expired(self):
+        """测试租约过期被其他进程获得后，原主进程续约不会覆盖新主进程的租约"""
+        first = LeaderElector('scheduler', on_elected=lambda: self.events.append('first elected'),
+                              on_lost=lambda: self.events.append('first lost'), store=self.store, ttl=0.05)
+        second = self.elector('second')
+        first.run_once()
+        time.sleep(0.1)
+        second.run_once()
+        self.assertTrue(second.is_leader)
+
+        first.run_once()
+        self.assertFalse(first.is_leader)
+        self.assertEqual(self.store.get(first.key), second.owner)
+
+        first.stop()
+        self.assertEqual(self.store.get(first.key), second.owner)
+        self.assertEqual(self.events, ['first elected', 'second elected', 'first lost'])
+
+    def test_compare_and_set(self):
+        """测试只有值与预期一致时才写入或删除"""
+        self.store.set('lease', 'a', ttl=30)
+        self.assertFalse(self.store.compare_and_set('lease', 'b', 'c', ttl=30))
+        self.assertTrue(self.store.compare_and_set('lease', 'a', 'c', ttl=30))
+        self.assertFalse(self.store.compare_and_delete('lease', 'a'))
+        self.assertEqual(self.store.get('lease'), 'c')
+        self.assertTrue(self.store.compare_and_delete('lease', 'c'))
+        self.assertIsNone(self.store.get('lease'))
+
+
+if __name__ == '__main__':
+    main()
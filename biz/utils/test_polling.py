@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/19
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from biz.utils.polling import poll_until, ready_or_failed
+
+
+# @Describe:
+class TestPollUntil(TestCase):
+    def setUp(self):
+        """用假的 sleep 记录每次等待时间"""
+        self.sleeps = []
+        patcher = patch('biz.utils.polling.time.sleep', side_effect=self.sleeps.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetcher(self, results: list):
+        results = iter(results)
+        return lambda: next(results)
+
+    def test_ready_on_first_attempt(self):
+        """测试首次获取即就绪时不等待"""
+        self.assertEqual(poll_until(self.fetcher([['a']]), ready_or_failed, max_wait=30), ['a'])
+        self.assertEqual(self.sleeps, [])
+
+    def test_backoff_sequence_capped(self):
+        """测试等待间隔从 initial_delay 开始按 backoff_factor 增长，不超过 max_delay"""
+        results = [[]] * 5 + [['a.py']]
+        result = poll_until(self.fetcher(results), ready_or_failed, initial_delay=1, max_wait=100,
+                            backoff_factor=2, max_delay=5)
+        self.assertEqual(result, ['a.py'])
+        self.assertEqual(self.sleeps, [1, 2, 4, 5, 5])
+
+    def test_give_up_at_max_wait(self):
+        """测试总等待时间达到 max_wait 后停止轮询并返回最后一次结果，最后一次等待被截断"""
+        fetched = []
+
+        def fetch():
+            fetched.append(len(fetched))
+            return []
+
+        result = poll_until(fetch, ready_or_failed, initial_delay=1, max_wait=5, backoff_factor=2, max_delay=8)
+        self.assertEqual(result, [])
+        self.assertEqual(self.sleeps, [1, 2, 2])
+        self.assertEqual(sum(self.sleeps), 5)
+        self.assertEqual(len(fetched), 4)
+
+    def test_defaults_from_env(self):
+        """测试默认间隔和等待上限读取 CHANGES_READY_INITIAL_DELAY / CHANGES_READY_MAX_WAIT"""
+        with patch.dict('os.environ', {'CHANGES_READY_INITIAL_DELAY': '0.5', 'CHANGES_READY_MAX_WAIT': '1'}):
+            poll_until(self.fetcher([[], [], [], []]), ready_or_failed)
+        self.assertEqual(self.sleeps, [0.5, 0.5])
+
+    def test_failed_request_stops_polling(self):
+        """测试请求失败(None)时立即返回，不再重试"""
+        self.assertIsNone(poll_until(self.fetcher([None]), ready_or_failed, max_wait=30))
+        self.assertEqual(self.sleeps, [])
+
+    def test_ready_or_failed(self):
+        """测试 GitLab/GitHub/Gitea 获取变更时使用的就绪判断"""
+        self.assertTrue(ready_or_failed(None))
+        self.assertTrue(ready_or_failed([{'new_path': 'a.py'}]))
+        self.assertFalse(ready_or_failed([]))
+
+    def test_gitlab_first_page_predicate(self):
+        """测试 GitLab 第一页 (变更列表, 下一页) 结果：diff 未生成时返回空页继续轮询"""
+        pages = [([], None), ([], None), ([{'new_path': 'a.py'}], 2)]
+        result = poll_until(self.fetcher(pages), lambda page: page is None or ready_or_failed(page[0]),
+                            initial_delay=1, max_wait=30)
+        self.assertEqual(result, ([{'new_path': 'a.py'}], 2))
+        self.assertEqual(self.sleeps, [1, 2])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,6 @@
+import os
+from typing import Iterable
+
 import tiktoken
 
 
@@ -41,6 +44,38 @@ def truncate_text_by_tokens(text: str, max_tokens: int, encoding_name: str = "cl
 
     return text
 
+
+def take_changes_within_budget(changes: Iterable[dict], max_tokens: int = None, count_remaining: bool = True) -> tuple:
+    """
+    逐个消费变更，保留累计 token 数未超过 REVIEW_MAX_TOKENS 的文件用于 review；
+    超出预算后的文件只统计新增、删除行数，不再保留 diff 内容，内存占用与变更总量无关。
+
+    Args:
+        changes (Iterable[dict]): 经过过滤的变更，可以是生成器。
+        max_tokens (int): token 预算，默认取 REVIEW_MAX_TOKENS。
+        count_remaining (bool): 预算用完后是否继续消费剩余变更以统计行数；为False时立即停止，
+            按页获取的变更不再请求后续分页，新增、删除行数只包含已获取的文件。
+
+    Returns:
+        tuple: (保留的变更列表, 新增行数, 删除行数)。
+    """
+    if max_tokens is None:
+        max_tokens = int(os.getenv("REVIEW_MAX_TOKENS", 10000))
+    kept = []
+    used_tokens = 0
+    additions = 0
+    deletions = 0
+    for item in changes:
+        additions += item.get('additions', 0)
+        deletions += item.get('deletions', 0)
+        # 最后一个文件允许超出预算，由 review 时按 token 截断
+        if used_tokens < max_tokens:
+            kept.append(item)
+            used_tokens += count_tokens(str(item))
+        if used_tokens >= max_tokens and not count_remaining:
+            break
+    return kept, additions, deletions
+
 if __name__ == '__main__':
     text = "Hello, world! This is a test text for token counting."
     print(count_tokens(text))  # 输出：11